@@ -1,7 +1,9 @@
-from flask import Flask, Response, request
+from flask import Flask, Response, request, g
 from datetime import datetime
 import json
 import src.data_service.data_table_adaptor as dta
+import src.data_service.instrumentation as instrumentation
+import src.data_service.serializers as serializers
 import logging
 
 logging.basicConfig(level=logging.DEBUG)
@@ -11,6 +13,8 @@ logger.setLevel(logging.DEBUG)
 # The convention is that a compound primary key in a path has the elements separated by "_"
 # For example, /batting/willite01_BOS_1960_1 maps to the primary key for batting
 _key_delimiter = "_"
+# Several keys in one path are separated by ",", for example /people/willite01,aaronha01
+_multi_key_delimiter = ","
 _host = "127.0.0.1"
 _port = 5002
 _api_base = "/api"
@@ -69,17 +73,19 @@ def log_and_extract_input(method, path_params=None):
             if args.get(element, None) is not "":
                 a = args.get(element)
                 if list:
-                    a = a.split(",")
+                    # MySQL ignores whitespace around names, so fields=a,b\n still means column b.
+                    a = [x.strip() for x in a.split(",")]
             else:
                 a = None
             del args[element]
             inputs[element] = a
 
-    pull_args('fields', list=True)
-    pull_args('limit', list=False)
-    pull_args('offset', list=False)
-    log_message += " received: \n" + json.dumps(inputs, indent=2)
-    logger.debug(log_message)
+    for element, is_list in dta.reserved_query_params:
+        pull_args(element, list=is_list)
+    # Pretty printing the headers is expensive, so only build the message if DEBUG is on.
+    if logger.isEnabledFor(logging.DEBUG):
+        log_message += " received: \n" + json.dumps(inputs, indent=2)
+        logger.debug(log_message)
     return inputs
 
 
@@ -90,7 +96,41 @@ def log_response(path, rsp):
     :return:
     """
     msg = rsp
-    logger.debug(str(datetime.now()) + ": \n" + str(rsp))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(str(datetime.now()) + ": \n" + str(rsp))
+
+
+def to_json(res, links=None):
+    """
+    :param res: The result to send.
+    :param links: Optional paging links for a page of rows.
+    :return: res encoded in the format the client asked for with the format query parameter or the Accept
+        header (see serializers.encode). The time spent is recorded as the route's serialize phase.
+    """
+    started = instrumentation.start()
+    fmt = serializers.format_from_request(request.args.get('format', None), request.headers.get('Accept', None))
+    s = serializers.encode(res, fmt=fmt, links=links)
+    if started is not None:
+        instrumentation.observe("route", _route_name(), "serialize", started)
+    return s
+
+
+def _route_name():
+    rule = request.url_rule.rule if request.url_rule is not None else request.path
+    return request.method + " " + rule
+
+
+@application.before_request
+def start_request_timer():
+    g.instrumentation_started = instrumentation.start()
+
+
+@application.after_request
+def record_request_time(rsp):
+    started = g.get("instrumentation_started", None)
+    if started is not None:
+        instrumentation.observe("route", _route_name(), "total", started)
+    return rsp
 
 
 def get_field_list(inputs):
@@ -122,6 +162,92 @@ def health_check():
     return rsp
 
 
+@application.route("/health/pools", methods=["GET"])
+def pool_stats():
+    """
+    :return: Connection pool metrics, for sizing the pools against the number of workers.
+    """
+    rsp_str = json.dumps(dta.get_pool_stats())
+    rsp = Response(rsp_str, status=200, content_type="application/json")
+    return rsp
+
+
+@application.route("/health/replicas", methods=["GET"])
+def replica_stats():
+    """
+    :return: Read replica health and load, and the reads that went to the primary.
+    """
+    rsp_str = json.dumps(dta.get_replica_stats())
+    rsp = Response(rsp_str, status=200, content_type="application/json")
+    return rsp
+
+
+@application.route("/health/sql_cache", methods=["GET"])
+def sql_cache_stats():
+    """
+    :return: Hit/miss counters for the generated SQL text cache.
+    """
+    rsp_str = json.dumps(dta.get_sql_cache_stats())
+    rsp = Response(rsp_str, status=200, content_type="application/json")
+    return rsp
+
+
+@application.route("/health/result_cache", methods=["GET"])
+def result_cache_stats():
+    """
+    :return: Result cache usage, with hits, misses and bytes held per table, and how many misses were
+        coalesced into an identical query already in flight.
+    """
+    rsp_data = dta.get_result_cache_stats()
+    rsp_data["single_flight"] = dta.get_single_flight_stats()
+    rsp_str = json.dumps(rsp_data)
+    rsp = Response(rsp_str, status=200, content_type="application/json")
+    return rsp
+
+
+@application.route("/health/tables", methods=["GET"])
+def table_registry_stats():
+    """
+    :return: Size, evictions and build times of the cache of table objects.
+    """
+    rsp_str = json.dumps(dta.get_table_registry_stats())
+    rsp = Response(rsp_str, status=200, content_type="application/json")
+    return rsp
+
+
+@application.route("/admin/index_advisor", methods=["GET"])
+def index_advice():
+    """
+    :return: The template query shapes seen so far (columns, operators, sort), how often, their EXPLAIN plan, and
+        a suggested composite index where MySQL scans. Optional query parameters: min_count and table (db.table).
+        Each shape is explained against the database, so this is an admin call, not a health check.
+    """
+    try:
+        min_count = int(request.args.get("min_count", "1"))
+        res = dta.get_index_advice(min_count=min_count, table=request.args.get("table", None))
+        return Response(to_json(res), status=200, content_type="application/json")
+    except Exception as e:
+        return handle_error(e, None)
+
+
+@application.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    :return: Per route, per table and per statement latency histograms, the slow query log, and the pool and
+        cache statistics. Histograms are only collected when instrumentation is enabled.
+    """
+    rsp_data = instrumentation.snapshot()
+    rsp_data["pools"] = dta.get_pool_stats()
+    rsp_data["replicas"] = dta.get_replica_stats()
+    rsp_data["sql_cache"] = dta.get_sql_cache_stats()
+    rsp_data["result_cache"] = dta.get_result_cache_stats()
+    rsp_data["single_flight"] = dta.get_single_flight_stats()
+    rsp_data["change_log"] = dta.get_change_log_stats()
+    rsp_data["tables"] = dta.get_table_registry_stats()
+    rsp = Response(json.dumps(rsp_data), status=200, content_type="application/json")
+    return rsp
+
+
 @application.route("/demo/<parameter>/", methods=["GET", "PUT", "DELETE", "POST"])
 def demo(parameter):
     """
@@ -173,18 +299,24 @@ def resource_by_id(dbname, resource, primary_key):
         fields = context.get('fields', None)
         tbl = dta.get_rdb_table(resource, dbname)
         pks = primary_key.split(_key_delimiter)
+        if request.method == 'GET' and _multi_key_delimiter in primary_key:
+            # Multi-get, e.g. /batting/willite01_BOS_1960_1,aaronha01_ML1_1954_1
+            keys = [k.split(_key_delimiter) for k in primary_key.split(_multi_key_delimiter)]
+            res = tbl.find_by_primary_keys(keys, field_list=fields)
+            rsp = Response(to_json(res), status=200, content_type="application/json")
+            return rsp
         if request.method == 'GET':
             res = tbl.find_by_primary_key(pks, field_list=fields)
-            rsp = Response(json.dumps(res, default=str), status=200, content_type="application/json")
+            rsp = Response(to_json(res), status=200, content_type="application/json")
             return rsp
         elif request.method == 'DELETE':
             res = {"Entries Deleted": tbl.delete_by_key(pks)}
-            rsp = Response(json.dumps(res, default=str), status=200, content_type="application/json")
+            rsp = Response(to_json(res), status=200, content_type="application/json")
             return rsp
         elif request.method == 'PUT':
             entry = context.get('body')
             res = {"Entries Updated": tbl.update_by_key(pks, entry)}
-            rsp = Response(json.dumps(res, default=str), status=200, content_type="application/json")
+            rsp = Response(to_json(res), status=200, content_type="application/json")
             return rsp
         else:
             result = "Invalid request."
@@ -206,26 +338,53 @@ def get_resource(dbname, resource_name):
             limit = context.get('limit', '10')
             offset = context.get('offset', '0')
             base_url = context.get('base_url', None)
+            if 'export' in context:
+                return get_resource_export(tbl, context, queries, fields)
+            if 'stream' in context:
+                return get_resource_stream(tbl, context, queries, fields)
+            if 'cursor' in context:
+                return get_resource_keyset(tbl, context, queries, fields, limit, base_url)
+            order_by = context.get('order_by', None)
             s = "?"
             for k, v in queries.items():
                 s += k + "=" + v + "&"
+            if order_by is not None:
+                s += "order_by=" + ",".join(order_by) + "&"
             if fields is not None:
                 s += "fields="
                 for i in range(len(fields)):
                     s += fields[i]
                     if i < len(fields) - 1:
                         s += ","
+            if context.get('format', None) is not None:
+                s += "&format=" + context['format']
             s += "&limit=" + limit + "&offset="
             prev_url = base_url + s + str(max(0, int(offset) - int(limit)))
             next_url = base_url + s + str(int(offset) + int(limit))
-            res = tbl.find_by_template(template=queries, field_list=fields, limit=limit, offset=offset)
-            res.insert(0, {"prev_page": prev_url, "current_page": context.get("url"), "next_page": next_url})
-            rsp = Response(json.dumps(res, default=str), status=200, content_type="application/json")
+            # Filters such as yearID__gte=1990 and the sort order are applied by MySQL, see parse_query_template.
+            template = dta.parse_query_template(queries)
+            res = tbl.find_by_template(template=template, field_list=fields, limit=limit,
+                                       offset=offset, order_by=order_by)
+            links = {"prev_page": prev_url, "current_page": context.get("url"), "next_page": next_url}
+            headers = {}
+            total = get_total(tbl, template, context.get('count', None))
+            if total is not None and total["count"] is not None:
+                headers["X-Total-Count"] = str(total["count"])
+                headers["X-Total-Count-Estimated"] = "true" if total["estimated"] else "false"
+                if int(limit) > 0:
+                    last_offset = max(0, (total["count"] - 1) // int(limit) * int(limit))
+                    links["last_page"] = base_url + s + str(last_offset)
+            rsp = Response(to_json(res, links=links), status=200, content_type="application/json", headers=headers)
             return rsp
         elif request.method == 'POST':
             entry = context.get('body')
+            if type(entry) == list:
+                # A JSON array is a bulk load. Rows are inserted in batches, see RDBDataTable.insert_many.
+                res = tbl.insert_many(entry, batch_size=context.get('batch_size', None))
+                status = 200 if res["failed_index"] is None else 400
+                return Response(to_json(res), status=status, content_type="application/json")
             res = {"Entries Inserted": tbl.insert(new_record=entry)}
-            return Response(json.dumps(res, default=str), status=200, content_type="application/json")
+            return Response(to_json(res), status=200, content_type="application/json")
         else:
             result = "Invalid request."
             return result, 400, {'Content-Type': 'text/plain; charset=utf-8'}
@@ -234,25 +393,237 @@ def get_resource(dbname, resource_name):
         return handle_error(e, result)
 
 
+def get_total(tbl, template, count):
+    """
+    :param count: The count query parameter: 'exact', 'estimate', 'none', or None for exact on small results and
+        estimated on large ones.
+    :return: {"count": n, "estimated": bool} from tbl.count_by_template (cached per template), or None.
+    """
+    if count == "none":
+        return None
+    exact = {"exact": True, "estimate": False}.get(count, None)
+    return tbl.count_by_template(template, exact=exact)
+
+
+def get_resource_stream(tbl, context, queries, fields):
+    """
+    Streaming mode for get_resource, enabled with stream=json (a JSON array) or stream=ndjson (one JSON object
+    per line). Rows are encoded and sent chunk by chunk as they come off the server side cursor, so memory is
+    bounded by the chunk size rather than the result size. limit and offset are optional here. Rows are encoded
+    with serializers.to_json, as in paged responses.
+    stream_by_template validates the request and runs the statement before it returns, so errors are still
+    reported with a 400/504 status instead of breaking off a 200 response.
+    """
+    fmt = context.get('stream') or "json"
+    if fmt not in ("json", "ndjson"):
+        return "Invalid stream format.", 400, {'Content-Type': 'text/plain; charset=utf-8'}
+    chunks = tbl.stream_by_template(template=dta.parse_query_template(queries), field_list=fields,
+                                    limit=context.get('limit', None), offset=context.get('offset', None),
+                                    order_by=context.get('order_by', None))
+
+    def generate_ndjson():
+        for rows in chunks:
+            yield "".join([serializers.to_json(r) + "\n" for r in rows])
+
+    def generate_json():
+        yield "["
+        first = True
+        for rows in chunks:
+            s = ",".join([serializers.to_json(r) for r in rows])
+            if not first:
+                s = "," + s
+            first = False
+            yield s
+        yield "]"
+
+    if fmt == "ndjson":
+        return Response(generate_ndjson(), status=200, content_type="application/x-ndjson")
+    return Response(generate_json(), status=200, content_type="application/json")
+
+
+def get_resource_export(tbl, context, queries, fields):
+    """
+    Columnar export for get_resource, enabled with export=arrow, export=parquet or export=npz. The whole
+    match is sent unless limit/offset are given. export_by_template runs the statement before it returns, so a bad
+    request gets an error status rather than a cut off file.
+    """
+    fmt = context.get('export') or "arrow"
+    if fmt not in dta.get_export_formats():
+        return "Unsupported export format. Available: " + ",".join(dta.get_export_formats()), 400, \
+            {'Content-Type': 'text/plain; charset=utf-8'}
+    chunks = tbl.export_by_template(template=dta.parse_query_template(queries), field_list=fields,
+                                    limit=context.get('limit', None), offset=context.get('offset', None),
+                                    order_by=context.get('order_by', None), fmt=fmt)
+    return Response(chunks, status=200, content_type=dta.get_export_content_type(fmt))
+
+
+def get_resource_keyset(tbl, context, queries, fields, limit, base_url):
+    """
+    Keyset paging for get_resource. Enabled by passing cursor= (empty for the first page). The next_page link
+    carries an opaque token holding the last primary key seen instead of an offset. Pages are in primary key
+    order; any other order_by is a 400.
+    """
+    res, next_token = tbl.find_by_template_keyset(template=dta.parse_query_template(queries), field_list=fields,
+                                                  limit=limit, page_token=context.get('cursor'),
+                                                  order_by=context.get('order_by', None))
+    s = "?"
+    for k, v in queries.items():
+        s += k + "=" + v + "&"
+    if fields is not None:
+        s += "fields=" + ",".join(fields) + "&"
+    if context.get('format', None) is not None:
+        s += "format=" + context['format'] + "&"
+    s += "limit=" + limit + "&cursor="
+    next_url = None
+    if next_token is not None:
+        next_url = base_url + s + next_token
+    links = {"current_page": context.get("url"), "next_page": next_url}
+    rsp = Response(to_json(res, links=links), status=200, content_type="application/json")
+    return rsp
+
+
+@application.route('/api/<dbname>/<resource_name>/_batch', methods=['POST'])
+def batch_by_keys(dbname, resource_name):
+    """
+    Bulk update/delete by key list. The body is one of
+        {"delete": [key, ...]}
+        {"update": [key, ...], "values": {...}}                     (same new values for every key)
+        {"update": [{"key": key, "values": {...}}, ...]}             (per key values)
+    where a key is a list of key column values or a "col1_col2_..." string. Optional "chunk_size" and
+    "commit_interval" (chunks per commit) tune the batching.
+    :return: Affected rows in total and per chunk, see RDBDataTable.update_by_keys/delete_by_keys.
+    """
+    result = None
+    try:
+        context = log_and_extract_input(batch_by_keys, (dbname, resource_name))
+        tbl = dta.get_rdb_table(resource_name, dbname)
+        body = context.get('body')
+        if type(body) != dict or ("delete" in body) == ("update" in body):
+            result = "Body must contain exactly one of delete or update."
+            return result, 400, {'Content-Type': 'text/plain; charset=utf-8'}
+
+        def to_key(k):
+            return k.split(_key_delimiter) if type(k) == str else k
+
+        chunk_size, commit_interval = dta.batch_options(body)
+        if "delete" in body:
+            res = tbl.delete_by_keys([to_key(k) for k in body["delete"]], chunk_size=chunk_size,
+                                     commit_interval=commit_interval)
+        else:
+            updates = body["update"]
+            if "values" in body:
+                keys = [to_key(k) for k in updates]
+                new_values = body["values"]
+            else:
+                keys = [to_key(u["key"]) for u in updates]
+                new_values = [u["values"] for u in updates]
+            res = tbl.update_by_keys(keys, new_values, chunk_size=chunk_size, commit_interval=commit_interval)
+        status = 200 if res["error"] is None else 400
+        return Response(to_json(res), status=status, content_type="application/json")
+    except Exception as e:
+        print("Exception e = ", e)
+        return handle_error(e, result)
+
+
+@application.route('/api/<dbname>/<resource_name>/_aggregate', methods=['GET'])
+def get_aggregate(dbname, resource_name):
+    """
+    Server side aggregation, e.g.
+        /api/lahman2019clean/batting/_aggregate?group_by=teamID,yearID&agg=sum:HR,count:*&yearID__gte=2000
+            &order_by=-sum_HR&limit=10
+    agg is a list of function:column with the functions count, count_distinct, sum, avg, min and max. Other query
+    parameters filter the rows first, as for get_resource.
+    :return: One row per group with the group columns and the aggregates (named e.g. sum_HR, count).
+    """
+    result = None
+    try:
+        context = log_and_extract_input(get_aggregate, (dbname, resource_name))
+        tbl = dta.get_rdb_table(resource_name, dbname)
+        template = dta.parse_query_template(context.get('query_params', None) or {})
+        res = tbl.aggregate_by_template(template, group_by=context.get('group_by', None),
+                                        aggregates=context.get('agg', None), order_by=context.get('order_by', None),
+                                        limit=context.get('limit', None), offset=context.get('offset', None))
+        return Response(to_json(res), status=200, content_type="application/json")
+    except Exception as e:
+        print("Exception e = ", e)
+        return handle_error(e, result)
+
+
+@application.route('/api/<dbname>/<resource_name>/_changes', methods=['GET'])
+def get_changes(dbname, resource_name):
+    """
+    Incremental sync. Query parameters:
+        since: the next value from the previous response (0 or absent the first time)
+        epoch: the epoch from the previous response
+        limit: maximum number of change log entries (default 1000)
+        rows=true: include the current row for each inserted or updated key
+        fields: columns of the included rows
+    :return: {"epoch", "since", "next", "reset", "has_more", "changes": [{"seq", "op", "key", "time", "row"}]}.
+        If reset is true the consumer must re-read the table and then continue from next.
+    """
+    result = None
+    try:
+        context = log_and_extract_input(get_changes, (dbname, resource_name))
+        queries = context.get('query_params', None) or {}
+        tbl = dta.get_rdb_table(resource_name, dbname)
+        res = tbl.changes_since(queries.get('since', None) or 0, epoch=queries.get('epoch', None),
+                                limit=context.get('limit', None) or 1000,
+                                include_rows=queries.get('rows', "false").lower() == "true",
+                                field_list=context.get('fields', None))
+        return Response(to_json(res), status=200, content_type="application/json")
+    except Exception as e:
+        print("Exception e = ", e)
+        return handle_error(e, result)
+
+
 @application.route('/api/<dbname>/<parent_name>/<primary_key>/<target_name>', methods=['GET'])
 def get_by_path(dbname, parent_name, primary_key, target_name):
-    # Do not implement
-    result = " -- THANK ALY AND ARA -- "
-    return result, 501, {'Content-Type': 'application/json; charset=utf-8'}
+    """
+    :return: The rows of target_name related to the parent_name row with key primary_key, e.g.
+        /api/lahman2019clean/people/willite01/batting. Query parameters filter the target like for get_resource.
+        The parent and target are read in one statement.
+    """
+    result = None
+    try:
+        context = log_and_extract_input(get_by_path, (dbname, parent_name, primary_key, target_name))
+        tbl = dta.get_rdb_table(parent_name, dbname)
+        pks = primary_key.split(_key_delimiter)
+        template = dta.parse_query_template(context.get('query_params', None) or {})
+        res = tbl.navigate_path(pks, target_name, template, context.get('fields', None),
+                                limit=context.get('limit', None), offset=context.get('offset', None),
+                                order_by=context.get('order_by', None))
+        return Response(to_json(res), status=200, content_type="application/json")
+    except Exception as e:
+        print("Exception e = ", e)
+        return handle_error(e, result)
 
 
 @application.route('/api/<dbname>/<parent_name>/<primary_key>/<target_name>/<target_key>',
                    methods=['GET'])
 def get_by_path_key(dbname, parent_name, primary_key, target_name, target_key):
-    # Do not implement
-    result = " -- THANK ALY AND ARA -- "
-
-    return result, 501, {'Content-Type': 'application/json; charset=utf-8'}
+    """
+    :return: The target_name row with key target_key, if it is related to the parent_name row with key
+        primary_key.
+    """
+    result = None
+    try:
+        context = log_and_extract_input(get_by_path_key, (dbname, parent_name, primary_key, target_name, target_key))
+        tbl = dta.get_rdb_table(parent_name, dbname)
+        res = tbl.navigate_path_and_key(primary_key.split(_key_delimiter), target_name,
+                                        target_key.split(_key_delimiter), context.get('fields', None))
+        if res is None:
+            return "Not found.", 404, {'Content-Type': 'text/plain; charset=utf-8'}
+        return Response(to_json(res), status=200, content_type="application/json")
+    except Exception as e:
+        print("Exception e = ", e)
+        return handle_error(e, result)
 
 
 # You can ignore this method.
 def handle_error(e, result):
-    return "Internal error.", 504, {'Content-Type': 'text/plain; charset=utf-8'}
+    # The status comes from dta.error_status, which async_app.py uses too: 400 for bad input, 504 otherwise.
+    status, msg = dta.error_status(e)
+    return msg, status, {'Content-Type': 'text/plain; charset=utf-8'}
 
 
 if __name__ == "__main__":
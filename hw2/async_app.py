@@ -0,0 +1,316 @@
+from datetime import datetime
+from urllib.parse import parse_qs
+import json
+import logging
+import src.data_service.async_data_table_adaptor as adta
+import src.data_service.serializers as serializers
+
+# Async (ASGI) version of the data service routes in app.py. Same URL scheme and JSON shapes, but requests are
+# coroutines, so a single process can keep many requests waiting on the database without a thread per request.
+# Streaming (stream=) and columnar export (export=) are only served by app.py.
+# Run with any ASGI server, for example:
+#   uvicorn async_app:application --port 5003
+logger = logging.getLogger()
+
+_key_delimiter = "_"
+_multi_key_delimiter = ","
+_api_base = "/api"
+
+
+class Request:
+    """
+    The parts of an ASGI HTTP request that the routes need, in the same form log_and_extract_input gives app.py.
+    """
+
+    def __init__(self, scope, body):
+        self.method = scope["method"]
+        self.path = scope["path"]
+        qs = scope.get("query_string", b"").decode("utf-8")
+        # Same flattening as app.handle_args: x=y arrives as {'x': ['y']} and becomes {'x': 'y'}.
+        self.args = {k: v[0] for k, v in parse_qs(qs, keep_blank_values=True).items()}
+        host = "localhost"
+        self.accept = None
+        for k, v in scope.get("headers", []):
+            if k == b"host":
+                host = v.decode("latin-1")
+            elif k == b"accept":
+                self.accept = v.decode("latin-1")
+        self.base_url = scope.get("scheme", "http") + "://" + host + self.path
+        self.url = self.base_url + ("?" + qs if qs else "")
+        self.body = None
+        if body:
+            try:
+                self.body = json.loads(body.decode("utf-8"))
+            except Exception:
+                self.body = "You sent something but I could not get JSON out of it."
+        # The reserved query parameters (fields, limit, format, ...), removed from args like pull_args in app.py.
+        # A parameter sent empty is present with the value None.
+        self.params = {}
+        for element, is_list in adta.reserved_query_params:
+            if element in self.args:
+                self.params[element] = self.pull_arg(element, is_list=is_list)
+
+    def pull_arg(self, element, is_list=False, default=None):
+        """
+        Removes element from the query parameters and returns it, like pull_args in app.py.
+        """
+        if element not in self.args:
+            return default
+        a = self.args.pop(element)
+        if a == "":
+            return None
+        if is_list:
+            a = [x.strip() for x in a.split(",")]
+        return a
+
+
+def json_response(req, data, status=200, links=None, headers=None):
+    """
+    :return: data encoded like app.to_json: JSON, or the columnar format if the format query parameter or the Accept
+        header asks for it.
+    """
+    fmt = serializers.format_from_request(req.params.get("format", None), req.accept)
+    return status, "application/json", serializers.encode(data, fmt=fmt, links=links), headers
+
+
+def text_response(text, status):
+    return status, "text/plain; charset=utf-8", text, None
+
+
+async def dbs(req):
+    return json_response(req, await adta.get_databases())
+
+
+async def tbls(req, dbname):
+    return json_response(req, await adta.get_tables(dbname))
+
+
+async def resource_by_id(req, dbname, resource, primary_key):
+    fields = req.params.get("fields", None)
+    tbl = await adta.get_rdb_table(resource, dbname)
+    pks = primary_key.split(_key_delimiter)
+    if req.method == "GET" and _multi_key_delimiter in primary_key:
+        keys = [k.split(_key_delimiter) for k in primary_key.split(_multi_key_delimiter)]
+        return json_response(req, await tbl.find_by_primary_keys(keys, field_list=fields))
+    if req.method == "GET":
+        return json_response(req, await tbl.find_by_primary_key(pks, field_list=fields))
+    elif req.method == "DELETE":
+        return json_response(req, {"Entries Deleted": await tbl.delete_by_key(pks)})
+    elif req.method == "PUT":
+        return json_response(req, {"Entries Updated": await tbl.update_by_key(pks, req.body)})
+    return text_response("Invalid request.", 400)
+
+
+async def get_resource(req, dbname, resource_name):
+    tbl = await adta.get_rdb_table(resource_name, dbname)
+    if req.method == "GET":
+        if "stream" in req.params or "export" in req.params:
+            return text_response("stream and export are served by app.py, not the async app.", 400)
+        fields = req.params.get("fields", None)
+        order_by = req.params.get("order_by", None)
+        limit = req.params.get("limit", "10")
+        offset = req.params.get("offset", "0")
+        fmt = req.params.get("format", None)
+        queries = req.args
+        template = adta.parse_query_template(queries)
+        if "cursor" in req.params:
+            return await get_resource_keyset(req, tbl, template, queries, fields, limit)
+        s = "?"
+        for k, v in queries.items():
+            s += k + "=" + v + "&"
+        if order_by is not None:
+            s += "order_by=" + ",".join(order_by) + "&"
+        if fields is not None:
+            s += "fields=" + ",".join(fields)
+        if fmt is not None:
+            s += "&format=" + fmt
+        s += "&limit=" + limit + "&offset="
+        prev_url = req.base_url + s + str(max(0, int(offset) - int(limit)))
+        next_url = req.base_url + s + str(int(offset) + int(limit))
+        res = await tbl.find_by_template(template, field_list=fields, limit=limit, offset=offset,
+                                         order_by=order_by)
+        links = {"prev_page": prev_url, "current_page": req.url, "next_page": next_url}
+        headers = None
+        total = await get_total(tbl, template, req.params.get("count", None))
+        if total is not None and total["count"] is not None:
+            headers = {"X-Total-Count": str(total["count"]),
+                       "X-Total-Count-Estimated": "true" if total["estimated"] else "false"}
+            if int(limit) > 0:
+                last_offset = max(0, (total["count"] - 1) // int(limit) * int(limit))
+                links["last_page"] = req.base_url + s + str(last_offset)
+        return json_response(req, res, links=links, headers=headers)
+    elif req.method == "POST":
+        if type(req.body) == list:
+            res = await tbl.insert_many(req.body, batch_size=req.params.get("batch_size", None))
+            return json_response(req, res, 200 if res["failed_index"] is None else 400)
+        return json_response(req, {"Entries Inserted": await tbl.insert(req.body)})
+    return text_response("Invalid request.", 400)
+
+
+async def get_total(tbl, template, count):
+    """
+    :return: As app.get_total.
+    """
+    if count == "none":
+        return None
+    exact = {"exact": True, "estimate": False}.get(count, None)
+    return await tbl.count_by_template(template, exact=exact)
+
+
+async def get_resource_keyset(req, tbl, template, queries, fields, limit):
+    res, next_token = await tbl.find_by_template_keyset(template, field_list=fields, limit=limit,
+                                                        page_token=req.params.get("cursor", None),
+                                                        order_by=req.params.get("order_by", None))
+    s = "?"
+    for k, v in queries.items():
+        s += k + "=" + v + "&"
+    if fields is not None:
+        s += "fields=" + ",".join(fields) + "&"
+    if req.params.get("format", None) is not None:
+        s += "format=" + req.params["format"] + "&"
+    s += "limit=" + limit + "&cursor="
+    next_url = None
+    if next_token is not None:
+        next_url = req.base_url + s + next_token
+    return json_response(req, res, links={"current_page": req.url, "next_page": next_url})
+
+
+async def batch_by_keys(req, dbname, resource_name):
+    """
+    As app.batch_by_keys.
+    """
+    tbl = await adta.get_rdb_table(resource_name, dbname)
+    body = req.body
+    if type(body) != dict or ("delete" in body) == ("update" in body):
+        return text_response("Body must contain exactly one of delete or update.", 400)
+
+    def to_key(k):
+        return k.split(_key_delimiter) if type(k) == str else k
+
+    chunk_size, commit_interval = adta.batch_options(body)
+    if "delete" in body:
+        res = await tbl.delete_by_keys([to_key(k) for k in body["delete"]], chunk_size=chunk_size,
+                                       commit_interval=commit_interval)
+    else:
+        updates = body["update"]
+        if "values" in body:
+            keys = [to_key(k) for k in updates]
+            new_values = body["values"]
+        else:
+            keys = [to_key(u["key"]) for u in updates]
+            new_values = [u["values"] for u in updates]
+        res = await tbl.update_by_keys(keys, new_values, chunk_size=chunk_size, commit_interval=commit_interval)
+    return json_response(req, res, 200 if res["error"] is None else 400)
+
+
+async def get_aggregate(req, dbname, resource_name):
+    """
+    As app.get_aggregate.
+    """
+    tbl = await adta.get_rdb_table(resource_name, dbname)
+    template = adta.parse_query_template(req.args)
+    res = await tbl.aggregate_by_template(template, group_by=req.params.get("group_by", None),
+                                          aggregates=req.params.get("agg", None),
+                                          order_by=req.params.get("order_by", None),
+                                          limit=req.params.get("limit", None), offset=req.params.get("offset", None))
+    return json_response(req, res)
+
+
+async def get_changes(req, dbname, resource_name):
+    """
+    As app.get_changes.
+    """
+    tbl = await adta.get_rdb_table(resource_name, dbname)
+    res = await tbl.changes_since(req.args.get("since", None) or 0, epoch=req.args.get("epoch", None),
+                                  limit=req.params.get("limit", None) or 1000,
+                                  include_rows=req.args.get("rows", "false").lower() == "true",
+                                  field_list=req.params.get("fields", None))
+    return json_response(req, res)
+
+
+async def get_by_path(req, dbname, parent_name, primary_key, target_name):
+    """
+    As app.get_by_path.
+    """
+    tbl = await adta.get_rdb_table(parent_name, dbname)
+    template = adta.parse_query_template(req.args)
+    res = await tbl.navigate_path(primary_key.split(_key_delimiter), target_name, template,
+                                  req.params.get("fields", None), limit=req.params.get("limit", None),
+                                  offset=req.params.get("offset", None), order_by=req.params.get("order_by", None))
+    return json_response(req, res)
+
+
+async def get_by_path_key(req, dbname, parent_name, primary_key, target_name, target_key):
+    """
+    As app.get_by_path_key.
+    """
+    tbl = await adta.get_rdb_table(parent_name, dbname)
+    res = await tbl.navigate_path_and_key(primary_key.split(_key_delimiter), target_name,
+                                          target_key.split(_key_delimiter), req.params.get("fields", None))
+    if res is None:
+        return text_response("Not found.", 404)
+    return json_response(req, res)
+
+
+async def route(req):
+    """
+    :return: (status, content type, body, extra headers or None) for the request.
+    """
+    if req.path in ("/health", "/health/"):
+        return json_response(req, {"status": "healthy", "time": str(datetime.now())})
+    if not req.path.startswith(_api_base + "/"):
+        return text_response("Not found.", 404)
+    parts = [p for p in req.path[len(_api_base) + 1:].split("/") if p != ""]
+    if parts[:1] == ["databases"] and len(parts) <= 2 and req.method == "GET":
+        if len(parts) == 1:
+            return await dbs(req)
+        return await tbls(req, parts[1])
+    if len(parts) == 2 and req.method in ("GET", "POST"):
+        return await get_resource(req, parts[0], parts[1])
+    if len(parts) == 3 and parts[2] == "_batch" and req.method == "POST":
+        return await batch_by_keys(req, parts[0], parts[1])
+    if len(parts) == 3 and parts[2] == "_aggregate" and req.method == "GET":
+        return await get_aggregate(req, parts[0], parts[1])
+    if len(parts) == 3 and parts[2] == "_changes" and req.method == "GET":
+        return await get_changes(req, parts[0], parts[1])
+    if len(parts) == 3 and req.method in ("GET", "PUT", "DELETE"):
+        return await resource_by_id(req, parts[0], parts[1], parts[2])
+    if len(parts) == 4 and req.method == "GET":
+        return await get_by_path(req, parts[0], parts[1], parts[2], parts[3])
+    if len(parts) == 5 and req.method == "GET":
+        return await get_by_path_key(req, parts[0], parts[1], parts[2], parts[3], parts[4])
+    return text_response("Not found.", 404)
+
+
+async def application(scope, receive, send):
+    """
+    The ASGI entry point.
+    """
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body", False):
+            break
+    try:
+        status, content_type, text, headers = await route(Request(scope, body))
+    except Exception as e:
+        logger.error(str(datetime.now()) + ": async request failed: " + str(e))
+        # Same statuses as app.handle_error: 400 for bad input, 504 otherwise.
+        status, msg = adta.error_status(e)
+        status, content_type, text, headers = text_response(msg, status)
+    raw_headers = [(b"content-type", content_type.encode("latin-1"))]
+    for k, v in (headers or {}).items():
+        raw_headers.append((k.lower().encode("latin-1"), v.encode("latin-1")))
+    await send({"type": "http.response.start", "status": status, "headers": raw_headers})
+    await send({"type": "http.response.body", "body": text.encode("utf-8")})
@@ -0,0 +1,273 @@
+"""
+Benchmarks for the data service (RDBDataTable) and the REST layer (app.py through the Flask test client).
+
+Seeds a synthetic Lahman shaped schema (people, batting) into a local MySQL, times each operation and writes
+machine readable JSON so that runs can be compared across commits:
+
+    python benchmark/run_benchmarks.py --password simplex78 --out before.json
+    ... change something ...
+    python benchmark/run_benchmarks.py --password simplex78 --skip-seed --out after.json
+    python benchmark/run_benchmarks.py --compare before.json after.json
+
+Run from the hw2 directory so that src and app import.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pymysql
+import src.data_service.RDBDataTable as RDBDataTable
+import src.data_service.data_table_adaptor as dta
+import src.data_service.result_cache as result_cache
+
+_teams = ["BOS", "NYA", "CHN", "SLN", "DET", "CLE", "PHI", "PIT", "CIN", "BRO", "LAN", "SFN"]
+_countries = ["USA", "D.R.", "Venezuela", "CAN", "Cuba", "P.R.", "Mexico", "Japan"]
+
+_people_ddl = """
+create table if not exists people (
+    playerID varchar(12) not null,
+    nameFirst varchar(64), nameLast varchar(64),
+    birthYear int, birthMonth int, birthDay int, birthCountry varchar(32),
+    weight int, height int, bats char(1), throws char(1),
+    primary key (playerID)
+)"""
+
+_batting_ddl = """
+create table if not exists batting (
+    playerID varchar(12) not null, teamID varchar(3) not null, yearID int not null, stint int not null,
+    G int, AB int, R int, H int, HR int, RBI int, SB int, BB int, SO int,
+    primary key (playerID, teamID, yearID, stint)
+)"""
+
+
+def player_id(i):
+    return "p" + str(i).zfill(8)
+
+
+def percentile(sorted_values, p):
+    if len(sorted_values) == 0:
+        return None
+    i = min(len(sorted_values) - 1, int(round(p / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[i]
+
+
+def seed(connect_info, db_name, n_people, stints_per_player):
+    """
+    Drops and recreates db_name and fills it with n_people players and n_people * stints_per_player batting rows.
+    Rows are loaded with RDBDataTable.insert_many.
+    """
+    cnx = pymysql.connect(**connect_info)
+    cur = cnx.cursor()
+    cur.execute("drop database if exists " + db_name)
+    cur.execute("create database " + db_name)
+    cur.execute("use " + db_name)
+    cur.execute(_people_ddl)
+    cur.execute(_batting_ddl)
+    cnx.commit()
+    cnx.close()
+
+    rnd = random.Random(4111)
+    people = dta.get_rdb_table("people", db_name)
+    batting = dta.get_rdb_table("batting", db_name)
+    rows = []
+    for i in range(n_people):
+        rows.append({"playerID": player_id(i), "nameFirst": "First" + str(i % 997), "nameLast": "Last" + str(i),
+                     "birthYear": 1850 + i % 150, "birthMonth": 1 + i % 12, "birthDay": 1 + i % 28,
+                     "birthCountry": _countries[i % len(_countries)], "weight": rnd.randint(150, 260),
+                     "height": rnd.randint(64, 80), "bats": "R", "throws": "L"})
+    res = people.insert_many(rows, batch_size=2000)
+    if res["failed_index"] is not None:
+        raise RuntimeError("Seeding people failed: " + str(res["error"]))
+    rows = []
+    for i in range(n_people):
+        for stint in range(stints_per_player):
+            rows.append({"playerID": player_id(i), "teamID": _teams[(i + stint) % len(_teams)],
+                         "yearID": 1871 + (i + stint) % 148, "stint": stint + 1, "G": rnd.randint(1, 162),
+                         "AB": rnd.randint(0, 650), "R": rnd.randint(0, 120), "H": rnd.randint(0, 220),
+                         "HR": rnd.randint(0, 60), "RBI": rnd.randint(0, 150), "SB": rnd.randint(0, 80),
+                         "BB": rnd.randint(0, 150), "SO": rnd.randint(0, 200)})
+    res = batting.insert_many(rows, batch_size=2000)
+    if res["failed_index"] is not None:
+        raise RuntimeError("Seeding batting failed: " + str(res["error"]))
+
+
+def measure(name, layer, op, iterations, warmup):
+    """
+    :param op: A function of the iteration number that performs one operation.
+    :return: A result dictionary with throughput and latency percentiles in milliseconds.
+    """
+    for i in range(warmup):
+        op(i)
+    latencies = []
+    start = time.perf_counter()
+    for i in range(warmup, warmup + iterations):
+        t0 = time.perf_counter()
+        op(i)
+        latencies.append((time.perf_counter() - t0) * 1000.0)
+    total = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "name": name,
+        "layer": layer,
+        "ops": iterations,
+        "total_s": round(total, 6),
+        "throughput_ops_s": round(iterations / total, 3) if total > 0 else None,
+        "mean_ms": round(sum(latencies) / len(latencies), 4),
+        "p50_ms": round(percentile(latencies, 50), 4),
+        "p99_ms": round(percentile(latencies, 99), 4),
+        "max_ms": round(latencies[-1], 4)
+    }
+
+
+def direct_benchmarks(db_name, n_people, iterations, warmup):
+    people = dta.get_rdb_table("people", db_name)
+    rnd = random.Random(1)
+    deep_offset = max(0, n_people - 20)
+    n = warmup + iterations
+    new_ids = ["bench" + str(i).zfill(7) for i in range(n)]
+    return [
+        ("pk_get", lambda i: people.find_by_primary_key([player_id(rnd.randrange(n_people))])),
+        ("template_search", lambda i: people.find_by_template({"birthYear": str(1850 + i % 150),
+                                                               "birthMonth": str(1 + i % 12)}, limit=10)),
+        ("deep_offset_page", lambda i: people.find_by_template({}, limit=10, offset=deep_offset - i % 100)),
+        ("deep_keyset_page", lambda i: people.find_by_template_keyset(
+            {}, limit=10, page_token=people.encode_page_token([player_id(deep_offset - i % 100)]))),
+        ("insert", lambda i: people.insert({"playerID": new_ids[i], "nameFirst": "Bench", "nameLast": str(i)})),
+        ("update", lambda i: people.update_by_key([new_ids[i]], {"nameLast": "Updated" + str(i)})),
+        ("delete", lambda i: people.delete_by_key([new_ids[i]]))
+    ]
+
+
+def rest_benchmarks(db_name, n_people, iterations, warmup):
+    import app
+    # app.py turns on DEBUG logging at import. Put it back so the numbers are not dominated by log output.
+    logging.getLogger().setLevel(logging.WARNING)
+    client = app.application.test_client()
+    base = "/api/" + db_name + "/people"
+    rnd = random.Random(2)
+    deep_offset = max(0, n_people - 20)
+    n = warmup + iterations
+    new_ids = ["rest" + str(i).zfill(8) for i in range(n)]
+
+    def check(rsp):
+        if rsp.status_code != 200:
+            raise RuntimeError("HTTP " + str(rsp.status_code) + ": " + rsp.get_data(as_text=True)[:200])
+
+    return [
+        ("pk_get", lambda i: check(client.get(base + "/" + player_id(rnd.randrange(n_people))))),
+        ("template_search", lambda i: check(client.get(base + "?birthYear=" + str(1850 + i % 150) +
+                                                       "&birthMonth=" + str(1 + i % 12) + "&limit=10"))),
+        ("deep_offset_page", lambda i: check(client.get(base + "?limit=10&offset=" + str(deep_offset - i % 100)))),
+        ("insert", lambda i: check(client.post(base, json={"playerID": new_ids[i], "nameFirst": "Rest",
+                                                           "nameLast": str(i)}))),
+        ("update", lambda i: check(client.put(base + "/" + new_ids[i], json={"nameLast": "Updated" + str(i)}))),
+        ("delete", lambda i: check(client.delete(base + "/" + new_ids[i])))
+    ]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def compare(old_file, new_file):
+    """
+    Prints the change in throughput and p50/p99 latency for every benchmark present in both files.
+    """
+    with open(old_file) as f:
+        old = {(r["layer"], r["name"]): r for r in json.load(f)["results"]}
+    with open(new_file) as f:
+        new = {(r["layer"], r["name"]): r for r in json.load(f)["results"]}
+    print("%-8s %-18s %14s %14s %14s" % ("layer", "name", "throughput", "p50", "p99"))
+    for key in sorted(new.keys()):
+        if key not in old:
+            continue
+        o, n = old[key], new[key]
+
+        def delta(field):
+            if not o[field] or n[field] is None:
+                return "n/a"
+            return "%+.1f%%" % ((n[field] - o[field]) / o[field] * 100.0)
+
+        print("%-8s %-18s %14s %14s %14s" % (key[0], key[1], delta("throughput_ops_s"), delta("p50_ms"),
+                                             delta("p99_ms")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the data service and REST layer.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3306)
+    parser.add_argument("--user", default="root")
+    parser.add_argument("--password", default="")
+    parser.add_argument("--db", default="perfbench", help="Database to (re)create and benchmark against.")
+    parser.add_argument("--people", type=int, default=20000, help="Number of synthetic players.")
+    parser.add_argument("--stints", type=int, default=5, help="Batting rows per player.")
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--skip-seed", action="store_true", help="Reuse the data from a previous run.")
+    parser.add_argument("--result-cache", action="store_true",
+                        help="Leave the result cache on. By default it is off so that every call reaches MySQL.")
+    parser.add_argument("--layers", default="direct,rest", help="Comma separated: direct, rest.")
+    parser.add_argument("--out", default=None, help="Write JSON results here instead of stdout.")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two result files and exit.")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args.compare[0], args.compare[1])
+        return
+
+    # Point the adaptor (and so app.py) at the benchmark server.
+    dta._default_connect_info.update({"host": args.host, "port": args.port, "user": args.user,
+                                      "password": args.password})
+    if not args.result_cache:
+        RDBDataTable.RDBDataTable._result_cache = result_cache.ResultCache(max_bytes=0)
+
+    if not args.skip_seed:
+        t0 = time.perf_counter()
+        seed({"host": args.host, "port": args.port, "user": args.user, "password": args.password},
+             args.db, args.people, args.stints)
+        print("Seeded " + args.db + " in " + str(round(time.perf_counter() - t0, 2)) + "s", file=sys.stderr)
+
+    layers = args.layers.split(",")
+    results = []
+    if "direct" in layers:
+        for name, op in direct_benchmarks(args.db, args.people, args.iterations, args.warmup):
+            results.append(measure(name, "direct", op, args.iterations, args.warmup))
+    if "rest" in layers:
+        for name, op in rest_benchmarks(args.db, args.people, args.iterations, args.warmup):
+            results.append(measure(name, "rest", op, args.iterations, args.warmup))
+
+    output = {
+        "meta": {
+            "commit": git_commit(),
+            "time": str(datetime.now()),
+            "python": platform.python_version(),
+            "people": args.people,
+            "batting": args.people * args.stints,
+            "iterations": args.iterations,
+            "warmup": args.warmup,
+            "result_cache": args.result_cache
+        },
+        "results": results
+    }
+    s = json.dumps(output, indent=2)
+    if args.out is None:
+        print(s)
+    else:
+        with open(args.out, "w") as f:
+            f.write(s)
+
+
+if __name__ == "__main__":
+    main()
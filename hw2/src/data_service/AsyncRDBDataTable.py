@@ -0,0 +1,123 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import src.data_service.RDBDataTable as RDBDataTable
+import src.data_service.data_table_adaptor as dta
+
+# PyMySQL is blocking, so the async data service runs each database call on this executor. Coroutines waiting on
+# it hold no thread, so an event loop can keep many more requests in flight than there are threads. The number of
+# workers only bounds how many statements run at once, and the connection pool bounds that anyway.
+_max_workers = 32
+_executor = None
+
+
+def get_executor():
+    """
+    :return: The shared executor used for blocking database calls, created on first use.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=_max_workers, thread_name_prefix="rdb")
+    return _executor
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """
+    :param fn: A blocking function.
+    :return: The result of fn(*args, **kwargs), computed on the shared executor.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(fn, *args, **kwargs))
+
+
+class AsyncRDBDataTable:
+    """
+    Async counterpart of RDBDataTable. It wraps an RDBDataTable, so it shares the connection pool, SQL cache and
+    result cache with the synchronous app, and exposes the same operations as coroutines.
+    """
+
+    def __init__(self, rdb_table):
+        """
+        :param rdb_table: The RDBDataTable to wrap.
+        """
+        self._table = rdb_table
+
+    @classmethod
+    async def create(cls, table_name, db_name, connect_info=None):
+        """
+        Building an RDBDataTable reads the primary key from the database, so construction is async too.
+        :param connect_info: Connection information. Defaults to the service default for db_name
+            (data_table_adaptor.default_connect_info), as for synchronous tables.
+        """
+        if connect_info is None:
+            connect_info = dta.default_connect_info(db_name)
+        tbl = await run_blocking(RDBDataTable.RDBDataTable, table_name, db_name, connect_info=connect_info)
+        return cls(tbl)
+
+    def __str__(self):
+        return "Async" + str(self._table)
+
+    def get_primary_key_columns(self):
+        return self._table.get_primary_key_columns()
+
+    async def get_row_count(self, estimate=None):
+        return await run_blocking(self._table.get_row_count, estimate=estimate)
+
+    async def find_by_primary_key(self, key_fields, field_list=None):
+        return await run_blocking(self._table.find_by_primary_key, key_fields, field_list=field_list)
+
+    async def find_by_primary_keys(self, keys, field_list=None):
+        return await run_blocking(self._table.find_by_primary_keys, keys, field_list=field_list)
+
+    async def find_by_template(self, template, field_list=None, limit=None, offset=None, order_by=None):
+        return await run_blocking(self._table.find_by_template, template, field_list=field_list, limit=limit,
+                                  offset=offset, order_by=order_by)
+
+    async def find_by_template_keyset(self, template, field_list=None, limit=10, page_token=None, order_by=None):
+        return await run_blocking(self._table.find_by_template_keyset, template, field_list=field_list,
+                                  limit=limit, page_token=page_token, order_by=order_by)
+
+    async def aggregate_by_template(self, template, group_by=None, aggregates=None, order_by=None, limit=None,
+                                    offset=None):
+        return await run_blocking(self._table.aggregate_by_template, template, group_by=group_by,
+                                  aggregates=aggregates, order_by=order_by, limit=limit, offset=offset)
+
+    async def count_by_template(self, template, exact=None):
+        return await run_blocking(self._table.count_by_template, template, exact=exact)
+
+    async def navigate_path(self, pk, target_name, query_template, fields, limit=None, offset=None, order_by=None):
+        return await run_blocking(self._table.navigate_path, pk, target_name, query_template, fields, limit=limit,
+                                  offset=offset, order_by=order_by)
+
+    async def navigate_path_and_key(self, pk, target_name, tk, fields):
+        return await run_blocking(self._table.navigate_path_and_key, pk, target_name, tk, fields)
+
+    async def changes_since(self, seq, epoch=None, limit=1000, include_rows=False, field_list=None):
+        return await run_blocking(self._table.changes_since, seq, epoch=epoch, limit=limit,
+                                  include_rows=include_rows, field_list=field_list)
+
+    async def insert(self, new_record):
+        return await run_blocking(self._table.insert, new_record)
+
+    async def insert_many(self, new_records, batch_size=None):
+        return await run_blocking(self._table.insert_many, new_records, batch_size=batch_size)
+
+    async def update_by_template(self, template, new_values):
+        return await run_blocking(self._table.update_by_template, template, new_values)
+
+    async def update_by_key(self, key_fields, new_values):
+        return await run_blocking(self._table.update_by_key, key_fields, new_values)
+
+    async def delete_by_template(self, template):
+        return await run_blocking(self._table.delete_by_template, template)
+
+    async def delete_by_key(self, key_fields):
+        return await run_blocking(self._table.delete_by_key, key_fields)
+
+    async def update_by_keys(self, keys, new_values, chunk_size=None, commit_interval=None):
+        return await run_blocking(self._table.update_by_keys, keys, new_values, chunk_size=chunk_size,
+                                  commit_interval=commit_interval)
+
+    async def delete_by_keys(self, keys, chunk_size=None, commit_interval=None):
+        return await run_blocking(self._table.delete_by_keys, keys, chunk_size=chunk_size,
+                                  commit_interval=commit_interval)
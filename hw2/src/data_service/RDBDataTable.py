@@ -1,7 +1,21 @@
 import pandas as pd
 import pymysql
 import json
+import base64
+import time
+import decimal
+import unicodedata
 import src.data_service.dbutils as dbutils
+import src.data_service.connection_pool as connection_pool
+import src.data_service.result_cache as result_cache
+import src.data_service.instrumentation as instrumentation
+import src.data_service.columnar_export as columnar_export
+import src.data_service.transaction as transaction
+import src.data_service.catalog as catalog
+import src.data_service.index_advisor as index_advisor
+import src.data_service.replicas as replicas
+import src.data_service.single_flight as single_flight
+import src.data_service.change_log as change_log
 import logging
 
 logger = logging.getLogger()
@@ -9,6 +23,74 @@ pd.set_option('display.width', 256)
 pd.set_option('display.max_columns', 12)
 
 
+_numeric_types = ("tinyint", "smallint", "mediumint", "int", "integer", "bigint", "decimal", "numeric", "float",
+                  "double", "year")
+_integer_types = ("tinyint", "smallint", "mediumint", "int", "integer", "bigint", "year")
+
+
+def _value_normalizer(column_type):
+    """
+    :param column_type: The catalog's column_types entry for a column, or None.
+    :return: A function mapping a value of the column to a hashable value that is equal for values MySQL
+        considers equal.
+    """
+    if column_type is None:
+        return str
+    if column_type["data_type"] in _numeric_types:
+        def number(v):
+            try:
+                d = decimal.Decimal(str(v).strip())
+            except decimal.InvalidOperation:
+                return str(v)
+            return d if d.is_finite() else str(v)
+        return number
+    collation = (column_type.get("collation", None) or "").lower()
+    if collation == "":
+        return str
+    # The utf8mb4_0900 collations are NO PAD; the older ones ignore trailing spaces.
+    pad = "0900" not in collation and "nopad" not in collation
+    ci = collation.endswith("_ci")
+    ai = "_ai_" in collation or (ci and "_as_" not in collation)
+
+    def text(v):
+        s = v.decode("utf-8", "replace") if isinstance(v, bytes) else str(v)
+        if pad:
+            s = s.rstrip(" ")
+        if ci:
+            s = s.casefold()
+        if ai:
+            s = "".join([c for c in unicodedata.normalize("NFKD", s) if not unicodedata.combining(c)])
+        return s
+    return text
+
+
+def _key_value_type(column_type):
+    """
+    :param column_type: The catalog's column_types entry for a key column, or None.
+    :return: A function giving a key value one type whether it came from a URL (str) or a JSON body: int for
+        integer columns, str otherwise. Values that do not convert are returned as str.
+    """
+    if column_type is not None and column_type["data_type"] in _integer_types:
+        def integer(v):
+            try:
+                return int(str(v).strip())
+            except ValueError:
+                return str(v)
+        return integer
+    return lambda v: v.decode("utf-8", "replace") if isinstance(v, bytes) else str(v)
+
+
+def _positive_int_or_none(value, name):
+    """
+    :return: value if it is None or a positive int. Raises ValueError otherwise, before anything is run.
+    """
+    if value is None:
+        return None
+    if type(value) != int or value <= 0:
+        raise ValueError(name + " must be a positive integer.")
+    return value
+
+
 class RDBDataTable:
     """
     RDBDataTable is relation DB implementation of the BaseDataTable.
@@ -22,12 +104,40 @@ class RDBDataTable:
         'port': 3306
     }
     _rows_to_print = 5
+    _insert_batch_size = 1000
+    _stream_chunk_size = 500
+    _multi_get_chunk_size = 500
+    _export_batch_size = 10000
+    _key_batch_chunk_size = 500
+
+    # Table metadata (key columns, row count, sample rows) is shared by all instances for the same table and
+    # reloaded after _metadata_ttl seconds or on refresh_metadata(). Entries are (value, time loaded).
+    _metadata_ttl = 300
+    _metadata_cache = {}
+
+    # Read-through cache for find_by_template (and so find_by_primary_key). Writes through this class
+    # invalidate the table's entries; the TTL bounds staleness from writes made elsewhere.
+    _result_cache = result_cache.ResultCache(max_bytes=64 * 1024 * 1024, ttl=60)
+
+    # Per template row counts for paging. Exact counts are only run when EXPLAIN says at most _exact_count_threshold
+    # rows are examined; above that the estimate is returned. Writes invalidate like results do.
+    _count_cache = result_cache.ResultCache(max_bytes=4 * 1024 * 1024, ttl=300)
 
-    def __init__(self, table_name, db_name, key_columns=None, connect_info=None, debug=True):
+    # Coalesces concurrent identical find_by_template queries that miss the result cache.
+    _single_flight = single_flight.SingleFlight()
+
+    # Primary keys written through this class, per table, for incremental sync (see changes_since()).
+    _change_log = change_log.ChangeLog()
+    _exact_count_threshold = 100000
+
+    def __init__(self, table_name, db_name, key_columns=None, connect_info=None, debug=True,
+                 estimate_row_count=False):
         """
         :param table_name: The name of the RDB table.
         :param connect_info: Dictionary of parameters necessary to connect to the data.
         :param key_columns: List, in order, of the columns (fields) that comprise the primary key.
+        :param estimate_row_count: If True, get_row_count() uses the information_schema estimate instead of
+            running COUNT(*) over the whole table.
         """
         # RDBDataTable is not told the keys. It can extract from the schema using DML statements.
         if key_columns is not None:
@@ -39,25 +149,20 @@ class RDBDataTable:
         if db_name != connect_info['db']:
             print(db_name, connect_info['db'])
             raise ValueError("db_name != connect_info['db']")
-        # Create a connection to use inside this object. In general, this is not the right approach.
-        # There would be a connection pool shared across many classes and applications.
-        self._cnx = pymysql.connect(
-            host=connect_info['host'],
-            user=connect_info['user'],
-            password=connect_info['password'],
-            db=connect_info['db'],
-            port=connect_info['port'],
-            charset='utf8mb4',
-            cursorclass=pymysql.cursors.DictCursor)
+        # Connections come from a pool shared by every RDBDataTable with the same connect_info, so that
+        # concurrent requests against one table do not serialize on a single connection.
+        self._pool = connection_pool.get_pool(connect_info)
+        # Schema information (keys, columns) comes from the server's shared catalog cache.
+        self._catalog = catalog.get_catalog(connect_info)
         if db_name is None or table_name is None:
             raise ValueError("You MUST pass a database name and table name.")
         self._db_name = db_name
         self._table_name = table_name
         self._full_table_name = db_name + "." + table_name
         self._connect_info = connect_info
-        self._row_count = self.get_row_count()
+        self._estimate_row_count = estimate_row_count
+        # Only the key is needed to serve requests. Row count and sample rows are loaded when asked for.
         self._key_columns = self.get_primary_key_columns()  # check if default is valid
-        self._sample_rows = self.get_sample_rows()
         self._related_resources = None
         self._columns = None
         # # DFF Remove below.
@@ -72,36 +177,131 @@ class RDBDataTable:
         result += "\ndb_name = " + self._db_name
         result += "\nTable type = " + str(type(self))
         result += "\nKey fields: " + str(self._key_columns)
-        result += "\nNo. of rows = " + str(self._row_count)
-        result += "\nA few sample rows = \n" + str(self._sample_rows)
+        result += "\nNo. of rows = " + str(self.get_row_count())
+        result += "\nA few sample rows = \n" + str(self.get_sample_rows())
         result += "\nRelated resources:\n" + json.dumps(self._related_resources, indent=2)
         return result
 
-    def get_row_count(self):
+    def _get_metadata(self, item, loader):
+        """
+        :param item: Name of the piece of metadata, e.g. 'row_count'.
+        :param loader: Function that loads the value from the database on a miss.
+        :return: The cached value if it is younger than _metadata_ttl, otherwise the freshly loaded value.
+        """
+        key = (self._pool_key(), self._full_table_name, item)
+        entry = RDBDataTable._metadata_cache.get(key, None)
+        now = time.time()
+        if entry is not None and now - entry[1] < RDBDataTable._metadata_ttl:
+            return entry[0]
+        value = loader()
+        RDBDataTable._metadata_cache[key] = (value, now)
+        return value
+
+    def _pool_key(self):
+        return connection_pool.pool_key(self._connect_info)
+
+    def _cache_table(self):
+        """
+        :return: The key the result and count caches group this table's entries (and invalidations) under. It
+            includes the pool key, so the same db.table on another server or login does not share results.
+        """
+        return self._pool_key(), self._full_table_name
+
+    def _drop_metadata(self):
+        prefix = (self._pool_key(), self._full_table_name)
+        for key in list(RDBDataTable._metadata_cache.keys()):
+            if key[:2] == prefix:
+                RDBDataTable._metadata_cache.pop(key, None)
+
+    def refresh_metadata(self):
+        """
+        Drops the cached metadata for this table. It is reloaded the next time it is asked for.
+        :return: None
+        """
+        self._drop_metadata()
+        self._catalog.refresh(self._db_name)
+        self._key_columns = self.get_primary_key_columns()
+
+    def close(self):
         """
+        Releases what this table holds outside the pool: its cached metadata (including the sample rows) and
+        cached results. Connections belong to the shared pool; see connection_pool.close_pool().
+        :return: None
+        """
+        self._drop_metadata()
+        RDBDataTable._result_cache.invalidate(self._cache_table())
+        RDBDataTable._count_cache.invalidate(self._cache_table())
+
+    @classmethod
+    def clear_metadata_cache(cls):
+        cls._metadata_cache.clear()
+
+    def get_row_count(self, estimate=None):
+        """
+        :param estimate: If True, return the information_schema estimate (cheap, but approximate for InnoDB).
+            If None, use the estimate_row_count setting the table was created with.
         :return: Returns the count of the number of rows in the table.
         """
-        sql = "select count(*) as count from " + self._table_name
-        res, d = dbutils.run_q(sql=sql, conn=self._cnx, commit=True, fetch=True)
+        if estimate is None:
+            estimate = self._estimate_row_count
+        if estimate:
+            return self._get_metadata("row_count_estimate", self._load_row_count_estimate)
+        return self._get_metadata("row_count", self._load_row_count)
+
+    def _load_row_count(self):
+        sql = "select count(*) as count from " + self._full_table_name
+        res, d = dbutils.run_q(sql=sql, connect_info=self._connect_info, commit=False, fetch=True)
+        return d[0]['count']
+
+    def _load_row_count_estimate(self):
+        sql = "select table_rows as count from information_schema.tables where table_schema=%s and table_name=%s"
+        res, d = dbutils.run_q(sql=sql, args=[self._db_name, self._table_name], connect_info=self._connect_info,
+                               commit=False, fetch=True)
+        if len(d) == 0 or d[0]['count'] is None:
+            return None
         return d[0]['count']
 
     def get_primary_key_columns(self):
         """
         :return: A list of the primary key columns ordered by their position in the key.
         """
-        # -- TO IMPLEMENT --
-        # Hint. Google "get primary key columns mysql"
+        return self._get_metadata("key_columns", self._load_primary_key_columns)
+
+    def _load_primary_key_columns(self):
+        keys = self._catalog.get_primary_key_columns(self._db_name, self._table_name)
+        if keys is not None:
+            return keys
+        # Not in the catalog even after it reloaded the database on the miss. Ask the table directly.
         # Hint. THE ORDER OF THE COLUMNS IN THE KEY DEFINITION MATTERS.
-        sql = "SHOW KEYS FROM " + self._table_name + " WHERE Key_name = 'PRIMARY'"
-        res, d = dbutils.run_q(sql=sql, conn=self._cnx, commit=True, fetch=True)
+        sql = "SHOW KEYS FROM " + self._full_table_name + " WHERE Key_name = 'PRIMARY'"
+        res, d = dbutils.run_q(sql=sql, connect_info=self._connect_info, commit=False, fetch=True)
         keys = []
         for row in d:
             keys.append(row['Column_name'])
         return keys
 
+    def get_columns(self):
+        """
+        :return: The table's column names, in order, from the catalog.
+        """
+        t = self._catalog.get_table(self._db_name, self._table_name)
+        return None if t is None else list(t["columns"])
+
+    def _validate_columns(self, *names):
+        """
+        :param names: Lists of column names, or dictionaries keyed by column name, or None.
+        :return: None. Raises catalog.UnknownColumnError before any SQL is sent if a name is not a column.
+        """
+        cols = []
+        for n in names:
+            if n is not None:
+                cols.extend(n)
+        if len(cols) > 0:
+            self._catalog.validate_columns(self._db_name, self._table_name, cols)
+
     def get_rows(self, no_of_rows=_rows_to_print):
         sql = "select * from " + self._full_table_name + " limit " + str(no_of_rows)
-        res, d = dbutils.run_q(sql, conn=self._cnx)
+        res, d = dbutils.run_q(sql, connect_info=self._connect_info)
         return d
 
     def get_sample_rows(self, no_of_rows=_rows_to_print):
@@ -109,23 +309,40 @@ class RDBDataTable:
         :param no_of_rows: Number of rows to include in a sample of the data.
         :return: A Pandas dataframe containing the first _row_to_print number of rows.
         """
+        if no_of_rows == RDBDataTable._rows_to_print:
+            return self._get_metadata("sample_rows", self._load_sample_rows)
+        return self._load_sample_rows(no_of_rows)
+
+    def _load_sample_rows(self, no_of_rows=_rows_to_print):
         sql = "select * from " + self._full_table_name + " limit " + str(no_of_rows)
-        return pd.read_sql(sql, self._cnx)
+        with self._pool.connection() as cnx:
+            return pd.read_sql(sql, cnx)
 
     def get_related_resources(self):
         """
-        :return:
+        :return: The tables related to this one by a foreign key, in either direction, as a dictionary of
+            table name -> list of (column here, column there) pairs. Comes from the catalog.
         """
-        # -- THANK ALY AND ARA --
-        # Aly and Ara told me to get rid of this requirement or they would be unhappy.
-        #
-        pass
+        fks = self._catalog.get_foreign_keys(self._db_name, self._table_name)
+        result = {}
+        if fks is None:
+            return result
+        outgoing, incoming = fks
+        for fk in outgoing:
+            result.setdefault(fk["referenced_table"], list(zip(fk["columns"], fk["referenced_columns"])))
+        for fk in incoming:
+            result.setdefault(fk["table"], list(zip(fk["referenced_columns"], fk["columns"])))
+        self._related_resources = {k: [list(p) for p in v] for k, v in result.items()}
+        return result
 
     def get_links(self, target_table=None):
-        # -- THANK ALY AND ARA --
-        # Aly and Ara told me to get rid of this requirement or they would be unhappy.
-        #
-        pass
+        """
+        :param target_table: A related table, or None for all of them.
+        :return: The key map for target_table, or a dictionary of key maps by table name.
+        """
+        if target_table is not None:
+            return self._get_key_map(target_table)
+        return self.get_related_resources()
 
     def find_by_primary_key(self, key_fields, field_list=None):
         """
@@ -149,25 +366,403 @@ class RDBDataTable:
             result = None
         return result
 
+    def find_by_primary_keys(self, keys, field_list=None, chunk_size=None):
+        """
+        Multi-get. Looks up many keys with one query per chunk instead of one query per key.
+        :param keys: A list of keys. Each key is a list of values for the key_columns, in order.
+        :param field_list: A subset of the fields of the records to return.
+        :param chunk_size: Keys per query, to keep statements under the server packet limit.
+            Defaults to _multi_get_chunk_size.
+        :return: A list with one entry per requested key, in request order: the record, or None if there is no
+            record with that key.
+        """
+        key_columns = self._key_columns
+        if key_columns is None or key_columns == []:
+            return [None] * len(keys)
+        if chunk_size is None:
+            chunk_size = RDBDataTable._multi_get_chunk_size
+        self._validate_columns(field_list)
+        fields = field_list
+        if field_list is not None:
+            fields = list(field_list) + [k for k in key_columns if k not in field_list]
+
+        # Key values from URLs are strings. Rows are matched to them the way MySQL compared them in the IN list.
+        normalizers = self._key_normalizers()
+
+        def key_of(values):
+            return tuple([f(v) for f, v in zip(normalizers, values)])
+
+        found = {}
+        unique_keys = list({key_of(k): k for k in keys}.values())
+        for start in range(0, len(unique_keys), chunk_size):
+            chunk = unique_keys[start:start + chunk_size]
+            sql, args = dbutils.create_select_by_keys(self._full_table_name, key_columns, chunk, fields=fields)
+            res, data = dbutils.run_q(sql=sql, args=args, connect_info=self._connect_info, commit=False, read=True,
+                                      fetch=True, table=self._full_table_name)
+            for r in data:
+                found[key_of([r[k] for k in key_columns])] = r
+        result = []
+        for k in keys:
+            r = found.get(key_of(k), None)
+            if r is not None and field_list is not None and len(fields) != len(field_list):
+                r = {f: r[f] for f in field_list}
+            result.append(r)
+        return result
+
+    def _key_normalizers(self):
+        """
+        :return: One function per key column that turns a value into the form MySQL compares it in, from the
+            column's type and collation in the catalog: numbers by value ("01" and 1 match), and strings without
+            trailing spaces (PAD SPACE collations), case (_ci) and accents (accent insensitive collations). Columns
+            the catalog does not describe compare as str().
+        """
+        t = self._catalog.get_table(self._db_name, self._table_name)
+        types = t["column_types"] if t is not None else {}
+        return [_value_normalizer(types.get(k, None)) for k in self._key_columns]
+
     def find_by_template(self, template, field_list=None, limit=None, offset=None, order_by=None, commit=True):
         """
-        :param template: A dictionary of the form { "field1" : value1, "field2": value2, ...}
+        :param template: A dictionary of the form { "field1" : value1, "field2": value2, ...}. A value may also be
+            a dictionary of operators, e.g. {"yearID": {"gte": 1990, "lt": 2000}}; see dbutils.template_ops.
         :param field_list: A list of request fields of the form, ['fielda', 'fieldb', ...]
         :param limit: Do not worry about this for now.
         :param offset: Do not worry about this for now.
-        :param order_by: Do not worry about this for now.
+        :param order_by: A list of columns to sort by, e.g. ['-yearID', 'nameLast'] (- means descending).
         :return: A list containing dictionaries. A dictionary is in the list representing each record
             that matches the template. The dictionary only contains the requested fields.
         """
         result = None
+        started = instrumentation.start()
         try:
+            self._validate_columns(template, field_list, dbutils.order_by_columns(order_by))
+            index_advisor.record(self._full_table_name, self._connect_info, template, order_by)
             sql, args = dbutils.create_select(self._full_table_name, template=template, fields=field_list, limit=limit,
-                                              offset=offset)
-            res, data = dbutils.run_q(sql=sql, args=args, conn=self._cnx, commit=True, fetch=True)
+                                              offset=offset, order_by=order_by)
+            instrumentation.observe("table", self._full_table_name, "find_by_template.build", started)
+            result = self._cached_read(sql, args, "find_by_template", started)
         except Exception as e:
             print("Exception e = ", e)
             raise e
-        return list(data)
+        return result
+
+    def _cached_read(self, sql, args, name, started):
+        """
+        Runs a read of this table through the result cache.
+        :param name: The operation, for instrumentation.
+        :return: The rows, as a new list.
+        """
+        if transaction.current() is not None:
+            # A unit of work may see its own uncommitted writes. Those must not reach the shared cache.
+            res, data = dbutils.run_q(sql=sql, args=args, connect_info=self._connect_info, commit=False,
+                                      fetch=True)
+            return list(data)
+        # The generated SQL and args identify the table, template, fields, limit and offset exactly.
+        cache_key = (sql, repr(args))
+        result = RDBDataTable._result_cache.get(self._cache_table(), cache_key)
+        if result is not None:
+            instrumentation.observe("table", self._full_table_name, name + ".cached", started)
+            return result
+        generation = RDBDataTable._result_cache.generation(self._cache_table())
+
+        def load():
+            res, data = dbutils.run_q(sql=sql, args=args, connect_info=self._connect_info, commit=False,
+                                      fetch=True, read=True, table=self._full_table_name)
+            rows = list(data)
+            RDBDataTable._result_cache.put(self._cache_table(), cache_key, rows, generation)
+            return rows
+
+        # Concurrent identical misses share one query. The generation is part of the key, so a read that
+        # starts after a write never joins a query that started before it.
+        result = list(RDBDataTable._single_flight.do((self._cache_table(), cache_key, generation), load))
+        instrumentation.observe("table", self._full_table_name, name, started)
+        return result
+
+    def aggregate_by_template(self, template, group_by=None, aggregates=None, order_by=None, limit=None,
+                              offset=None):
+        """
+        Server side aggregation: one GROUP BY query, so MySQL returns the summary rows instead of every matching
+        row. Results go through the result cache like find_by_template.
+        :param template: A template selecting the rows to aggregate, with or without operators.
+        :param group_by: A list of columns to group by. None aggregates all matching rows into one row.
+        :param aggregates: A list of "function:column" strings, e.g. ["sum:HR", "count:*", "avg:AB"]; see
+            dbutils.aggregate_functions. Defaults to ["count:*"].
+        :param order_by: Group columns or aggregate names (e.g. "-sum_HR") to sort by.
+        :return: A list of dictionaries with the group columns and one entry per aggregate.
+        """
+        started = instrumentation.start()
+        if aggregates is None or len(aggregates) == 0:
+            aggregates = ["count:*"]
+        aggregates = dbutils.parse_aggregates(aggregates)
+        names = set([dbutils.aggregate_name(fn, c).lower() for fn, c in aggregates])
+        sort_columns = [c for c in dbutils.order_by_columns(order_by) if c.lower() not in names]
+        self._validate_columns(template, group_by, [c for fn, c in aggregates if c != "*"], sort_columns)
+        index_advisor.record(self._full_table_name, self._connect_info, template, kind="aggregate")
+        sql, args = dbutils.create_aggregate(self._full_table_name, template, group_by, aggregates,
+                                             order_by=order_by, limit=limit, offset=offset)
+        return self._cached_read(sql, args, "aggregate_by_template", started)
+
+    def count_by_template(self, template, exact=None):
+        """
+        :param template: A template, as for find_by_template.
+        :param exact: True always runs COUNT(*), False never does. None (the default) runs it only if COUNT(*)
+            would examine at most _exact_count_threshold rows; a selective filter does not make a big scan cheap.
+        :return: {"count": n, "estimated": bool}. Counts are cached per template until the table is written to or
+            the cache TTL passes. count is None if no estimate is available.
+        """
+        self._validate_columns(template)
+        sql, args = dbutils.create_count(self._full_table_name, template)
+        in_uow = transaction.current() is not None
+        cache_key = (sql, repr(args), exact)
+        if not in_uow:
+            cached = RDBDataTable._count_cache.get(self._cache_table(), cache_key)
+            if cached is not None:
+                return dict(cached[0])
+        generation = RDBDataTable._count_cache.generation(self._cache_table())
+        examined, estimate = None, None
+        if exact is not True:
+            examined, estimate = self._estimate_count(template)
+        if exact is True or (exact is None and (examined is None or examined <= RDBDataTable._exact_count_threshold)):
+            res, d = dbutils.run_q(sql, args=args, connect_info=self._connect_info, commit=False, fetch=True,
+                                   read=True, table=self._full_table_name)
+            result = {"count": d[0]["count"], "estimated": False}
+        else:
+            result = {"count": estimate, "estimated": True}
+        if not in_uow:
+            RDBDataTable._count_cache.put(self._cache_table(), cache_key, [result], generation)
+        return dict(result)
+
+    def _estimate_count(self, template):
+        """
+        :return: (rows examined, rows matching), estimated without reading the rows: the information_schema row
+            estimate for the whole table (both), or EXPLAIN's rows and rows times filtered for a template.
+            (None, None) if unavailable.
+        """
+        if not template:
+            estimate = self.get_row_count(estimate=True)
+            return estimate, estimate
+        sql, args = dbutils.create_select(self._full_table_name, template=template)
+        res, d = dbutils.run_q("EXPLAIN " + sql, args=args, connect_info=self._connect_info, commit=False, fetch=True,
+                               read=True, table=self._full_table_name)
+        if len(d) == 0 or d[0].get("rows", None) is None:
+            return None, None
+        examined = int(d[0]["rows"])
+        filtered = d[0].get("filtered", None)
+        if filtered is None:
+            filtered = 100.0
+        return examined, int(round(examined * float(filtered) / 100.0))
+
+    def _invalidate_cached_results(self):
+        RDBDataTable._result_cache.invalidate(self._cache_table())
+        RDBDataTable._count_cache.invalidate(self._cache_table())
+        replicas.note_write(self._full_table_name)
+        uow = transaction.current()
+        if uow is not None:
+            # Other threads may cache the pre-transaction rows until the unit of work commits.
+            uow.on_end(self._invalidate_after_transaction)
+
+    def _invalidate_after_transaction(self):
+        RDBDataTable._result_cache.invalidate(self._cache_table())
+        RDBDataTable._count_cache.invalidate(self._cache_table())
+        replicas.note_write(self._full_table_name)
+
+    def _read_connection(self):
+        """
+        :return: A context manager yielding a pooled connection for a read of this table: a replica's if
+            connect_info names replicas (see replicas.py), otherwise the primary's.
+        """
+        replica_set = replicas.get_replica_set(self._connect_info)
+        if replica_set is None or transaction.current() is not None:
+            return self._pool.connection()
+        return replica_set.read_connection(self._full_table_name)
+
+    def transaction(self):
+        """
+        :return: A context manager for a unit of work. Every RDBDataTable operation on this thread inside the
+            with block, on this or any other table, runs on one pinned pooled connection per connect_info with
+            no per-statement commits, and is committed once at the end (rolled back on an exception):
+
+                with people.transaction():
+                    people.insert(row)
+                    batting.insert_many(rows)
+        """
+        return transaction.unit_of_work()
+
+    @classmethod
+    def get_result_cache_stats(cls):
+        """
+        :return: Result cache budget and usage, with hits, misses and bytes held per table, named
+            user@host:port/db.table.
+        """
+        result = cls._result_cache.stats()
+        tables = {}
+        for (key, table), t in result["tables"].items():
+            name = connection_pool.pool_name(key) + "/" + table
+            if name in tables:
+                # Same login with another password.
+                t = {k: v + tables[name][k] for k, v in t.items()}
+            tables[name] = t
+        result["tables"] = tables
+        return result
+
+    @classmethod
+    def get_single_flight_stats(cls):
+        """
+        :return: Queries executed and queries coalesced into another thread's identical query.
+        """
+        return cls._single_flight.stats()
+
+    def stream_by_template(self, template, field_list=None, limit=None, offset=None, order_by=None,
+                           chunk_size=None):
+        """
+        Like find_by_template, but returns a generator. Uses an unbuffered server side cursor (SSDictCursor), so
+        only chunk_size rows are held in memory at a time no matter how big the result is.
+        Columns are validated, the SQL is built and the statement is executed before this returns, so bad input and
+        SQL errors are raised here rather than from the first next(), after a response may have started.
+        The pooled connection is held until the generator is exhausted or closed.
+        :param chunk_size: Rows fetched from the server per fetchmany(). Defaults to _stream_chunk_size.
+        :return: A generator of lists of row dictionaries, one list per chunk.
+        """
+        if chunk_size is None:
+            chunk_size = RDBDataTable._stream_chunk_size
+        self._validate_columns(template, field_list, dbutils.order_by_columns(order_by))
+        sql, args = dbutils.create_select(self._full_table_name, template=template, fields=field_list, limit=limit,
+                                          offset=offset, order_by=order_by)
+        return self._started(self._stream_rows(sql, args, chunk_size))
+
+    @staticmethod
+    def _started(gen):
+        """
+        :param gen: A generator that yields None once its statement has been executed.
+        :return: gen, advanced past that first yield.
+        """
+        next(gen)
+        return gen
+
+    def _stream_rows(self, sql, args, chunk_size):
+        with self._read_connection() as cnx:
+            cur = cnx.cursor(pymysql.cursors.SSDictCursor)
+            try:
+                cur.execute(sql, args)
+                yield None
+                while True:
+                    rows = cur.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    yield rows
+            finally:
+                # Closing an unbuffered cursor reads and discards any rows left on the wire.
+                cur.close()
+
+    def export_by_template(self, template, field_list=None, limit=None, offset=None, order_by=None, fmt="arrow",
+                           batch_size=None):
+        """
+        Columnar export for bulk reads. Rows come off an unbuffered tuple cursor in batches and are converted
+        column by column, by MySQL type, into Arrow record batches (or NumPy arrays), so no row dictionaries
+        are built. As in stream_by_template, the statement is validated, built and executed before this returns.
+        :param fmt: 'arrow' (Arrow IPC stream), 'parquet', or 'npz' (NumPy, works without pyarrow).
+        :param batch_size: Rows per batch. Defaults to _export_batch_size.
+        :return: A generator of bytes.
+        """
+        if batch_size is None:
+            batch_size = RDBDataTable._export_batch_size
+        if fmt not in columnar_export.available_formats():
+            raise ValueError("Unsupported export format " + str(fmt) + ". Available: " +
+                             ",".join(columnar_export.available_formats()))
+        self._validate_columns(template, field_list, dbutils.order_by_columns(order_by))
+        sql, args = dbutils.create_select(self._full_table_name, template=template, fields=field_list, limit=limit,
+                                          offset=offset, order_by=order_by)
+        return self._started(self._export_rows(sql, args, fmt, batch_size))
+
+    def _unsigned_columns(self):
+        """
+        :return: The lower case names of the table's UNSIGNED columns, which cursor.description does not report.
+        """
+        t = self._catalog.get_table(self._db_name, self._table_name)
+        types = t["column_types"] if t is not None else {}
+        return {c.lower() for c, ct in types.items() if "unsigned" in (ct.get("column_type", None) or "").lower()}
+
+    def _export_rows(self, sql, args, fmt, batch_size):
+        with self._read_connection() as cnx:
+            cur = cnx.cursor(pymysql.cursors.SSCursor)
+            try:
+                cur.execute(sql, args)
+                yield None
+
+                def batches():
+                    while True:
+                        rows = cur.fetchmany(batch_size)
+                        if not rows:
+                            break
+                        yield rows
+
+                for data in columnar_export.export_batches(cur.description, batches(), fmt, self._unsigned_columns()):
+                    yield data
+            finally:
+                cur.close()
+
+    @staticmethod
+    def encode_page_token(key_values):
+        """
+        :param key_values: The primary key values of the last row on a page.
+        :return: An opaque, URL safe token for the next page.
+        """
+        s = json.dumps(key_values, default=str)
+        return base64.urlsafe_b64encode(s.encode("utf-8")).decode("ascii")
+
+    @staticmethod
+    def decode_page_token(token):
+        """
+        :param token: A token produced by encode_page_token, or None/"" for the first page.
+        :return: The list of key values encoded in the token, or None for the first page.
+        """
+        if token is None or token == "":
+            return None
+        try:
+            return json.loads(base64.urlsafe_b64decode(token.encode("ascii")).decode("utf-8"))
+        except Exception:
+            raise ValueError("Invalid page token.")
+
+    def find_by_template_keyset(self, template, field_list=None, limit=10, page_token=None, order_by=None):
+        """
+        Keyset (seek) pagination. Rows are ordered by the primary key and each page starts strictly after the
+        last key of the previous page, so page N costs the same as page 1.
+        :param template: A dictionary of the form { "field1" : value1, "field2": value2, ...}
+        :param field_list: A list of request fields. Key columns are fetched even if not requested, but are
+            only returned if requested.
+        :param limit: Page size.
+        :param page_token: None for the first page, otherwise the next_token from the previous page.
+        :param order_by: None, or the primary key columns in ascending order. Pages are always in key order, so
+            any other order raises ValueError instead of being ignored.
+        :return: A tuple (rows, next_token). next_token is None when there are no more rows.
+        """
+        key_columns = self._key_columns
+        if key_columns is None or key_columns == []:
+            raise ValueError("Keyset paging requires a primary key on " + self._full_table_name)
+        self._validate_columns(template, field_list)
+        key_order = [(k.lower(), False) for k in key_columns]
+        if order_by is not None and [(c.lower(), d) for c, d in dbutils.order_by_terms(order_by)] != key_order:
+            raise ValueError("cursor pages are in primary key order (" + ",".join(key_columns) +
+                             "); order_by cannot be combined with cursor.")
+        last_key = self.decode_page_token(page_token)
+        if last_key is not None and (type(last_key) != list or len(last_key) != len(key_columns) or
+                                     not all([type(v) in (str, int, float, bool) for v in last_key])):
+            raise ValueError("Invalid page token.")
+        index_advisor.record(self._full_table_name, self._connect_info, template, self._key_columns)
+        limit = int(limit)
+        fields = field_list
+        if field_list is not None:
+            fields = list(field_list) + [k for k in key_columns if k not in field_list]
+        sql, args = dbutils.create_select(self._full_table_name, template=template, fields=fields, limit=limit,
+                                          order_by=key_columns, seek=(key_columns, last_key))
+        res, data = dbutils.run_q(sql=sql, args=args, connect_info=self._connect_info, commit=False, fetch=True,
+                                  read=True, table=self._full_table_name)
+        data = list(data)
+        next_token = None
+        if len(data) == limit and limit > 0:
+            next_token = self.encode_page_token([data[-1][k] for k in key_columns])
+        if field_list is not None and len(fields) != len(field_list):
+            data = [{k: r[k] for k in field_list} for r in data]
+        return data, next_token
 
     def delete_by_template(self, template):
         """
@@ -175,9 +770,14 @@ class RDBDataTable:
         :param template: A template.
         :return: A count of the rows deleted.
         """
+        started = instrumentation.start()
         try:
+            self._validate_columns(template)
+            index_advisor.record(self._full_table_name, self._connect_info, template, kind="delete")
             sql, args = dbutils.create_select(self._full_table_name, template=template, is_select=False)
-            res, d = dbutils.run_q(sql, args=args, conn=self._cnx, commit=True)
+            res = self._write_by_template(sql, args, template, change_log.DELETE)
+            self._invalidate_cached_results()
+            instrumentation.observe("table", self._full_table_name, "delete_by_template", started)
             return res
         except Exception as e:
             print("Got exception e = ", e)
@@ -199,10 +799,91 @@ class RDBDataTable:
         :return: None
         """
         # Get the list of columns.
+        started = instrumentation.start()
+        self._validate_columns(new_record)
         sql, args = dbutils.create_insert(self._full_table_name, new_record)
-        res, d = dbutils.run_q(sql, args=args, conn=self._cnx)
+        res, d = dbutils.run_q(sql, args=args, connect_info=self._connect_info)
+        self._invalidate_cached_results()
+        self._record_changes([(change_log.INSERT, self._key_of(new_record))])
+        instrumentation.observe("table", self._full_table_name, "insert", started)
         return res
 
+    def insert_many(self, new_records, batch_size=None):
+        """
+        Insert many rows. Rows are sent in batches of batch_size, each batch as multi-row INSERT statements in a
+        single transaction. Batches before a failing batch stay committed; nothing after it is attempted.
+        Inside a unit of work (see transaction()) nothing is committed here and a failure is raised instead, so
+        that the unit of work rolls back.
+        :param new_records: A list of dictionaries, each representing a row.
+        :param batch_size: Rows per batch/transaction. Defaults to _insert_batch_size.
+        :return: A dictionary {"inserted": total rows inserted, "batches": [rows inserted per batch],
+            "failed_index": index in new_records of the first row that failed or None, "error": message or None}
+        """
+        if batch_size is None:
+            batch_size = RDBDataTable._insert_batch_size
+        batch_size = int(batch_size)
+        if batch_size <= 0:
+            raise ValueError("batch_size must be positive.")
+        column_names = set()
+        for r in new_records:
+            column_names.update(r.keys())
+        self._validate_columns(column_names)
+        result = {"inserted": 0, "batches": [], "failed_index": None, "error": None}
+        for start in range(0, len(new_records), batch_size):
+            batch = new_records[start:start + batch_size]
+            with transaction.pinned_connection(self._connect_info) as (cnx, owned):
+                if not owned:
+                    count = self._insert_batch(cnx, batch)
+                else:
+                    try:
+                        cnx.begin()
+                        count = self._insert_batch(cnx, batch)
+                        cnx.commit()
+                    except pymysql.err.MySQLError as e:
+                        cnx.rollback()
+                        result["failed_index"] = start + self._find_failing_row(cnx, batch)
+                        result["error"] = str(e)
+                        break
+            result["batches"].append(count)
+            result["inserted"] += count
+            self._record_changes([(change_log.INSERT, self._key_of(r)) for r in batch])
+        if result["inserted"] > 0:
+            self._invalidate_cached_results()
+        return result
+
+    def _insert_batch(self, cnx, batch):
+        # Rows with the same columns share one statement, so group consecutive rows by column set.
+        count = 0
+        group_start = 0
+        for i in range(1, len(batch) + 1):
+            if i == len(batch) or set(batch[i].keys()) != set(batch[group_start].keys()):
+                sql = None
+                args_list = []
+                for row in batch[group_start:i]:
+                    sql, args = dbutils.create_insert(self._full_table_name, row)
+                    args_list.append(args)
+                count += dbutils.run_many(sql, args_list, conn=cnx, commit=False)
+                group_start = i
+        return count
+
+    def _find_failing_row(self, cnx, batch):
+        # A multi-row statement does not say which row failed. Replay the batch one row at a time, then
+        # roll back, to find it. This only runs after a failure.
+        # If every row succeeds on its own, the batch as a whole is reported from its first row.
+        failed = 0
+        try:
+            cnx.begin()
+            for index in range(len(batch)):
+                sql, args = dbutils.create_insert(self._full_table_name, batch[index])
+                try:
+                    dbutils.run_q(sql, args=args, conn=cnx, fetch=False, commit=False)
+                except pymysql.err.MySQLError:
+                    failed = index
+                    break
+        finally:
+            cnx.rollback()
+        return failed
+
     def update_by_template(self, template, new_values):
         """
         :param template: A template that defines which matching rows to update.
@@ -210,8 +891,13 @@ class RDBDataTable:
             in the records.
         :return: The number of rows updates.
         """
+        started = instrumentation.start()
+        self._validate_columns(template, new_values)
+        index_advisor.record(self._full_table_name, self._connect_info, template, kind="update")
         sql, args = dbutils.create_update(self._full_table_name, template=template, changed_cols=new_values)
-        res, d = dbutils.run_q(sql, args=args, conn=self._cnx, commit=True)
+        res = self._write_by_template(sql, args, template, change_log.UPDATE, new_values)
+        self._invalidate_cached_results()
+        instrumentation.observe("table", self._full_table_name, "update_by_template", started)
         return res
 
     def update_by_key(self, key_fields, new_values):
@@ -224,20 +910,266 @@ class RDBDataTable:
         res = self.update_by_template(template=tmp, new_values=new_values)
         return res
 
+    def delete_by_keys(self, keys, chunk_size=None, commit_interval=None):
+        """
+        Delete many rows by primary key with one DELETE ... WHERE key IN (...) per chunk.
+        :param keys: A list of keys. Each key is a list of values for the key_columns, in order.
+        :param chunk_size: Keys per statement. Defaults to _key_batch_chunk_size.
+        :param commit_interval: Commit after this many chunks. None commits once, after the last chunk.
+        :return: See _run_key_batches.
+        """
+        chunk_size = _positive_int_or_none(chunk_size, "chunk_size")
+        commit_interval = _positive_int_or_none(commit_interval, "commit_interval")
+        statements = []
+        for chunk in self._key_chunks(keys, chunk_size):
+            sql, args = dbutils.create_delete_by_keys(self._full_table_name, self._key_columns, chunk)
+            statements.append((sql, args, self._changes_for(change_log.DELETE, chunk)))
+        return self._run_key_batches(statements, commit_interval)
+
+    def update_by_keys(self, keys, new_values, chunk_size=None, commit_interval=None):
+        """
+        Update many rows by primary key with one UPDATE per chunk.
+        :param keys: A list of keys. Each key is a list of values for the key_columns, in order.
+        :param new_values: One dictionary of new values for every key, or a list with one dictionary per key.
+            Per key values are applied with CASE expressions; keys that set different columns go in separate
+            statements.
+        :param chunk_size: Keys per statement. Defaults to _key_batch_chunk_size.
+        :param commit_interval: Commit after this many statements. None commits once, after the last one.
+        :return: See _run_key_batches.
+        """
+        if type(new_values) == list and len(new_values) != len(keys):
+            raise ValueError("new_values must have one entry per key.")
+        chunk_size = _positive_int_or_none(chunk_size, "chunk_size")
+        commit_interval = _positive_int_or_none(commit_interval, "commit_interval")
+        if chunk_size is None:
+            chunk_size = RDBDataTable._key_batch_chunk_size
+        if type(new_values) == list:
+            for v in new_values:
+                self._validate_columns(v)
+        else:
+            self._validate_columns(new_values)
+        statements = []
+        if type(new_values) != list:
+            for chunk in self._key_chunks(keys, chunk_size):
+                sql, args = dbutils.create_update_by_keys(self._full_table_name, self._key_columns, chunk,
+                                                          new_values)
+                statements.append((sql, args, self._changes_for(change_log.UPDATE, chunk, new_values)))
+        else:
+            # One CASE statement needs every key in it to set the same columns.
+            groups = {}
+            for k, v in zip(keys, new_values):
+                groups.setdefault(tuple(sorted(v.keys())), []).append((k, v))
+            for group in groups.values():
+                for start in range(0, len(group), chunk_size):
+                    chunk = group[start:start + chunk_size]
+                    sql, args = dbutils.create_update_by_keys(self._full_table_name, self._key_columns,
+                                                              [c[0] for c in chunk], [c[1] for c in chunk])
+                    changes = []
+                    for k, v in chunk:
+                        changes.extend(self._changes_for(change_log.UPDATE, [k], v))
+                    statements.append((sql, args, changes))
+        return self._run_key_batches(statements, commit_interval)
+
+    def _key_chunks(self, keys, chunk_size):
+        if self._key_columns is None or self._key_columns == []:
+            raise ValueError(self._full_table_name + " has no primary key.")
+        if chunk_size is None:
+            chunk_size = RDBDataTable._key_batch_chunk_size
+        return [keys[i:i + chunk_size] for i in range(0, len(keys), chunk_size)]
+
+    def _run_key_batches(self, statements, commit_interval):
+        """
+        Runs the statements on one pooled connection as one transaction, committing every commit_interval
+        statements. On an error, the uncommitted statements are rolled back and nothing further is run.
+        Inside a unit of work the statements join its transaction and errors are raised.
+        :param statements: A list of (sql, args, changes); the changes of committed statements go to the change log.
+        :return: A dictionary {"affected": total rows affected, "chunks": [rows affected per statement],
+            "committed_chunks": statements committed, "error": message or None}
+        """
+        result = {"affected": 0, "chunks": [], "committed_chunks": 0, "error": None}
+        with transaction.pinned_connection(self._connect_info) as (cnx, owned):
+            if not owned:
+                # Part of a unit of work, which commits (or rolls back) everything at its end.
+                for sql, args, changes in statements:
+                    res, d = dbutils.run_q(sql, args=args, conn=cnx, fetch=False, commit=False)
+                    result["chunks"].append(res)
+                result["committed_chunks"] = len(result["chunks"])
+            else:
+                try:
+                    cnx.begin()
+                    for sql, args, changes in statements:
+                        res, d = dbutils.run_q(sql, args=args, conn=cnx, fetch=False, commit=False)
+                        result["chunks"].append(res)
+                        if commit_interval is not None and len(result["chunks"]) % commit_interval == 0:
+                            cnx.commit()
+                            result["committed_chunks"] = len(result["chunks"])
+                            cnx.begin()
+                    cnx.commit()
+                    result["committed_chunks"] = len(result["chunks"])
+                except pymysql.err.MySQLError as e:
+                    cnx.rollback()
+                    result["error"] = str(e)
+        result["affected"] = sum(result["chunks"][:result["committed_chunks"]])
+        if result["committed_chunks"] > 0:
+            self._invalidate_cached_results()
+            committed = []
+            for sql, args, changes in statements[:result["committed_chunks"]]:
+                committed.extend(changes)
+            self._record_changes(committed)
+        return result
+
+    def _key_of(self, record):
+        """
+        :return: The record's primary key values, or None if it does not hold all of them.
+        """
+        if not self._key_columns or not all([k in record for k in self._key_columns]):
+            return None
+        return [record[k] for k in self._key_columns]
+
+    def _changes_for(self, op, keys, new_values=None):
+        """
+        :return: Change log entries for writing the rows with these keys. An update that sets key columns is
+            logged as a delete of the old key and an insert of the new one.
+        """
+        if op != change_log.UPDATE or type(new_values) != dict or \
+                not any([k in new_values for k in self._key_columns]):
+            return [(op, k) for k in keys]
+        changes = []
+        for k in keys:
+            new_key = [new_values.get(c, v) for c, v in zip(self._key_columns, k)]
+            changes.append((change_log.DELETE, k))
+            changes.append((change_log.INSERT, new_key))
+        return changes
+
+    def _record_changes(self, changes):
+        """
+        Logs changes with their key values converted to one type per column, and compacted by the values MySQL
+        compares, so a key written as 7 and later as "7" is one row to the consumer.
+        """
+        if not change_log.is_enabled() or len(changes) == 0:
+            return
+        t = self._catalog.get_table(self._db_name, self._table_name)
+        types = t["column_types"] if t is not None else {}
+        converters = [_key_value_type(types.get(k, None)) for k in self._key_columns]
+        normalizers = self._key_normalizers()
+        changes = [(op, None if key is None else [f(v) for f, v in zip(converters, key)]) for op, key in changes]
+
+        def identity(key):
+            return tuple([f(v) for f, v in zip(normalizers, key)])
+        self._publish(lambda: RDBDataTable._change_log.append(self._full_table_name, changes, identity=identity))
+
+    def _record_reset(self):
+        if not change_log.is_enabled():
+            return
+        self._publish(lambda: RDBDataTable._change_log.reset(self._full_table_name))
+
+    def _publish(self, fn):
+        uow = transaction.current()
+        if uow is not None:
+            # Published only if the unit of work commits.
+            uow.on_commit(fn)
+        else:
+            fn()
+
+    def _write_by_template(self, sql, args, template, op, new_values=None):
+        """
+        Runs an update or delete by template and records it in the change log. A template that is the full primary
+        key logs that key. Any other template logs a reset marker: finding the keys would take a SELECT ... FOR
+        UPDATE before every such write, which doubles its statements and locks, and would hold every matching key
+        in memory.
+        :return: The number of rows affected.
+        """
+        res, d = dbutils.run_q(sql, args=args, connect_info=self._connect_info, commit=True)
+        if res == 0 or not change_log.is_enabled() or not self._key_columns:
+            return res
+        if template is not None and set(template.keys()) == set(self._key_columns) and \
+                not any([type(v) == dict for v in template.values()]):
+            key = [template[k] for k in self._key_columns]
+            self._record_changes(self._changes_for(op, [key], new_values))
+        else:
+            self._record_reset()
+        return res
+
+    def changes_since(self, seq, epoch=None, limit=1000, include_rows=False, field_list=None):
+        """
+        Incremental sync. A consumer remembers epoch and next from each response and passes them back.
+        :param seq: The last sequence number applied, 0 for everything retained.
+        :param epoch: The epoch seq came from.
+        :param limit: Maximum number of log entries to return.
+        :param include_rows: If True, each inserted or updated change carries the row as it is now, read with one
+            multi-key select.
+        :return: See change_log.ChangeLog.since().
+        """
+        result = RDBDataTable._change_log.since(self._full_table_name, seq, epoch=epoch, limit=limit)
+        if include_rows:
+            live = [c for c in result["changes"] if c["op"] != change_log.DELETE and c["key"] is not None]
+            rows = self.find_by_primary_keys([c["key"] for c in live], field_list=field_list) if live else []
+            for c, r in zip(live, rows):
+                c["row"] = r
+        return result
+
+    @classmethod
+    def get_change_log_stats(cls):
+        return cls._change_log.stats()
+
     def _get_key_map(self, target_name):
-        # -- THANK ALY AND ARA --
-        # Aly and Ara told me to get rid of this requirement or they would be unhappy.
-        #
-        pass
+        """
+        :param target_name: The name of a table in the same database.
+        :return: A list of (column in this table, column in target) pairs that relate the two tables. Cached with
+            the table metadata.
+        """
+        return self._get_metadata("key_map:" + target_name, lambda: self._load_key_map(target_name))
+
+    def _load_key_map(self, target_name):
+        target = self._catalog.get_table(self._db_name, target_name)
+        if target is None:
+            raise ValueError("Unknown table " + self._db_name + "." + target_name)
+        key_map = self.get_related_resources().get(target_name, None)
+        if key_map is not None:
+            return key_map
+        # No declared foreign key. Fall back to this table's primary key columns if the target has columns with
+        # the same names, e.g. people.playerID and batting.playerID in a schema loaded without constraints.
+        target_columns = set([c.lower() for c in target["columns"]])
+        if len(self._key_columns) > 0 and all([k.lower() in target_columns for k in self._key_columns]):
+            return [(k, k) for k in self._key_columns]
+        raise ValueError("No relationship from " + self._full_table_name + " to " + self._db_name + "." +
+                         target_name)
 
-    def navigate_path(self, pk, target_name, query_template, fields):
-        # -- THANK ALY AND ARA --
-        # Aly and Ara told me to get rid of this requirement or they would be unhappy.
-        #
-        pass
+    def _path_select(self, pk, target_name, template, fields, limit=None, offset=None, order_by=None):
+        if len(pk) != len(self._key_columns):
+            raise ValueError("Key " + str(pk) + " does not match key columns " + str(self._key_columns))
+        key_map = self._get_key_map(target_name)
+        self._catalog.validate_columns(self._db_name, target_name, [c for c in (template or {})] +
+                                       (fields or []) + dbutils.order_by_columns(order_by))
+        parent_key = dict(zip(self._key_columns, pk))
+        return dbutils.create_path_select(self._full_table_name, parent_key, self._db_name + "." + target_name,
+                                          key_map, template=template, fields=fields, order_by=order_by, limit=limit,
+                                          offset=offset)
+
+    def navigate_path(self, pk, target_name, query_template, fields, limit=None, offset=None, order_by=None):
+        """
+        :param pk: The values of this table's key columns, in order.
+        :param target_name: A related table.
+        :param query_template: A template on the target's columns, with or without operators.
+        :param fields: Target columns to return.
+        :return: The target rows related to the row with key pk, read with one statement (see
+            dbutils.create_path_select).
+        """
+        sql, args = self._path_select(pk, target_name, query_template, fields, limit=limit, offset=offset,
+                                      order_by=order_by)
+        res, d = dbutils.run_q(sql, args=args, connect_info=self._connect_info, commit=False, fetch=True, read=True,
+                               table=self._db_name + "." + target_name)
+        return list(d)
 
     def navigate_path_and_key(self, pk, target_name, tk, fields):
-        # -- THANK ALY AND ARA --
-        # Aly and Ara told me to get rid of this requirement or they would be unhappy.
-        #
-        pass
+        """
+        :param tk: The values of the target's key columns, in order.
+        :return: The target row with key tk if it is related to the row with key pk, otherwise None.
+        """
+        target_keys = self._catalog.get_primary_key_columns(self._db_name, target_name)
+        if target_keys is None:
+            raise ValueError("Unknown table " + self._db_name + "." + target_name)
+        if len(tk) != len(target_keys):
+            raise ValueError("Key " + str(tk) + " does not match key columns " + str(target_keys))
+        res = self.navigate_path(pk, target_name, dict(zip(target_keys, tk)), fields)
+        return res[0] if len(res) > 0 else None
@@ -0,0 +1,46 @@
+import src.data_service.data_table_adaptor as dta
+import src.data_service.AsyncRDBDataTable as AsyncRDBDataTable
+
+# Async wrappers around data_table_adaptor. The synchronous adaptor keeps the (bounded) cache of RDBDataTables,
+# so the async and sync apps share table objects, pools and caches when they run in one process. A cached table
+# is wrapped without going through the executor; only building one does.
+
+
+async def get_rdb_table(table_name, db_name, connect_info=None):
+    """
+    :param table_name: Name of the database table.
+    :param db_name: Schema/database name.
+    :param connect_info: Optional special connection information.
+    :return: An AsyncRDBDataTable for the table.
+    """
+    tbl = dta.get_cached_rdb_table(table_name, db_name)
+    if tbl is None:
+        tbl = await AsyncRDBDataTable.run_blocking(dta.get_rdb_table, table_name, db_name,
+                                                   connect_info=connect_info)
+    return AsyncRDBDataTable.AsyncRDBDataTable(tbl)
+
+
+reserved_query_params = dta.reserved_query_params
+
+
+def parse_query_template(query_params):
+    return dta.parse_query_template(query_params)
+
+
+def error_status(e):
+    return dta.error_status(e)
+
+
+def batch_options(body):
+    return dta.batch_options(body)
+
+
+async def get_tables(db_name):
+    return await AsyncRDBDataTable.run_blocking(dta.get_tables, db_name)
+
+
+async def get_databases():
+    """
+    :return: A list of databases/schema at this endpoint.
+    """
+    return await AsyncRDBDataTable.run_blocking(dta.get_databases)
@@ -0,0 +1,205 @@
+import threading
+import time
+import src.data_service.dbutils as dbutils
+import src.data_service.connection_pool as connection_pool
+
+
+class UnknownColumnError(ValueError):
+    """
+    Raised when a request names a column (in fields or a template) that the table does not have.
+    """
+    pass
+
+
+class Catalog:
+    """
+    Cached schema information for one MySQL server: databases, and per database the tables, columns (with types),
+    primary keys and foreign keys. A database is loaded from information_schema with four bulk queries the first
+    time it is used and reloaded after ttl seconds or on refresh(). A table that is not found causes one reload
+    of its database (at most every _miss_reload_interval seconds), so tables created since the load are seen.
+    """
+    _miss_reload_interval = 1
+
+    def __init__(self, connect_info, ttl=300):
+        """
+        :param connect_info: Connection information for the server. Any 'db' entry is ignored.
+        :param ttl: Seconds before cached information is reloaded.
+        """
+        self._connect_info = {k: v for k, v in connect_info.items() if k != "db"}
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._databases = None  # (list of names, time loaded)
+        self._schemas = {}  # db name -> (schema dictionary, time loaded)
+
+    def _fresh(self, loaded):
+        return time.time() - loaded < self._ttl
+
+    def _query(self, sql, args=None):
+        res, d = dbutils.run_q(sql, args=args, connect_info=self._connect_info, commit=False, fetch=True)
+        return d
+
+    def get_databases(self):
+        """
+        :return: The database names on the server, sorted.
+        """
+        entry = self._databases
+        if entry is None or not self._fresh(entry[1]):
+            d = self._query("select schema_name as name from information_schema.schemata order by schema_name")
+            entry = ([r["name"] for r in d], time.time())
+            self._databases = entry
+        return entry[0]
+
+    def _load_schema(self, db_name):
+        tables = {}
+        d = self._query("select table_name as table_name, table_type as table_type from information_schema.tables "
+                        "where table_schema=%s order by table_name", [db_name])
+        for r in d:
+            tables[r["table_name"]] = {"type": r["table_type"], "columns": [], "column_types": {},
+                                       "primary_key": [], "foreign_keys": [], "referenced_by": []}
+        d = self._query("select table_name as table_name, column_name as column_name, data_type as data_type, "
+                        "column_type as column_type, is_nullable as is_nullable, collation_name as collation_name "
+                        "from information_schema.columns where table_schema=%s "
+                        "order by table_name, ordinal_position", [db_name])
+        for r in d:
+            t = tables.get(r["table_name"], None)
+            if t is not None:
+                t["columns"].append(r["column_name"])
+                t["column_types"][r["column_name"]] = {"data_type": r["data_type"], "column_type": r["column_type"],
+                                                       "nullable": r["is_nullable"] == "YES",
+                                                       "collation": r["collation_name"]}
+        d = self._query("select table_name as table_name, column_name as column_name "
+                        "from information_schema.key_column_usage "
+                        "where table_schema=%s and constraint_name='PRIMARY' "
+                        "order by table_name, ordinal_position", [db_name])
+        for r in d:
+            t = tables.get(r["table_name"], None)
+            if t is not None:
+                t["primary_key"].append(r["column_name"])
+        # Foreign keys within the schema. Each one is recorded on the referencing table and, as referenced_by, on
+        # the referenced table, so relationships can be followed in both directions.
+        d = self._query("select table_name as table_name, constraint_name as constraint_name, "
+                        "column_name as column_name, referenced_table_name as referenced_table_name, "
+                        "referenced_column_name as referenced_column_name "
+                        "from information_schema.key_column_usage "
+                        "where table_schema=%s and referenced_table_schema=%s and referenced_table_name is not null "
+                        "order by table_name, constraint_name, ordinal_position", [db_name, db_name])
+        fks = {}
+        for r in d:
+            fk = fks.get((r["table_name"], r["constraint_name"]), None)
+            if fk is None:
+                fk = {"name": r["constraint_name"], "table": r["table_name"], "columns": [],
+                      "referenced_table": r["referenced_table_name"], "referenced_columns": []}
+                fks[(r["table_name"], r["constraint_name"])] = fk
+            fk["columns"].append(r["column_name"])
+            fk["referenced_columns"].append(r["referenced_column_name"])
+        for fk in fks.values():
+            if fk["table"] in tables and fk["referenced_table"] in tables:
+                tables[fk["table"]]["foreign_keys"].append(fk)
+                tables[fk["referenced_table"]]["referenced_by"].append(fk)
+        # Column names are compared case insensitively, like MySQL does.
+        for t in tables.values():
+            t["column_set"] = set([c.lower() for c in t["columns"]])
+        return tables
+
+    def _schema(self, db_name):
+        entry = self._schemas.get(db_name, None)
+        if entry is None or not self._fresh(entry[1]):
+            with self._lock:
+                entry = self._schemas.get(db_name, None)
+                if entry is None or not self._fresh(entry[1]):
+                    entry = (self._load_schema(db_name), time.time())
+                    self._schemas[db_name] = entry
+        return entry[0]
+
+    def get_tables(self, db_name):
+        """
+        :return: The table (and view) names in db_name, sorted.
+        """
+        return list(self._schema(db_name).keys())
+
+    def get_table(self, db_name, table_name):
+        """
+        :return: A dictionary with the table's type, columns (in order), column_types and primary_key, or None.
+        """
+        result = self._schema(db_name).get(table_name, None)
+        if result is None and self._expire_on_miss(db_name):
+            result = self._schema(db_name).get(table_name, None)
+        return result
+
+    def _expire_on_miss(self, db_name):
+        """
+        :return: True if db_name's cached schema was dropped so that the next use reloads it. It is only dropped if
+            it is older than _miss_reload_interval, so requests for a table that does not exist cannot keep the
+            catalog reloading.
+        """
+        with self._lock:
+            entry = self._schemas.get(db_name, None)
+            if entry is None or time.time() - entry[1] < self._miss_reload_interval:
+                return False
+            del self._schemas[db_name]
+            return True
+
+    def get_primary_key_columns(self, db_name, table_name):
+        t = self.get_table(db_name, table_name)
+        if t is None:
+            return None
+        return list(t["primary_key"])
+
+    def get_foreign_keys(self, db_name, table_name):
+        """
+        :return: (foreign keys of the table, foreign keys of other tables that reference it), or None if there is
+            no such table. Each foreign key is a dictionary with name, table, columns, referenced_table and
+            referenced_columns.
+        """
+        t = self.get_table(db_name, table_name)
+        if t is None:
+            return None
+        return list(t["foreign_keys"]), list(t["referenced_by"])
+
+    def validate_columns(self, db_name, table_name, names):
+        """
+        Checks column names before they are put into SQL.
+        :param names: An iterable of column names, or None.
+        :return: None. Raises UnknownColumnError naming the columns the table does not have.
+        """
+        if names is None:
+            return
+        t = self.get_table(db_name, table_name)
+        if t is None:
+            raise UnknownColumnError("Unknown table " + db_name + "." + table_name)
+        unknown = [n for n in names if str(n).lower() not in t["column_set"]]
+        if unknown:
+            raise UnknownColumnError("Unknown column(s) " + ",".join([str(n) for n in unknown]) + " in " +
+                                     db_name + "." + table_name)
+
+    def refresh(self, db_name=None):
+        """
+        Drops the cached information for db_name (or everything), so it is reloaded on next use.
+        """
+        with self._lock:
+            if db_name is None:
+                self._schemas = {}
+                self._databases = None
+            else:
+                self._schemas.pop(db_name, None)
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(connect_info):
+    """
+    :param connect_info: Connection information. Catalogs are per server, so 'db' does not matter.
+    :return: The shared Catalog for the server.
+    """
+    server_info = {k: v for k, v in connect_info.items() if k != "db"}
+    key = connection_pool.pool_key(server_info)
+    result = _catalogs.get(key, None)
+    if result is None:
+        with _catalogs_lock:
+            result = _catalogs.get(key, None)
+            if result is None:
+                result = Catalog(server_info)
+                _catalogs[key] = result
+    return result
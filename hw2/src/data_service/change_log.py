@@ -0,0 +1,152 @@
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+# The change log records the primary keys written through RDBDataTable, per table, with a sequence number, so a
+# consumer can ask for what changed since the last sequence number it saw instead of re-reading the table.
+# It is kept in memory by this process: the epoch changes when the process restarts, and each table keeps at
+# most _max_entries changes. A consumer whose epoch differs, or whose position has been dropped, is told to
+# reset (re-read the table once and continue from the returned position). A write whose keys are not known
+# without reading them (an update or delete by a template other than the full key) is logged as a reset marker,
+# which has the same effect for every consumer that has not seen it. Writes made by other processes or directly
+# in MySQL are not seen. DATA_SERVICE_CHANGE_LOG=0 turns recording off.
+_enabled = os.environ.get("DATA_SERVICE_CHANGE_LOG", "1") != "0"
+_max_entries = 100000
+
+INSERT = "insert"
+UPDATE = "update"
+DELETE = "delete"
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+class ChangeLog:
+    """
+    Append-only, bounded per table logs of (sequence number, operation, key, time, identity). Sequence numbers
+    increase across all tables. identity is what compaction groups changes by.
+    """
+
+    def __init__(self, max_entries=_max_entries):
+        self._max_entries = max_entries
+        self._epoch = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._tables = {}  # table -> {"entries": deque, "dropped_through": seq of the last dropped entry}
+
+    def epoch(self):
+        return self._epoch
+
+    def append(self, table, changes, identity=None):
+        """
+        :param table: Fully qualified table name.
+        :param changes: A list of (operation, key) pairs. key is a list of primary key values, or None if the key
+            is not known (an insert that left an auto increment key to the server).
+        :param identity: A function mapping a key to a hashable value that is equal for keys naming the same row
+            (e.g. 7 and "7"). Defaults to the key itself.
+        :return: The sequence number of the last change.
+        """
+        now = time.time()
+        with self._lock:
+            log = self._log(table)
+            entries = log["entries"]
+            for op, key in changes:
+                self._seq += 1
+                if key is None:
+                    entries.append((self._seq, op, None, now, None))
+                else:
+                    key = tuple(key)
+                    entries.append((self._seq, op, key, now, identity(key) if identity is not None else key))
+            while len(entries) > self._max_entries:
+                log["dropped_through"] = entries.popleft()[0]
+            return self._seq
+
+    def _log(self, table):
+        log = self._tables.get(table, None)
+        if log is None:
+            log = {"entries": deque(), "dropped_through": 0, "resets": 0}
+            self._tables[table] = log
+        return log
+
+    def reset(self, table):
+        """
+        Records that rows of table changed without saying which. Consumers that have not seen the returned
+        sequence number are told to reset, and the entries before it are dropped.
+        :return: The sequence number of the marker.
+        """
+        with self._lock:
+            log = self._log(table)
+            self._seq += 1
+            log["entries"].clear()
+            log["dropped_through"] = self._seq
+            log["resets"] += 1
+            return self._seq
+
+    def since(self, table, seq, epoch=None, limit=1000):
+        """
+        :param table: Fully qualified table name.
+        :param seq: The last sequence number the consumer has applied, 0 (or None) for everything retained.
+        :param epoch: The epoch the consumer's seq came from, or None.
+        :param limit: Maximum number of log entries to read, at least 1.
+        :return: {"epoch", "since", "next", "reset", "has_more", "changes"}. changes has one entry per key, its
+            latest operation and sequence number, in sequence order; entries with key None mean "unknown row
+            inserted". next is the seq to ask from next time (seq itself if there was nothing new). If reset is True
+            the consumer must re-read the table, then continue from next. Raises ValueError for limit < 1.
+        """
+        seq = 0 if seq is None else int(seq)
+        limit = int(limit)
+        if limit < 1:
+            raise ValueError("limit must be at least 1.")
+        with self._lock:
+            log = self._tables.get(table, None)
+            current = self._seq
+            if (epoch is not None and epoch != self._epoch) or \
+                    (log is not None and seq < log["dropped_through"]):
+                return {"epoch": self._epoch, "since": seq, "next": current, "reset": True, "has_more": False,
+                        "changes": []}
+            if log is None:
+                return {"epoch": self._epoch, "since": seq, "next": seq, "reset": False, "has_more": False,
+                        "changes": []}
+            entries = log["entries"]
+            # Entries are in sequence order; skip the ones already seen with a binary search.
+            lo, hi = 0, len(entries)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if entries[mid][0] <= seq:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            selected = [entries[i] for i in range(lo, min(lo + limit, len(entries)))]
+            has_more = lo + limit < len(entries)
+        # Compact: a consumer only needs the latest operation for each key.
+        latest = {}
+        for s, op, key, t, ident in selected:
+            latest[ident if key is not None else ("unknown", s)] = (s, op, key, t)
+        changes = [{"seq": s, "op": op, "key": None if key is None else list(key), "time": t}
+                   for s, op, key, t in sorted(latest.values(), key=lambda e: e[0])]
+        next_seq = selected[-1][0] if len(selected) > 0 else seq
+        return {"epoch": self._epoch, "since": seq, "next": next_seq, "reset": False, "has_more": has_more,
+                "changes": changes}
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": _enabled,
+                "epoch": self._epoch,
+                "seq": self._seq,
+                "tables": {t: {"entries": len(log["entries"]), "dropped_through": log["dropped_through"],
+                               "resets": log["resets"]} for t, log in self._tables.items()}
+            }
@@ -0,0 +1,181 @@
+import io
+import numpy as np
+from pymysql.constants import FIELD_TYPE
+
+# pyarrow is optional. With it, exports can be Arrow IPC streams or Parquet. Without it only the NumPy .npz
+# format is available.
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+_int_types = {FIELD_TYPE.TINY, FIELD_TYPE.SHORT, FIELD_TYPE.LONG, FIELD_TYPE.LONGLONG, FIELD_TYPE.INT24,
+              FIELD_TYPE.YEAR}
+_float_types = {FIELD_TYPE.FLOAT, FIELD_TYPE.DOUBLE}
+_decimal_types = {FIELD_TYPE.DECIMAL, FIELD_TYPE.NEWDECIMAL}
+_date_types = {FIELD_TYPE.DATE, FIELD_TYPE.NEWDATE}
+_datetime_types = {FIELD_TYPE.DATETIME, FIELD_TYPE.TIMESTAMP}
+
+FORMATS = {
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+    "npz": "application/octet-stream"
+}
+
+
+def available_formats():
+    if pa is None:
+        return ["npz"]
+    return ["arrow", "parquet", "npz"]
+
+
+class _StreamSink(io.RawIOBase):
+    """
+    A write only file that hands back what was written since the last drain(), so the writers' output can be sent
+    while they keep writing. tell() reports the total written, which is all the Arrow and Parquet writers need.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._pos = 0
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def write(self, b):
+        b = bytes(b)
+        self._chunks.append(b)
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._pos
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _decimal_precision(d, unsigned):
+    """
+    :param d: A cursor.description entry for a DECIMAL column.
+    :return: The declared precision. The driver reports the display length, which also counts the decimal point
+        and, for signed columns, the sign.
+    """
+    length, scale = d[4], d[5] or 0
+    return max(1, length - (1 if scale > 0 else 0) - (0 if unsigned else 1))
+
+
+def _arrow_type(d, unsigned):
+    """
+    :param d: A cursor.description entry.
+    :param unsigned: True if the column is UNSIGNED.
+    :return: The Arrow type for the column, from its declared type, so every batch gets the same schema.
+    """
+    type_code = d[1]
+    if type_code == FIELD_TYPE.LONGLONG and unsigned:
+        return pa.uint64()
+    if type_code in _int_types:
+        return pa.int64()
+    if type_code in _float_types:
+        return pa.float64()
+    if type_code in _date_types:
+        return pa.date32()
+    if type_code in _datetime_types:
+        return pa.timestamp("us")
+    if type_code in _decimal_types:
+        precision, scale = _decimal_precision(d, unsigned), d[5] or 0
+        # DECIMAL goes up to 65 digits; decimal128 holds 38.
+        if precision > 38:
+            return pa.decimal256(precision, scale)
+        return pa.decimal128(precision, scale)
+    return pa.string()
+
+
+def _arrow_batch(description, columns, types):
+    arrays = []
+    for i in range(len(description)):
+        t = types[i]
+        values = columns[i]
+        if t == pa.string():
+            values = [v if v is None or type(v) == str else str(v) for v in values]
+        arrays.append(pa.array(values, type=t))
+    return pa.RecordBatch.from_arrays(arrays, names=[d[0] for d in description])
+
+
+def _numpy_column(type_code, values, unsigned=False):
+    if type_code in _int_types:
+        if None in values:
+            return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+        return np.array(values, dtype=np.uint64 if unsigned and type_code == FIELD_TYPE.LONGLONG else np.int64)
+    if type_code in _float_types or type_code in _decimal_types:
+        return np.array([np.nan if v is None else float(v) for v in values], dtype=np.float64)
+    if type_code in _date_types:
+        return np.array([np.datetime64("NaT") if v is None else v for v in values], dtype="datetime64[D]")
+    if type_code in _datetime_types:
+        return np.array([np.datetime64("NaT") if v is None else v for v in values], dtype="datetime64[us]")
+    # Strings and everything else. NULL becomes "" so the array does not need pickling.
+    return np.array(["" if v is None else str(v) for v in values], dtype=np.str_)
+
+
+def export_batches(description, batches, fmt, unsigned_columns=None):
+    """
+    :param description: cursor.description of the query. Column types, including decimal precision and scale, come
+        from here rather than from the values.
+    :param batches: An iterable of lists of row tuples.
+    :param unsigned_columns: Names (lower case) of UNSIGNED columns, which cursor.description does not say.
+    :param fmt: 'arrow' (Arrow IPC stream), 'parquet' or 'npz'.
+    :return: A generator of bytes. Arrow and Parquet output is produced batch by batch; npz is a zip file with
+        one array per column and is produced at the end.
+    """
+    if fmt not in FORMATS:
+        raise ValueError("Unknown export format " + str(fmt))
+    if fmt in ("arrow", "parquet") and pa is None:
+        raise ValueError("Export format " + fmt + " requires pyarrow.")
+    type_codes = [d[1] for d in description]
+    unsigned_columns = unsigned_columns or set()
+    unsigned = [str(d[0]).lower() in unsigned_columns for d in description]
+
+    if fmt == "npz":
+        parts = [[] for d in description]
+        for rows in batches:
+            columns = list(zip(*rows))
+            for i in range(len(columns)):
+                parts[i].append(_numpy_column(type_codes[i], list(columns[i]), unsigned[i]))
+        arrays = {}
+        for i in range(len(description)):
+            if parts[i]:
+                arrays[description[i][0]] = np.concatenate(parts[i])
+            else:
+                arrays[description[i][0]] = _numpy_column(type_codes[i], [], unsigned[i])
+        buf = io.BytesIO()
+        np.savez(buf, **arrays)
+        yield buf.getvalue()
+        return
+
+    types = [_arrow_type(d, u) for d, u in zip(description, unsigned)]
+    schema = pa.schema([(d[0], t) for d, t in zip(description, types)])
+    sink = _StreamSink()
+    if fmt == "arrow":
+        writer = pa.ipc.new_stream(pa.PythonFile(sink, mode="w"), schema)
+    else:
+        writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema)
+    for rows in batches:
+        columns = [list(c) for c in zip(*rows)]
+        batch = _arrow_batch(description, columns, types)
+        if fmt == "arrow":
+            writer.write_batch(batch)
+        else:
+            writer.write_table(pa.Table.from_batches([batch]))
+        data = sink.drain()
+        if data:
+            yield data
+    writer.close()
+    yield sink.drain()
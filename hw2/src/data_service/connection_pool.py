@@ -0,0 +1,297 @@
+import hashlib
+import pymysql
+import threading
+import time
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger()
+
+# Connection settings that every pooled connection gets unless connect_info overrides them. Autocommit means a
+# single statement needs no separate COMMIT, and a pooled connection never carries an old read snapshot from one
+# borrower to the next. Multi-statement transactions begin() explicitly (see transaction.py).
+_connection_defaults = {
+    "charset": "utf8mb4",
+    "cursorclass": pymysql.cursors.DictCursor,
+    "autocommit": True
+}
+
+# Keys in connect_info that describe read replicas (see replicas.py). They are not passed on to pymysql.connect
+# and do not change which pool the primary's connections come from.
+replica_option_keys = ("replicas", "replica_selection", "replica_lag", "replica_retry_interval")
+
+# Keys in connect_info that describe the pool itself and are not passed on to pymysql.connect.
+_pool_option_keys = ("pool_size", "pool_timeout", "health_check_interval") + replica_option_keys
+
+_default_pool_size = 10
+_default_pool_timeout = 30
+_default_health_check_interval = 30
+
+# One pool per distinct connect_info. Guarded by _pools_lock.
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class PoolTimeoutError(Exception):
+    """
+    Raised when no connection becomes available within the pool timeout.
+    """
+    pass
+
+
+def pool_key(connect_info):
+    """
+    :param connect_info: A dictionary of connection information.
+    :return: A hashable key identifying the pool for this connect_info. The password is in the key as a SHA-256
+        digest, so logins that differ only by password get separate pools without the key holding the password.
+    """
+    items = []
+    for k in sorted(connect_info.keys()):
+        if k in _pool_option_keys:
+            continue
+        v = connect_info[k]
+        if k == "password":
+            v = hashlib.sha256(v if isinstance(v, bytes) else str(v).encode("utf-8")).hexdigest()
+        items.append((k, str(v)))
+    return tuple(items)
+
+
+def pool_name(key):
+    """
+    :param key: A pool_key().
+    :return: user@host:port for reports. The password digest is left out.
+    """
+    d = dict(key)
+    return str(d.get("user", "")) + "@" + str(d.get("host", "")) + ":" + str(d.get("port", ""))
+
+
+class ConnectionPool:
+    """
+    A bounded, thread-safe pool of PyMySQL connections that all share the same connect_info.
+    Connections are created lazily up to max_size. Idle connections that have not been used for
+    health_check_interval seconds are pinged (and reconnected if stale) before being handed out.
+    """
+
+    def __init__(self, connect_info, max_size=None, timeout=None, health_check_interval=None):
+        """
+        :param connect_info: Dictionary of parameters for pymysql.connect. May also contain pool_size,
+            pool_timeout and health_check_interval.
+        :param max_size: Maximum number of open connections.
+        :param timeout: Seconds to wait for a free connection before raising PoolTimeoutError.
+        :param health_check_interval: Seconds a connection may sit idle before it is pinged on checkout.
+        """
+        self._connect_args = dict(_connection_defaults)
+        for k, v in connect_info.items():
+            if k not in _pool_option_keys:
+                self._connect_args[k] = v
+        if max_size is None:
+            max_size = connect_info.get("pool_size", _default_pool_size)
+        if timeout is None:
+            timeout = connect_info.get("pool_timeout", _default_pool_timeout)
+        if health_check_interval is None:
+            health_check_interval = connect_info.get("health_check_interval", _default_health_check_interval)
+        self._max_size = max_size
+        self._timeout = timeout
+        self._health_check_interval = health_check_interval
+        self._cond = threading.Condition(threading.Lock())
+        self._idle = []  # List of (connection, time returned to the pool).
+        self._size = 0  # Open connections, idle or checked out.
+        self._checkouts = 0
+        self._waits = 0
+        self._total_wait_time = 0.0
+        self._max_wait_time = 0.0
+        self._reconnects = 0
+        self._discards = 0
+
+    def _connect(self):
+        return pymysql.connect(**self._connect_args)
+
+    def _is_healthy(self, cnx, last_used):
+        if time.time() - last_used < self._health_check_interval:
+            return True
+        try:
+            cnx.ping(reconnect=True)
+            return True
+        except Exception as e:
+            logger.debug("Discarding stale pooled connection: " + str(e))
+            return False
+
+    def checkout(self):
+        """
+        :return: A connection from the pool. Blocks up to the pool timeout if the pool is exhausted.
+        """
+        start = time.time()
+        waited = False
+        with self._cond:
+            while True:
+                if self._idle:
+                    cnx, last_used = self._idle.pop()
+                    break
+                if self._size < self._max_size:
+                    cnx, last_used = None, None
+                    self._size += 1
+                    break
+                remaining = self._timeout - (time.time() - start)
+                if remaining <= 0:
+                    raise PoolTimeoutError("No connection available after " + str(self._timeout) + " seconds.")
+                waited = True
+                self._cond.wait(remaining)
+            wait_time = time.time() - start
+            self._checkouts += 1
+            if waited:
+                self._waits += 1
+            self._total_wait_time += wait_time
+            self._max_wait_time = max(self._max_wait_time, wait_time)
+
+        # Connecting and pinging happen outside the lock so a slow server does not block other threads.
+        try:
+            if cnx is None:
+                cnx = self._connect()
+            elif not self._is_healthy(cnx, last_used):
+                self._close_quietly(cnx)
+                cnx = self._connect()
+                with self._cond:
+                    self._reconnects += 1
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        return cnx
+
+    def checkin(self, cnx, discard=False):
+        """
+        :param cnx: A connection previously returned by checkout().
+        :param discard: If True, the connection is closed instead of being returned to the idle list. Use this
+            after an error that may have left the connection in a bad state.
+        :return: None
+        """
+        if discard:
+            self._close_quietly(cnx)
+            with self._cond:
+                self._size -= 1
+                self._discards += 1
+                self._cond.notify()
+            return
+        with self._cond:
+            self._idle.append((cnx, time.time()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager that checks a connection out and returns it to the pool on exit. The connection is
+        discarded if the body raises a connection level error and rolled back on any other error.
+        """
+        cnx = self.checkout()
+        discard = False
+        try:
+            yield cnx
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+            discard = True
+            raise
+        except Exception:
+            # Do not hand a half finished transaction to the next borrower.
+            try:
+                cnx.rollback()
+            except Exception:
+                discard = True
+            raise
+        finally:
+            self.checkin(cnx, discard=discard)
+
+    def close(self):
+        """
+        Closes all idle connections. Checked out connections are closed when they are returned with discard=True,
+        or simply dropped with the pool.
+        """
+        with self._cond:
+            idle = self._idle
+            self._idle = []
+            self._size -= len(idle)
+        for cnx, last_used in idle:
+            self._close_quietly(cnx)
+
+    def stats(self):
+        """
+        :return: A dictionary of metrics that are useful for sizing the pool.
+        """
+        with self._cond:
+            idle = len(self._idle)
+            result = {
+                "max_size": self._max_size,
+                "size": self._size,
+                "idle": idle,
+                "in_use": self._size - idle,
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "total_wait_time": self._total_wait_time,
+                "avg_wait_time": self._total_wait_time / self._checkouts if self._checkouts else 0.0,
+                "max_wait_time": self._max_wait_time,
+                "reconnects": self._reconnects,
+                "discards": self._discards
+            }
+        return result
+
+    @staticmethod
+    def _close_quietly(cnx):
+        try:
+            cnx.close()
+        except Exception:
+            pass
+
+
+def get_pool(connect_info):
+    """
+    :param connect_info: A dictionary of connection information.
+    :return: The shared pool for this connect_info, creating it on first use.
+    """
+    key = pool_key(connect_info)
+    pool = _pools.get(key, None)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key, None)
+            if pool is None:
+                pool = ConnectionPool(connect_info)
+                _pools[key] = pool
+    return pool
+
+
+def close_pool(connect_info):
+    """
+    Closes the idle connections of the pool for connect_info, if there is one. The pool stays registered and
+    reconnects on the next checkout.
+    """
+    pool = _pools.get(pool_key(connect_info), None)
+    if pool is not None:
+        pool.close()
+
+
+def get_pool_stats():
+    """
+    :return: A dictionary mapping a readable pool name (user@host:port/db) to the stats for that pool. The
+        password digest in the pool key is not part of the name.
+    """
+    with _pools_lock:
+        pools = list(_pools.items())
+    result = {}
+    for key, pool in pools:
+        name = pool_name(key) + "/" + str(dict(key).get("db", ""))
+        base, n = name, 1
+        while name in result:
+            # Same login with another password.
+            n += 1
+            name = base + " (" + str(n) + ")"
+        result[name] = pool.stats()
+    return result
+
+
+def close_all():
+    """
+    Closes the idle connections in every pool and forgets the pools.
+    """
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
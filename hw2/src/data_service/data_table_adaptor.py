@@ -1,12 +1,32 @@
 import pymysql
 import src.data_service.dbutils as dbutils
 import src.data_service.RDBDataTable as RDBDataTable
+import src.data_service.columnar_export as columnar_export
+import src.data_service.catalog as catalog
+import src.data_service.connection_pool as connection_pool
+import src.data_service.table_registry as table_registry
+import src.data_service.index_advisor as index_advisor
+import src.data_service.replicas as replicas
 import copy
+import os
 
 # The REST application server app.py will be handling multiple requests over a long period of time.
 # It is inefficient to create an instance of RDBDataTable for each request.  This is a cache of created
-# instances.
-_db_tables = {}
+# instances. It is bounded: the least recently used table is evicted and closed when it is full, and the idle
+# connections of its pool are closed once no cached table uses that pool.
+_max_tables = 256
+
+
+def _close_table(key, tbl):
+    tbl.close()
+    pool_key = connection_pool.pool_key(tbl._connect_info)
+    for other in _db_tables.values():
+        if connection_pool.pool_key(other._connect_info) == pool_key:
+            return
+    connection_pool.close_pool(tbl._connect_info)
+
+
+_db_tables = table_registry.TableRegistry(max_size=_max_tables, on_evict=_close_table)
 
 _default_connect_info = {"host": "localhost",
               "port": 3306,
@@ -15,6 +35,42 @@ _default_connect_info = {"host": "localhost",
               "cursorclass": pymysql.cursors.DictCursor}
 
 
+def _replicas_from_env(value):
+    """
+    :param value: DATA_SERVICE_REPLICAS, e.g. "replica1:3306,localhost:3307".
+    :return: The replicas list for connect_info.
+    """
+    result = []
+    for entry in value.split(","):
+        entry = entry.strip()
+        if entry == "":
+            continue
+        host, sep, port = entry.partition(":")
+        replica = {"host": host}
+        if port != "":
+            replica["port"] = int(port)
+        result.append(replica)
+    return result
+
+
+# Reads can be spread over replicas named in DATA_SERVICE_REPLICAS (see replicas.py), e.g. a second local
+# server for testing. DATA_SERVICE_REPLICA_SELECTION is round_robin (default) or least_outstanding.
+if os.environ.get("DATA_SERVICE_REPLICAS", ""):
+    _default_connect_info["replicas"] = _replicas_from_env(os.environ["DATA_SERVICE_REPLICAS"])
+    _default_connect_info["replica_selection"] = os.environ.get("DATA_SERVICE_REPLICA_SELECTION", "round_robin")
+
+
+def default_connect_info(db_name):
+    """
+    :param db_name: Schema/database name.
+    :return: A copy of the service's default connection information for db_name. Sync and async tables built
+        without explicit connection information both use it, so they share pools and caches.
+    """
+    result = copy.deepcopy(_default_connect_info)
+    result['db'] = db_name
+    return result
+
+
 def get_rdb_table(table_name, db_name, key_columns=None, connect_info=None):
     """
     :param table_name: Name of the database table.
@@ -25,36 +81,150 @@ def get_rdb_table(table_name, db_name, key_columns=None, connect_info=None):
     :return:
     """
     if connect_info is None:
-        _connect_info = copy.deepcopy(_default_connect_info)
-        _connect_info['db'] = db_name
-    global _db_tables
+        _connect_info = default_connect_info(db_name)
+    else:
+        _connect_info = connect_info
     # We use the fully qualified table name as the key into the cache, e.g. lahman2019clean.people
     key = db_name + "." + table_name
-    # Have we already created and cache the data table?
-    result = _db_tables.get(key, None)
-    # We have not yet accessed this table.
-    if result is None:
-        # Make an RDBDataTable for this database table.
-        result = RDBDataTable.RDBDataTable(table_name, db_name, key_columns=key_columns, connect_info=_connect_info)
-        # Add to the cache.
-        _db_tables[key] = result
-    return result
+    # Make an RDBDataTable for this database table if we have not yet accessed it. Concurrent first requests
+    # share one build.
+    return _db_tables.get(key, lambda: RDBDataTable.RDBDataTable(table_name, db_name, key_columns=key_columns,
+                                                                 connect_info=_connect_info))
+
+
+def get_cached_rdb_table(table_name, db_name):
+    """
+    :return: The cached RDBDataTable for db_name.table_name, or None if it has not been built (or was evicted).
+        Does not touch the database.
+    """
+    return _db_tables.peek(db_name + "." + table_name)
+
+
+def get_table_registry_stats():
+    """
+    :return: Size, hits, misses, evictions and build times of the RDBDataTable cache, and the cached table names.
+    """
+    return _db_tables.stats()
+
+
+# Query parameters that shape the response instead of filtering rows, and whether each is a comma separated list.
+# app.py and async_app.py remove them from the query parameters before the rest become the template.
+reserved_query_params = [("fields", True), ("order_by", True), ("limit", False), ("offset", False), ("cursor", False),
+                         ("batch_size", False), ("stream", False), ("format", False), ("export", False),
+                         ("count", False), ("group_by", True), ("agg", True)]
+
+
+def error_status(e):
+    """
+    :param e: An exception raised while serving a request.
+    :return: (HTTP status, message). ValueErrors come from bad input, e.g. an unknown column in fields or the
+        template, a bad operator or a bad page token, and are 400 with their message. Anything else is 504.
+    """
+    if isinstance(e, ValueError):
+        return 400, str(e)
+    return 504, "Internal error."
+
+
+def batch_options(body):
+    """
+    :param body: The body of a _batch request.
+    :return: (chunk_size, commit_interval) from the body, each None or a positive int. Raises ValueError otherwise.
+    """
+    return tuple([RDBDataTable._positive_int_or_none(body.get(name, None), name)
+                  for name in ("chunk_size", "commit_interval")])
+
+
+def parse_query_template(query_params):
+    """
+    :param query_params: Query parameters other than fields, limit, offset etc.
+    :return: The template for find_by_template. column__op=value applies an operator, see
+        dbutils.parse_query_template.
+    """
+    return dbutils.parse_query_template(query_params)
 
 
 def get_tables(db_name):
-    _connect_info = copy.deepcopy(_default_connect_info)
-    _connect_info['db'] = db_name
-    _conn = pymysql.connect(**_connect_info)
-    sql = "show tables"
-    res, d = dbutils.run_q(sql, conn=_conn)
-    return d
+    """
+    :param db_name: Schema/database name.
+    :return: The tables in the database, in the same form as SHOW TABLES, from the catalog cache.
+    """
+    names = catalog.get_catalog(_default_connect_info).get_tables(db_name)
+    return [{"Tables_in_" + db_name: n} for n in names]
 
 
 def get_databases():
     """
-    :return: A list of databases/schema at this endpoint.
+    :return: A list of databases/schema at this endpoint, in the same form as SHOW DATABASES, from the catalog
+        cache.
+    """
+    names = catalog.get_catalog(_default_connect_info).get_databases()
+    return [{"Database": n} for n in names]
+
+
+def refresh_catalog(db_name=None):
+    """
+    Reloads the cached schema information for db_name, or for everything, on next use.
+    """
+    catalog.get_catalog(_default_connect_info).refresh(db_name)
+
+
+def get_pool_stats():
+    """
+    :return: Connection pool metrics (size, idle, in use, checkouts, wait times) keyed by pool.
+    """
+    return dbutils.get_pool_stats()
+
+
+def get_replica_stats():
+    """
+    :return: Per replica set: reads sent to the primary, and per replica health, outstanding reads and failures.
+    """
+    return replicas.get_stats()
+
+
+def get_sql_cache_stats():
+    """
+    :return: Size and hit/miss/eviction counters for the generated SQL text cache.
+    """
+    return dbutils.get_sql_cache_stats()
+
+
+def get_result_cache_stats():
+    """
+    :return: Result cache usage, with hits, misses and bytes held per table.
+    """
+    return RDBDataTable.RDBDataTable.get_result_cache_stats()
+
+
+def get_index_advice(min_count=1, table=None):
+    """
+    :param min_count: Only report query shapes seen at least this often.
+    :param table: Only report on this db.table.
+    :return: The recorded template shapes with their EXPLAIN results and suggested composite indexes.
+    """
+    return {"stats": index_advisor.stats(), "shapes": index_advisor.report(min_count=min_count, table=table)}
+
+
+def get_single_flight_stats():
+    """
+    :return: Counters for identical concurrent reads that were executed versus coalesced.
     """
-    _conn = pymysql.connect(**_default_connect_info)
-    sql = "show databases"
-    res, d = dbutils.run_q(sql, conn=_conn)
-    return d
+    return RDBDataTable.RDBDataTable.get_single_flight_stats()
+
+
+def get_change_log_stats():
+    """
+    :return: The change log epoch, last sequence number, and entries held per table.
+    """
+    return RDBDataTable.RDBDataTable.get_change_log_stats()
+
+
+def get_export_formats():
+    """
+    :return: The columnar export formats available in this installation.
+    """
+    return columnar_export.available_formats()
+
+
+def get_export_content_type(fmt):
+    return columnar_export.FORMATS[fmt]
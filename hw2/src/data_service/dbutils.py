@@ -1,8 +1,16 @@
 import pymysql
 import logging
+import src.data_service.connection_pool as connection_pool
+import src.data_service.transaction as transaction
+import src.data_service.sql_cache as sql_cache
+import src.data_service.instrumentation as instrumentation
+import src.data_service.replicas as replicas
 
 logger = logging.getLogger()
 
+# Generated SQL text, keyed by statement shape. The builders below only do string work on a miss.
+_sql_cache = sql_cache.SQLCache(max_size=1024)
+
 
 def get_connection(connect_info):
     """
@@ -13,7 +21,14 @@ def get_connection(connect_info):
     return cnx
 
 
-def run_q(sql, args=None, fetch=True, cur=None, conn=None, commit=True):
+def get_pool_stats():
+    """
+    :return: Metrics for every connection pool that has been used so far.
+    """
+    return connection_pool.get_pool_stats()
+
+
+def run_q(sql, args=None, fetch=True, cur=None, conn=None, commit=True, connect_info=None, read=False, table=None):
     """
     Helper function to run an SQL statement.
     This is a modification that better supports HW1. An RDBDataTable MUST have a connection specified by
@@ -27,109 +42,666 @@ def run_q(sql, args=None, fetch=True, cur=None, conn=None, commit=True):
     :param cur: The cursor to use. This is wizard stuff. Do not worry about it for now.
         DO NOT PASS CURSORS for HW1.
     :param commit: This is wizard stuff. Do not worry about it.
+    :param connect_info: If conn and cur are None, a connection is checked out of the shared pool for this
+        connect_info and returned to the pool when the statement completes. If a unit of work is active on
+        this thread (see transaction.py), its pinned connection is used instead and commit is ignored.
+    :param read: The statement only reads. If connect_info names replicas (see replicas.py), it may be sent to one.
+    :param table: For reads, the table read. Reads of a table written recently by this process use the primary.
     :return: A pair of the form (execute response, fetched data). There will only be fetched data if
         the fetch parameter is True. 'execute response' is the return from the connection.execute, which
         is typically the number of rows effected.
     """
+    if conn is None and cur is None and connect_info is not None:
+        uow = transaction.current()
+        if uow is not None:
+            # Inside a unit of work: use its pinned connection and leave the commit to it.
+            return run_q(sql, args=args, fetch=fetch, conn=uow.connection(connect_info), commit=False)
+        replica_set = replicas.get_replica_set(connect_info) if read else None
+        if replica_set is not None:
+            return replica_set.run_read(lambda cnx: run_q(sql, args=args, fetch=fetch, conn=cnx, commit=False),
+                                        table)
+        with connection_pool.get_pool(connect_info).connection() as pooled_conn:
+            return run_q(sql, args=args, fetch=fetch, conn=pooled_conn, commit=commit)
+
     cursor_created = False
     connection_created = False
     try:
-        if conn is None:
+        if conn is None and cur is None:
             raise ValueError("In this implementation, conn cannot be None.")
+        if conn is None:
+            conn = cur.connection
         if cur is None:
             cursor_created = True
             cur = conn.cursor()
-        if args is not None:
-            log_message = cur.mogrify(sql, args)
-        else:
-            log_message = sql
-        logger.debug("Executing SQL = " + log_message)
+        # mogrify does a full client side interpolation, so only pay for it when the message will be logged.
+        if logger.isEnabledFor(logging.DEBUG):
+            if args is not None:
+                log_message = cur.mogrify(sql, args)
+            else:
+                log_message = sql
+            logger.debug("Executing SQL = " + log_message)
+        started = instrumentation.start()
+        statement = sql.lstrip()[:6].lower() if started is not None else None
         res = cur.execute(sql, args)
+        t = instrumentation.observe("sql", statement, "execute", started)
         if fetch:
             data = cur.fetchall()
         else:
             data = None
-        if commit:  # Do not ask.
+        t = instrumentation.observe("sql", statement, "fetch", t)
+        # In autocommit mode the server already committed the statement, so skip the extra round trip.
+        if commit and not conn.get_autocommit():  # Do not ask.
             conn.commit()
+            instrumentation.observe("sql", statement, "commit", t)
+        instrumentation.observe_query(sql, args, started)
     except Exception as e:
         raise e
+    finally:
+        if cursor_created:
+            cur.close()
 
     return res, data
 
 
+def run_many(sql, args_list, conn, commit=False):
+    """
+    Run one statement for many sets of args with cursor.executemany(). For INSERT ... VALUES statements
+    PyMySQL rewrites this into multi-row VALUES lists, so the rows go to the server in a few round trips.
+    :param sql: SQL template with placeholders for parameters.
+    :param args_list: A list of args, one entry per execution.
+    :param conn: The database connection to use.
+    :param commit: Commit after the statement. Callers batching several statements into one transaction
+        leave this False and commit themselves.
+    :return: The number of rows affected.
+    """
+    logger.debug("Executing SQL " + str(len(args_list)) + " times = " + sql)
+    cur = conn.cursor()
+    try:
+        res = cur.executemany(sql, args_list)
+        if commit:
+            conn.commit()
+    finally:
+        cur.close()
+    return res
+
+
+# A template maps columns to values. A plain value means equality. A dictionary of operators means every
+# operator must hold, e.g. {"yearID": {"gte": 1990, "lt": 2000}, "teamID": {"in": ["BOS", "NYA"]}}.
+#   eq, ne, gt, gte, lt, lte: comparison with one value.
+#   in: a list of values.
+#   like: a prefix. % and _ in the value match literally.
+#   between: a list [low, high], inclusive.
+#   is_null: True for IS NULL, False for IS NOT NULL.
+_comparison_ops = {"eq": "=", "ne": "<>", "gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+template_ops = ("eq", "ne", "gt", "gte", "lt", "lte", "in", "like", "between", "is_null")
+
+
+def _column_shape(column, value):
+    """
+    :return: The operators applied to one column, in sorted order, as (op, n) pairs. n is the number of values for
+        in and the truth value for is_null; the SQL text depends on both.
+    """
+    if type(value) != dict:
+        return (("eq", None),)
+    if len(value) == 0:
+        raise ValueError("No operator given for column " + column)
+    shape = []
+    for op in sorted(value.keys()):
+        v = value[op]
+        if op in _comparison_ops or op == "like":
+            shape.append((op, None))
+        elif op == "in":
+            if type(v) not in (list, tuple):
+                raise ValueError("in for column " + column + " needs a list of values.")
+            shape.append((op, len(v)))
+        elif op == "between":
+            if type(v) not in (list, tuple) or len(v) != 2:
+                raise ValueError("between for column " + column + " needs a list [low, high].")
+            shape.append((op, None))
+        elif op == "is_null":
+            shape.append((op, bool(v)))
+        else:
+            raise ValueError("Unknown operator " + str(op) + " for column " + column + ". Use one of " +
+                             ",".join(template_ops))
+    return tuple(shape)
+
+
+def _template_shape(template):
+    """
+    :param template: A template or None.
+    :return: ((column, column shape), ...) with the columns in sorted order. Terms are always emitted in this
+        order so that templates with the same columns and operators in a different order share one cached
+        statement.
+    """
+    if template is None:
+        return ()
+    return tuple([(k, _column_shape(k, template[k])) for k in sorted(template.keys())])
+
+
+def _term_sql(column, op, n):
+    if op in _comparison_ops:
+        return column + _comparison_ops[op] + "%s"
+    if op == "in":
+        if n == 0:
+            return "1=0"
+        return column + " IN (" + ",".join(["%s"] * n) + ")"
+    if op == "like":
+        return column + " LIKE %s"
+    if op == "between":
+        return column + " BETWEEN %s AND %s"
+    return column + (" IS NULL" if n else " IS NOT NULL")
+
+
+def _escape_like(value):
+    return str(value).replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _template_args(template, shape):
+    args = []
+    for column, column_shape in shape:
+        value = template[column]
+        for op, n in column_shape:
+            if type(value) != dict:
+                args.append(value)
+                continue
+            v = value[op]
+            if op == "in" or op == "between":
+                args.extend(v)
+            elif op == "like":
+                args.append(_escape_like(v) + "%")
+            elif op != "is_null":
+                args.append(v)
+    return args
+
+
+def _build_where_terms(shape, prefix=""):
+    terms = []
+    for column, column_shape in shape:
+        for op, n in column_shape:
+            terms.append(" " + _term_sql(prefix + column, op, n) + " ")
+    return terms
+
+
+def _build_where_clause(shape):
+    return " WHERE " + "AND".join(_build_where_terms(shape))
+
+
 def template_to_where_clause(template):
     """
-    :param template: One of those weird templates
+    :param template: One of those weird templates, optionally with operators (see template_ops).
     :return: WHERE clause corresponding to the template.
     """
     if template is None or template == {}:
         result = ("", None)
     else:
-        args = []
-        terms = []
-        for k, v in template.items():
-            terms.append(" " + k + "=%s ")
-            args.append(v)
-        w_clause = "AND".join(terms)
-        w_clause = " WHERE " + w_clause
-        result = (w_clause, args)
+        shape = _template_shape(template)
+        w_clause = _sql_cache.get_or_build(("where", shape), lambda: _build_where_clause(shape))
+        result = (w_clause, _template_args(template, shape))
     return result
 
 
-def create_select(table_name, template, fields=None, order_by=None, limit=None, offset=None, is_select=True):
+def parse_query_template(query_params):
+    """
+    Turns query parameters into a template. column=value is equality and column__op=value applies an operator:
+    yearID__gte=1990, teamID__in=BOS,NYA, birthYear__between=1960,1970, nameLast__like=Wil,
+    deathYear__is_null=true.
+    :param query_params: Dictionary of query parameter strings.
+    :return: The template.
+    """
+    template = {}
+    for k, v in query_params.items():
+        k = k.strip()
+        column, op = k, None
+        if "__" in k:
+            column, op = k.rsplit("__", 1)
+            if op not in template_ops:
+                column, op = k, None
+        if op is None or op == "eq":
+            value = v
+        elif op == "in" or op == "between":
+            value = v.split(",")
+        elif op == "is_null":
+            value = v.lower() in ("true", "1", "yes")
+        else:
+            value = v
+        current = template.get(column, None)
+        if op is None:
+            if type(current) == dict:
+                # Joins the operators already given for the column, whatever order the parameters came in.
+                current["eq"] = value
+            else:
+                template[column] = value
+            continue
+        if current is not None and type(current) != dict:
+            current = {"eq": current}
+        if current is None:
+            current = {}
+        current[op] = value
+        template[column] = current
+    return template
+
+
+def order_by_terms(order_by):
+    """
+    :param order_by: A list of sort columns. "-col" or "col desc" sorts descending, "col" or "col asc" ascending.
+    :return: ((column, descending), ...)
+    """
+    if order_by is None:
+        return ()
+    terms = []
+    for o in order_by:
+        parts = str(o).strip().split()
+        descending = False
+        if len(parts) == 2 and parts[1].lower() in ("asc", "desc"):
+            descending = parts[1].lower() == "desc"
+        elif len(parts) != 1:
+            raise ValueError("Invalid order by term " + str(o))
+        column = parts[0]
+        if column.startswith("-"):
+            column, descending = column[1:], True
+        elif column.startswith("+"):
+            column = column[1:]
+        if column == "":
+            raise ValueError("Invalid order by term " + str(o))
+        terms.append((column, descending))
+    return tuple(terms)
+
+
+def order_by_columns(order_by):
+    return [t[0] for t in order_by_terms(order_by)]
+
+
+def create_seek_clause(key_columns, last_key):
+    """
+    Produce the keyset (seek) condition that selects rows strictly after last_key in key order.
+    For key (k1, k2) this is (k1 > %s) OR (k1 = %s AND k2 > %s), which MySQL can answer with a range scan
+    on the primary key instead of reading and discarding the skipped rows like OFFSET does.
+    :param key_columns: The key columns, in order.
+    :param last_key: The values of the key columns for the last row already returned.
+    :return: A tuple of the form (condition string, args).
+    """
+    terms = []
+    for i in range(len(key_columns)):
+        parts = []
+        for j in range(i):
+            parts.append(key_columns[j] + "=%s")
+        parts.append(key_columns[i] + ">%s")
+        terms.append("(" + " AND ".join(parts) + ")")
+    return " OR ".join(terms), _seek_args(last_key)
+
+
+def _seek_args(last_key):
+    args = []
+    for i in range(len(last_key)):
+        args.extend(last_key[:i + 1])
+    return args
+
+
+# MySQL has no OFFSET without LIMIT. An offset on its own is sent with the largest LIMIT, as the MySQL manual
+# suggests for "all rows from an offset to the end".
+_no_limit = 18446744073709551615
+
+
+def _limit_sql(limit, offset):
+    """
+    :return: The limit/offset clause with placeholders, "" if neither is given.
+    """
+    sql = ""
+    if limit is not None or offset is not None:
+        sql += "limit %s "
+    if offset is not None:
+        sql += "offset %s "
+    return sql
+
+
+def _limit_args(limit, offset):
+    args = []
+    if limit is not None or offset is not None:
+        args.append(int(limit) if limit is not None else _no_limit)
+    if offset is not None:
+        args.append(int(offset))
+    return args
+
+
+def create_select(table_name, template, fields=None, order_by=None, limit=None, offset=None, is_select=True,
+                  seek=None):
     """
     Produce a select statement: sql string and args.
+    The SQL text only depends on the shape of the request, so it is cached (see get_sql_cache_stats()).
+    Limit and offset are passed as parameters rather than formatted into the text.
     :param table_name: Table name: May be fully qualified dbname.tablename or just tablename.
     :param fields: Columns to select (an array of column name)
-    :param template: One of Don Ferguson's weird JSON/python dictionary templates.
-    :param order_by: Ignore for now.
-    :param limit: Ignore for now.
-    :param offset: Ignore for now.
+    :param template: One of Don Ferguson's weird JSON/python dictionary templates. Values may be operator
+        dictionaries, see template_ops.
+    :param order_by: A list of columns to sort by. Prefix a column with - (or add " desc") to sort descending.
+    :param limit: Maximum number of rows.
+    :param offset: Number of rows to skip. May be given without limit.
+    :param seek: None, or a tuple (key_columns, last_key). Restricts the result to rows after last_key, see
+        create_seek_clause().
     :return: A tuple of the form (sql string, args), where the sql string is a template.
     """
-    if is_select:
+    shape = _template_shape(template)
+    has_seek = seek is not None and seek[1] is not None
+    seek_columns = tuple(seek[0]) if has_seek else None
+    order_terms = order_by_terms(order_by)
+    key = ("select" if is_select else "delete", table_name, shape,
+           tuple(fields) if fields is not None else None,
+           order_terms, seek_columns, limit is not None, offset is not None)
+
+    def build():
+        if is_select:
+            if fields is None:
+                field_list = " * "
+            else:
+                field_list = " " + ",".join(fields) + " "
+        else:
+            field_list = None
+        w_clause = _build_where_clause(shape) if len(shape) > 0 else ""
+        if has_seek:
+            s_clause, s_args = create_seek_clause(seek_columns, seek[1])
+            if w_clause == "":
+                w_clause = " WHERE (" + s_clause + ") "
+            else:
+                w_clause += " AND (" + s_clause + ") "
+        ob_clause = ""
+        if len(order_terms) > 0:
+            ob_clause = "order by " + ",".join([c + (" desc" if d else "") for c, d in order_terms]) + " "
+        l_clause = _limit_sql(limit, offset)
+        if is_select:
+            sql = "select " + field_list + " from " + table_name + " " + w_clause + ob_clause + l_clause
+        else:
+            sql = "delete from " + table_name + " " + w_clause + l_clause
+        return sql
+
+    sql = _sql_cache.get_or_build(key, build)
+    args = _template_args(template, shape)
+    if has_seek:
+        args.extend(_seek_args(seek[1]))
+    args.extend(_limit_args(limit, offset))
+    if len(args) == 0:
+        args = None
+    return sql, args
+
+
+# Aggregate functions for create_aggregate. count accepts * as the column.
+aggregate_functions = ("count", "count_distinct", "sum", "avg", "min", "max")
+
+
+def parse_aggregates(aggregates):
+    """
+    :param aggregates: A list of "function:column" strings or (function, column) pairs.
+    :return: A list of (function, column) pairs.
+    """
+    result = []
+    for a in aggregates:
+        if type(a) in (list, tuple):
+            fn, column = a
+        else:
+            fn, sep, column = str(a).partition(":")
+        fn = fn.strip().lower()
+        column = column.strip()
+        if fn not in aggregate_functions:
+            raise ValueError("Unknown aggregate function " + fn + ". Use one of " + ",".join(aggregate_functions))
+        if column == "" or (column == "*" and fn != "count"):
+            raise ValueError("Invalid aggregate " + str(a))
+        result.append((fn, column))
+    return result
+
+
+def aggregate_name(fn, column):
+    """
+    :return: The name of the aggregate in the result, e.g. sum_HR, or count for count:*.
+    """
+    if column == "*":
+        return fn
+    return fn + "_" + column
+
+
+def _aggregate_sql(fn, column):
+    if fn == "count_distinct":
+        return "count(distinct " + column + ")"
+    return fn + "(" + column + ")"
+
+
+def create_aggregate(table_name, template, group_by, aggregates, order_by=None, limit=None, offset=None):
+    """
+    Produce a GROUP BY statement: sql string and args.
+    :param table_name: Table name: May be fully qualified dbname.tablename or just tablename.
+    :param template: Filter on the rows before grouping, as for create_select.
+    :param group_by: A list of columns to group by, or None for one row over everything.
+    :param aggregates: A list of (function, column) pairs, see parse_aggregates().
+    :param order_by: Group columns or aggregate names to sort by; - prefix for descending.
+    :return: A tuple of the form (sql string, args).
+    """
+    shape = _template_shape(template)
+    group_by = tuple(group_by) if group_by is not None else ()
+    aggregates = tuple([tuple(a) for a in aggregates])
+    order_terms = order_by_terms(order_by)
+    key = ("aggregate", table_name, shape, group_by, aggregates, order_terms, limit is not None,
+           offset is not None)
+
+    def build():
+        columns = list(group_by) + [_aggregate_sql(fn, c) + " as " + aggregate_name(fn, c) for fn, c in aggregates]
+        sql = "select " + ",".join(columns) + " from " + table_name + " "
+        if len(shape) > 0:
+            sql += _build_where_clause(shape)
+        if len(group_by) > 0:
+            sql += "group by " + ",".join(group_by) + " "
+        if len(order_terms) > 0:
+            sql += "order by " + ",".join([c + (" desc" if d else "") for c, d in order_terms]) + " "
+        sql += _limit_sql(limit, offset)
+        return sql
+
+    sql = _sql_cache.get_or_build(key, build)
+    args = _template_args(template, shape)
+    args.extend(_limit_args(limit, offset))
+    return sql, args if len(args) > 0 else None
+
+
+def create_count(table_name, template):
+    """
+    :return: A tuple (sql string, args) for SELECT count(*) AS count over the rows matching template.
+    """
+    shape = _template_shape(template)
+
+    def build():
+        w_clause = _build_where_clause(shape) if len(shape) > 0 else ""
+        return "select count(*) as count from " + table_name + " " + w_clause
+
+    sql = _sql_cache.get_or_build(("count", table_name, shape), build)
+    args = _template_args(template, shape)
+    return sql, args if len(args) > 0 else None
+
+
+def create_path_select(parent_table, parent_key, target_table, key_map, template=None, fields=None, order_by=None,
+                       limit=None, offset=None):
+    """
+    Produce one select for the rows of target_table related to one row of parent_table.
+    If the relationship only uses parent key columns, their values are already known and the target is filtered
+    directly (WHERE t.playerID=%s). Otherwise target and parent are joined on the key map and the parent is
+    filtered by its key, so the traversal is still one statement.
+    :param parent_table: Fully qualified parent table name.
+    :param parent_key: Dictionary of the parent's primary key columns and values.
+    :param target_table: Fully qualified target table name.
+    :param key_map: A list of (parent column, target column) pairs.
+    :param template: A template on the target's columns, with or without operators.
+    :param fields: Target columns to select. Default all.
+    :param order_by: Target columns to sort by, as for create_select.
+    :return: A tuple of the form (sql string, args).
+    """
+    shape = _template_shape(template)
+    order_terms = order_by_terms(order_by)
+    key_columns = tuple(sorted(parent_key.keys()))
+    key_map = tuple([tuple(m) for m in key_map])
+    direct = all(pc in parent_key for pc, tc in key_map)
+    key = ("path", parent_table, key_columns, target_table, key_map, direct, shape,
+           tuple(fields) if fields is not None else None, order_terms, limit is not None, offset is not None)
+
+    def build():
+        field_list = " t.* " if fields is None else " " + ",".join(["t." + f for f in fields]) + " "
+        sql = "select " + field_list + " from " + target_table + " t "
+        if direct:
+            terms = [" t." + tc + "=%s " for pc, tc in key_map]
+        else:
+            sql += "join " + parent_table + " p on " + " AND ".join(["t." + tc + "=p." + pc for pc, tc in key_map])
+            terms = [" p." + k + "=%s " for k in key_columns]
+        terms.extend(_build_where_terms(shape, prefix="t."))
+        sql += " WHERE " + "AND".join(terms)
+        if len(order_terms) > 0:
+            sql += "order by " + ",".join(["t." + c + (" desc" if d else "") for c, d in order_terms]) + " "
+        sql += _limit_sql(limit, offset)
+        return sql
+
+    sql = _sql_cache.get_or_build(key, build)
+    if direct:
+        args = [parent_key[pc] for pc, tc in key_map]
+    else:
+        args = [parent_key[k] for k in key_columns]
+    args.extend(_template_args(template, shape))
+    args.extend(_limit_args(limit, offset))
+    return sql, args
+
+
+def create_select_by_keys(table_name, key_columns, keys, fields=None):
+    """
+    Produce one select for many primary keys. A single column key becomes WHERE k IN (%s,...), a composite key
+    the row constructor WHERE (k1,k2) IN ((%s,%s),...), which MySQL answers with primary key lookups.
+    :param table_name: Table name: May be fully qualified dbname.tablename or just tablename.
+    :param key_columns: The key columns, in order.
+    :param keys: A list of keys. Each key is a list of values, one per key column.
+    :param fields: Columns to select (an array of column name)
+    :return: A tuple of the form (sql string, args).
+    """
+    key_columns = tuple(key_columns)
+    n = len(keys)
+
+    def build():
         if fields is None:
             field_list = " * "
         else:
             field_list = " " + ",".join(fields) + " "
+        return "select " + field_list + " from " + table_name + " WHERE " + _key_in_clause(key_columns, n)
+
+    sql = _sql_cache.get_or_build(("select_keys", table_name, key_columns,
+                                   tuple(fields) if fields is not None else None, n), build)
+    return sql, _key_args(key_columns, keys)
+
+
+def _key_in_clause(key_columns, n):
+    if len(key_columns) == 1:
+        return key_columns[0] + " IN (" + ",".join(["%s"] * n) + ")"
+    row = "(" + ",".join(["%s"] * len(key_columns)) + ")"
+    return "(" + ",".join(key_columns) + ") IN (" + ",".join([row] * n) + ")"
+
+
+def _key_args(key_columns, keys):
+    args = []
+    for k in keys:
+        if len(k) != len(key_columns):
+            raise ValueError("Key " + str(k) + " does not match key columns " + str(list(key_columns)))
+        args.extend(k)
+    return args
+
+
+def create_delete_by_keys(table_name, key_columns, keys):
+    """
+    Produce one delete for many primary keys, using the same IN list as create_select_by_keys().
+    :return: A tuple of the form (sql string, args).
+    """
+    key_columns = tuple(key_columns)
+    n = len(keys)
+    sql = _sql_cache.get_or_build(("delete_keys", table_name, key_columns, n),
+                                  lambda: "delete from " + table_name + " WHERE " + _key_in_clause(key_columns, n))
+    return sql, _key_args(key_columns, keys)
+
+
+def create_update_by_keys(table_name, key_columns, keys, new_values):
+    """
+    Produce one update for many primary keys.
+    :param keys: A list of keys. Each key is a list of values, one per key column.
+    :param new_values: Either one dictionary of column values applied to every key, or a list of dictionaries,
+        one per key, that all set the same columns. In the second case each column is set with
+        CASE WHEN <key matches> THEN %s ... END, so different rows get different values in one statement.
+    :return: A tuple of the form (sql string, args).
+    """
+    key_columns = tuple(key_columns)
+    n = len(keys)
+    per_key = type(new_values) == list
+    if per_key:
+        if len(new_values) != n:
+            raise ValueError("new_values must have one entry per key.")
+        set_cols = tuple(sorted(new_values[0].keys()))
+        for v in new_values:
+            if tuple(sorted(v.keys())) != set_cols:
+                raise ValueError("Every entry in new_values must set the same columns.")
     else:
-        field_list = None
-    w_clause, args = template_to_where_clause(template)
-    l_clause, o_clause = "", ""
-    if limit is not None:
-        l_clause = "limit " + limit + " "
-    if offset is not None:
-        o_clause = "offset " + offset + " "
-    if is_select:
-        sql = "select " + field_list + " from " + table_name + " " + w_clause + l_clause + o_clause
-    else:
-        sql = "delete from " + table_name + " " + w_clause + l_clause + o_clause
+        set_cols = tuple(sorted(new_values.keys()))
+
+    def build():
+        set_terms = []
+        for c in set_cols:
+            if not per_key:
+                set_terms.append(c + "=%s")
+            elif len(key_columns) == 1:
+                set_terms.append(c + "=CASE " + key_columns[0] + " " + " ".join(["WHEN %s THEN %s"] * n) +
+                                 " ELSE " + c + " END")
+            else:
+                match = " AND ".join([k + "=%s" for k in key_columns])
+                set_terms.append(c + "=CASE " + " ".join(["WHEN " + match + " THEN %s"] * n) +
+                                 " ELSE " + c + " END")
+        return "update " + table_name + " set " + ",".join(set_terms) + " WHERE " + _key_in_clause(key_columns, n)
+
+    sql = _sql_cache.get_or_build(("update_keys", table_name, key_columns, set_cols, per_key, n), build)
+    args = []
+    for c in set_cols:
+        if not per_key:
+            args.append(new_values[c])
+        else:
+            for i in range(n):
+                args.extend(keys[i])
+                args.append(new_values[i][c])
+    args.extend(_key_args(key_columns, keys))
     return sql, args
 
 
 def create_insert(table_name, new_row):
-    sql = "insert into " + table_name + " "
-    cols = list(new_row.keys())
-    cols = ",".join(cols)
-    col_clause = "(" + cols + ") "
-    args = list(new_row.values())
-    s_stuff = ["%s"] * len(args)
-    s_clause = ",".join(s_stuff)
-    v_clause = " values(" + s_clause + ")"
-    sql += " " + col_clause + " " + v_clause
+    cols = tuple(sorted(new_row.keys()))
+
+    def build():
+        sql = "insert into " + table_name + " "
+        col_clause = "(" + ",".join(cols) + ") "
+        s_clause = ",".join(["%s"] * len(cols))
+        v_clause = " values(" + s_clause + ")"
+        sql += " " + col_clause + " " + v_clause
+        return sql
+
+    sql = _sql_cache.get_or_build(("insert", table_name, cols), build)
+    args = [new_row[k] for k in cols]
     return sql, args
 
 
 def create_update(table_name, template, changed_cols):
-    sql = "update " + table_name + " "
-    set_terms = []
-    args = []
-    for k, v in changed_cols.items():
-        args.append(v)
-        set_terms.append(k + "=%s")
-    set_terms = ",".join(set_terms)
-    set_clause = " set " + set_terms
-    w_clause, args2 = template_to_where_clause(template)
-    sql += set_clause + " " + w_clause
-    args.extend(args2)
+    set_cols = tuple(sorted(changed_cols.keys()))
+    shape = _template_shape(template)
+
+    def build():
+        sql = "update " + table_name + " "
+        set_terms = []
+        for k in set_cols:
+            set_terms.append(k + "=%s")
+        set_clause = " set " + ",".join(set_terms)
+        w_clause = _build_where_clause(shape) if len(shape) > 0 else ""
+        sql += set_clause + " " + w_clause
+        return sql
+
+    sql = _sql_cache.get_or_build(("update", table_name, set_cols, shape), build)
+    args = [changed_cols[k] for k in set_cols]
+    args.extend(_template_args(template, shape))
     return sql, args
+
+
+def get_sql_cache_stats():
+    """
+    :return: Size and hit/miss/eviction counters for the SQL text cache.
+    """
+    return _sql_cache.stats()
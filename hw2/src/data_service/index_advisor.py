@@ -0,0 +1,208 @@
+import os
+import threading
+import logging
+import src.data_service.dbutils as dbutils
+
+logger = logging.getLogger()
+
+# The advisor records the shape of every template query (which columns, with which operators, and the sort
+# order) per table. Recording is one dictionary update; EXPLAIN only runs when a report is asked for. Set
+# DATA_SERVICE_INDEX_ADVISOR=0 or call disable() to turn recording off.
+_enabled = os.environ.get("DATA_SERVICE_INDEX_ADVISOR", "1") != "0"
+
+# At most this many distinct shapes are kept. Further new shapes are counted as dropped.
+_max_shapes = 1000
+
+# Operators an index can use. Equality-like operators go first in a suggested index, then at most one range.
+_point_ops = ("eq", "in", "is_null")
+_range_ops = ("gt", "gte", "lt", "lte", "between", "like")
+
+# EXPLAIN access types that read the whole table or the whole of an index.
+_scan_types = ("ALL", "index")
+
+_lock = threading.Lock()
+_shapes = {}  # (table, shape, order) -> entry dictionary
+_dropped = 0
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    global _dropped
+    with _lock:
+        _shapes.clear()
+        _dropped = 0
+
+
+def _column_ops(value):
+    if type(value) != dict:
+        return ("eq",)
+    return tuple(sorted(value.keys()))
+
+
+def record(full_table_name, connect_info, template, order_by=None, kind="find"):
+    """
+    Counts one template query.
+    :param full_table_name: db.table
+    :param connect_info: Connection information for the table, used to run EXPLAIN in report().
+    :param template: The template, with or without operators.
+    :param order_by: The order_by list, if any.
+    :param kind: 'find', 'update' or 'delete'.
+    """
+    global _dropped
+    if not _enabled or not template:
+        return
+    shape = tuple([(k, _column_ops(template[k])) for k in sorted(template.keys())])
+    order = dbutils.order_by_terms(order_by)
+    key = (full_table_name, shape, order)
+    with _lock:
+        entry = _shapes.get(key, None)
+        if entry is None:
+            if len(_shapes) >= _max_shapes:
+                _dropped += 1
+                return
+            entry = {"connect_info": connect_info, "count": 0, "kinds": {}}
+            _shapes[key] = entry
+        entry["count"] += 1
+        entry["kinds"][kind] = entry["kinds"].get(kind, 0) + 1
+        # The latest values stand in for the shape when it is explained.
+        entry["template"] = template
+
+
+def _existing_indexes(full_table_name, connect_info):
+    """
+    :return: {index name: [columns in order]}
+    """
+    res, d = dbutils.run_q("SHOW INDEX FROM " + full_table_name, connect_info=connect_info, commit=False,
+                           fetch=True)
+    indexes = {}
+    for r in sorted(d, key=lambda r: (r["Key_name"], r["Seq_in_index"])):
+        indexes.setdefault(r["Key_name"], []).append(r["Column_name"])
+    return indexes
+
+
+def _explain(full_table_name, connect_info, template, order_by):
+    sql, args = dbutils.create_select(full_table_name, template=template, order_by=order_by)
+    res, d = dbutils.run_q("EXPLAIN " + sql, args=args, connect_info=connect_info, commit=False, fetch=True)
+    r = d[0]
+    return {
+        "type": r.get("type", None),
+        "key": r.get("key", None),
+        "rows": r.get("rows", None),
+        "filtered": r.get("filtered", None),
+        "extra": r.get("Extra", None)
+    }
+
+
+def suggest_index(shape, order):
+    """
+    :param shape: ((column, operators), ...) as recorded.
+    :param order: ((column, descending), ...)
+    :return: The columns of a composite index for the shape: equality and IN columns first, then one range
+        column. Without a range column the sort columns follow, if they all sort the same way, so MySQL can
+        also skip the filesort. None if no column can use an index.
+    """
+    point = [c for c, ops in shape if any(op in _point_ops for op in ops)]
+    ranges = [c for c, ops in shape if c not in point and any(op in _range_ops for op in ops)]
+    columns = list(point)
+    if len(ranges) > 0:
+        columns.append(ranges[0])
+    elif len(order) > 0 and len(set([d for c, d in order])) == 1:
+        columns.extend([c for c, d in order if c not in columns])
+    if len(columns) == 0:
+        return None
+    return columns[:16]
+
+
+def _covered_by(columns, point_count, indexes):
+    """
+    :return: The name of an existing index that starts with the suggested columns (the equality columns in any
+        order), or None.
+    """
+    for name, index_columns in indexes.items():
+        if len(index_columns) < len(columns):
+            continue
+        lowered = [c.lower() for c in index_columns[:len(columns)]]
+        wanted = [c.lower() for c in columns]
+        if set(lowered[:point_count]) == set(wanted[:point_count]) and lowered[point_count:] == wanted[point_count:]:
+            return name
+    return None
+
+
+def _index_name(columns):
+    return ("idx_" + "_".join(columns))[:64]
+
+
+def report(min_count=1, table=None):
+    """
+    Explains every recorded shape and suggests composite indexes for the ones MySQL answers with a scan.
+    :param min_count: Skip shapes seen fewer times than this.
+    :param table: Only report on this db.table.
+    :return: A list of entries, most expensive (count times rows examined) first. rows_examined_after is the
+        EXPLAIN estimate of matching rows (rows * filtered), which is what an index on all the template columns
+        would read.
+    """
+    with _lock:
+        items = [(k, dict(v)) for k, v in _shapes.items() if v["count"] >= min_count and
+                 (table is None or k[0] == table)]
+    indexes_by_table = {}
+    result = []
+    for (full_table_name, shape, order), entry in items:
+        ci = entry["connect_info"]
+        r = {
+            "table": full_table_name,
+            "columns": [{"column": c, "operators": list(ops)} for c, ops in shape],
+            "order_by": [c + (" desc" if d else "") for c, d in order],
+            "count": entry["count"],
+            "kinds": entry["kinds"],
+            "explain": None,
+            "existing_index": None,
+            "suggested_index": None,
+            "create_statement": None,
+            "rows_examined_before": None,
+            "rows_examined_after": None,
+            "error": None
+        }
+        try:
+            if full_table_name not in indexes_by_table:
+                indexes_by_table[full_table_name] = _existing_indexes(full_table_name, ci)
+            indexes = indexes_by_table[full_table_name]
+            order_by = r["order_by"] if len(r["order_by"]) > 0 else None
+            explain = _explain(full_table_name, ci, entry["template"], order_by)
+            r["explain"] = explain
+            rows = explain["rows"]
+            filtered = explain["filtered"] if explain["filtered"] is not None else 100.0
+            r["rows_examined_before"] = rows
+            if rows is not None:
+                r["rows_examined_after"] = max(1, int(round(float(rows) * float(filtered) / 100.0)))
+            columns = suggest_index(shape, order)
+            if columns is not None:
+                point_count = len([c for c, ops in shape if any(op in _point_ops for op in ops)])
+                r["existing_index"] = _covered_by(columns, point_count, indexes)
+                if r["existing_index"] is None and explain["type"] in _scan_types:
+                    r["suggested_index"] = columns
+                    r["create_statement"] = "CREATE INDEX " + _index_name(columns) + " ON " + full_table_name + \
+                        " (" + ",".join(columns) + ")"
+        except Exception as e:
+            logger.debug("Index advisor could not explain " + full_table_name + ": " + str(e))
+            r["error"] = str(e)
+        result.append(r)
+    result.sort(key=lambda r: -r["count"] * (r["rows_examined_before"] or 0))
+    return result
+
+
+def stats():
+    with _lock:
+        return {"enabled": _enabled, "shapes": len(_shapes), "max_shapes": _max_shapes, "dropped": _dropped}
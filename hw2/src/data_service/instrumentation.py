@@ -0,0 +1,150 @@
+import os
+import threading
+import time
+import logging
+from collections import deque
+from datetime import datetime
+
+logger = logging.getLogger()
+
+# Instrumentation is off unless DATA_SERVICE_METRICS=1 or enable() is called. When it is off, start() returns
+# None and every observe call returns immediately, so the hot path pays one function call and one test.
+_enabled = os.environ.get("DATA_SERVICE_METRICS", "0") == "1"
+
+# Latency histogram bucket upper bounds, in milliseconds. The last bucket catches everything slower.
+_buckets_ms = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+# Statements slower than this (seconds) go to the slow query log.
+_slow_query_threshold = 0.5
+_slow_query_log_size = 100
+
+_lock = threading.Lock()
+_histograms = {}  # (kind, name, phase) -> Histogram
+_slow_queries = deque(maxlen=_slow_query_log_size)
+
+
+class Histogram:
+    """
+    Count, sum, max and bucketed counts of latencies.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(_buckets_ms) + 1)
+
+    def add(self, ms):
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+        i = 0
+        while i < len(_buckets_ms) and ms > _buckets_ms[i]:
+            i += 1
+        self.buckets[i] += 1
+
+    def to_dict(self):
+        labels = ["le_" + str(b) + "ms" for b in _buckets_ms] + ["le_inf"]
+        return {
+            "count": self.count,
+            "sum_ms": round(self.total, 3),
+            "mean_ms": round(self.total / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max, 3),
+            "buckets": dict(zip(labels, self.buckets))
+        }
+
+
+def enable(slow_query_threshold=None):
+    """
+    Turns instrumentation on.
+    :param slow_query_threshold: Optional new slow query threshold in seconds.
+    """
+    global _enabled, _slow_query_threshold
+    _enabled = True
+    if slow_query_threshold is not None:
+        _slow_query_threshold = slow_query_threshold
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _slow_queries.clear()
+
+
+def start():
+    """
+    :return: A start time to pass to observe(), or None when instrumentation is off.
+    """
+    if not _enabled:
+        return None
+    return time.perf_counter()
+
+
+def observe(kind, name, phase, started):
+    """
+    Records the time since started.
+    :param kind: What is being measured, e.g. 'route', 'table' or 'sql'.
+    :param name: The route, table or statement type.
+    :param phase: The phase, e.g. 'build', 'execute', 'fetch', 'serialize' or 'total'.
+    :param started: The value returned by start(). Nothing is recorded if it is None.
+    :return: The current time, so that consecutive phases can be chained, or None when off.
+    """
+    if started is None:
+        return None
+    now = time.perf_counter()
+    key = (kind, name, phase)
+    with _lock:
+        h = _histograms.get(key, None)
+        if h is None:
+            h = Histogram()
+            _histograms[key] = h
+        h.add((now - started) * 1000.0)
+    return now
+
+
+def observe_query(sql, args, started):
+    """
+    Adds the statement to the slow query log if it took longer than the threshold.
+    :param started: The value returned by start() before the statement ran.
+    """
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    if elapsed < _slow_query_threshold:
+        return
+    entry = {
+        "time": str(datetime.now()),
+        "duration_ms": round(elapsed * 1000.0, 3),
+        "sql": sql,
+        "args": repr(args)[:200]
+    }
+    with _lock:
+        _slow_queries.append(entry)
+    logger.warning("Slow query (" + str(entry["duration_ms"]) + " ms): " + sql)
+
+
+def snapshot():
+    """
+    :return: All histograms, grouped as {kind: {name: {phase: histogram}}}, and the slow query log.
+    """
+    with _lock:
+        result = {}
+        for (kind, name, phase), h in _histograms.items():
+            result.setdefault(kind, {}).setdefault(name, {})[phase] = h.to_dict()
+        slow = list(_slow_queries)
+    return {
+        "enabled": _enabled,
+        "slow_query_threshold_ms": _slow_query_threshold * 1000.0,
+        "histograms": result,
+        "slow_queries": slow
+    }
@@ -0,0 +1,238 @@
+import threading
+import time
+import logging
+from contextlib import contextmanager
+import pymysql
+import src.data_service.connection_pool as connection_pool
+
+logger = logging.getLogger()
+
+# connect_info may name read replicas:
+#
+#     {"host": "db-primary", ..., "replicas": [{"host": "db-replica-1"}, {"host": "db-replica-2", "port": 3307}],
+#      "replica_selection": "least_outstanding"}
+#
+# Each replica entry overrides the primary's settings, so a local stand-in for testing can be a second server on
+# another port, or even the primary itself. Reads of a table go to the primary for replica_lag seconds after
+# this process wrote to it, so a client reads its own writes and the result cache is not filled from a replica
+# that has not caught up yet. A replica whose connection fails is skipped for retry_interval seconds.
+_default_selection = "round_robin"
+_default_replica_lag = 5
+_default_retry_interval = 30
+
+_replica_sets = {}
+_replica_sets_lock = threading.Lock()
+
+# Table name -> time of the last write from this process.
+_last_writes = {}
+_local = threading.local()
+
+
+def primary_connect_info(connect_info):
+    """
+    :return: connect_info without the replica settings.
+    """
+    return {k: v for k, v in connect_info.items() if k not in connection_pool.replica_option_keys}
+
+
+def _is_connection_error(e):
+    """
+    :return: True if e says the server could not be reached or the connection broke: grounds to mark a replica
+        unhealthy. A PoolTimeoutError is not one; it only means this process has every connection checked out.
+    """
+    if isinstance(e, pymysql.err.InterfaceError):
+        return True
+    # Client side errors (2000 and up) such as "can't connect" and "lost connection during query".
+    return isinstance(e, pymysql.err.OperationalError) and len(e.args) > 0 and type(e.args[0]) == int and \
+        e.args[0] >= 2000
+
+
+class _Replica:
+
+    def __init__(self, connect_info):
+        self.connect_info = connect_info
+        self.name = str(connect_info.get("host", "")) + ":" + str(connect_info.get("port", ""))
+        self.outstanding = 0
+        self.reads = 0
+        self.failures = 0
+        self.unhealthy_until = 0.0
+
+
+class ReplicaSet:
+    """
+    The replicas of one primary, with round robin or least outstanding selection and health tracking.
+    """
+
+    def __init__(self, connect_info):
+        self._primary = primary_connect_info(connect_info)
+        self._replicas = []
+        for r in connect_info.get("replicas", []):
+            ci = dict(self._primary)
+            ci.update(r)
+            self._replicas.append(_Replica(ci))
+        self._selection = connect_info.get("replica_selection", _default_selection)
+        if self._selection not in ("round_robin", "least_outstanding"):
+            raise ValueError("Unknown replica_selection " + str(self._selection))
+        self._replica_lag = connect_info.get("replica_lag", _default_replica_lag)
+        self._retry_interval = connect_info.get("replica_retry_interval", _default_retry_interval)
+        self._lock = threading.Lock()
+        self._next = 0
+        self._primary_reads = 0
+
+    def _choose(self, table):
+        """
+        :return: The replica to read from, with its outstanding count taken, or None for the primary.
+        """
+        if getattr(_local, "primary_depth", 0) > 0:
+            return None
+        if table is not None and time.time() - _last_writes.get(table, 0.0) < self._replica_lag:
+            return None
+        now = time.time()
+        with self._lock:
+            healthy = [r for r in self._replicas if r.unhealthy_until <= now]
+            if len(healthy) == 0:
+                return None
+            if self._selection == "least_outstanding":
+                # Ties go round robin, so idle replicas share the load.
+                start = self._next % len(healthy)
+                ordered = healthy[start:] + healthy[:start]
+                chosen = min(ordered, key=lambda r: r.outstanding)
+            else:
+                chosen = healthy[self._next % len(healthy)]
+            self._next += 1
+            chosen.outstanding += 1
+            chosen.reads += 1
+            return chosen
+
+    def _release(self, replica, failed):
+        with self._lock:
+            replica.outstanding -= 1
+            if failed:
+                replica.failures += 1
+                replica.unhealthy_until = time.time() + self._retry_interval
+        if failed:
+            logger.warning("Replica " + replica.name + " failed; out of rotation for " +
+                           str(self._retry_interval) + " seconds.")
+
+    def _checkout(self, table):
+        """
+        :return: (pool, connection, replica) for a read of table. replica is None when the connection is the
+            primary's. A replica that cannot be connected to is marked unhealthy and the primary is used instead.
+            If the replica's pool is exhausted, this read uses the primary and the replica stays healthy.
+        """
+        replica = self._choose(table)
+        if replica is not None:
+            pool = connection_pool.get_pool(replica.connect_info)
+            try:
+                return pool, pool.checkout(), replica
+            except connection_pool.PoolTimeoutError:
+                self._release(replica, False)
+            except Exception as e:
+                failed = _is_connection_error(e)
+                self._release(replica, failed)
+                if not failed:
+                    raise
+        with self._lock:
+            self._primary_reads += 1
+        pool = connection_pool.get_pool(self._primary)
+        return pool, pool.checkout(), None
+
+    def _checkin(self, pool, cnx, replica, error):
+        failed = error is not None and _is_connection_error(error)
+        pool.checkin(cnx, discard=failed)
+        if replica is not None:
+            self._release(replica, failed)
+
+    @contextmanager
+    def read_connection(self, table=None):
+        """
+        Context manager yielding a pooled connection for a read of table: a replica's, or the primary's.
+        """
+        pool, cnx, replica = self._checkout(table)
+        error = None
+        try:
+            yield cnx
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._checkin(pool, cnx, replica, error)
+
+    def run_read(self, fn, table=None):
+        """
+        :param fn: Function that runs a read on the connection it is given.
+        :return: fn's result. If a replica fails with a connection error, the read is retried on the primary.
+        """
+        pool, cnx, replica = self._checkout(table)
+        try:
+            result = fn(cnx)
+        except Exception as e:
+            self._checkin(pool, cnx, replica, e)
+            if replica is None or not _is_connection_error(e):
+                raise
+            with connection_pool.get_pool(self._primary).connection() as cnx:
+                return fn(cnx)
+        self._checkin(pool, cnx, replica, None)
+        return result
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            return {
+                "selection": self._selection,
+                "primary_reads": self._primary_reads,
+                "replicas": {r.name: {"healthy": r.unhealthy_until <= now, "outstanding": r.outstanding,
+                                      "reads": r.reads, "failures": r.failures} for r in self._replicas}
+            }
+
+
+def get_replica_set(connect_info):
+    """
+    :return: The shared ReplicaSet for connect_info, or None if it names no replicas.
+    """
+    if not connect_info.get("replicas", None):
+        return None
+    key = connection_pool.pool_key(connect_info)
+    result = _replica_sets.get(key, None)
+    if result is None:
+        with _replica_sets_lock:
+            result = _replica_sets.get(key, None)
+            if result is None:
+                result = ReplicaSet(connect_info)
+                _replica_sets[key] = result
+    return result
+
+
+def note_write(table):
+    """
+    Records a write to table, so that reads of it go to the primary for the replica lag window.
+    """
+    _last_writes[table] = time.time()
+
+
+@contextmanager
+def primary_session():
+    """
+    Context manager that sends every read on this thread to the primary, e.g. for a read that must see a write
+    made by another process.
+    """
+    _local.primary_depth = getattr(_local, "primary_depth", 0) + 1
+    try:
+        yield
+    finally:
+        _local.primary_depth -= 1
+
+
+def get_stats():
+    with _replica_sets_lock:
+        sets = list(_replica_sets.items())
+    result = {}
+    for key, rs in sets:
+        name = connection_pool.pool_name(key)
+        base, n = name, 1
+        while name in result:
+            # Same login with another password; the password digest in the key is not shown.
+            n += 1
+            name = base + " (" + str(n) + ")"
+        result[name] = rs.stats()
+    return result
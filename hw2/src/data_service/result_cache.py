@@ -0,0 +1,137 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+def estimate_size(rows):
+    """
+    :param rows: A list of row dictionaries.
+    :return: A rough estimate, in bytes, of the memory held by the rows. Good enough for budgeting.
+    """
+    size = sys.getsizeof(rows)
+    for r in rows:
+        size += sys.getsizeof(r)
+        for k, v in r.items():
+            size += sys.getsizeof(v)
+    return size
+
+
+class ResultCache:
+    """
+    A thread-safe, in-process cache of query results with a memory budget, LRU eviction, a TTL and
+    per-table invalidation. Entries are grouped by table so that a write to one table drops only that
+    table's results.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=60):
+        """
+        :param max_bytes: Memory budget for all cached results. Least recently used entries are evicted to stay
+            under it. 0 disables the cache.
+        :param ttl: Seconds a result may be served from the cache.
+        """
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (table, key) -> (rows, size, time stored)
+        self._bytes = 0
+        # Per table: hits, misses, bytes held, invalidation generation.
+        self._tables = {}
+
+    def _table_stats(self, table):
+        t = self._tables.get(table, None)
+        if t is None:
+            t = {"hits": 0, "misses": 0, "bytes": 0, "entries": 0, "invalidations": 0, "generation": 0}
+            self._tables[table] = t
+        return t
+
+    def generation(self, table):
+        """
+        :param table: Fully qualified table name.
+        :return: A counter that changes every time the table is invalidated. Read it before running a query and
+            pass it to put(), so that a result read before a concurrent write is not cached after it.
+        """
+        with self._lock:
+            return self._table_stats(table)["generation"]
+
+    def get(self, table, key):
+        """
+        :return: The cached rows, or None on a miss. The list is a copy; the row dictionaries are shared and
+            must not be modified.
+        """
+        with self._lock:
+            t = self._table_stats(table)
+            entry = self._entries.get((table, key), None)
+            if entry is not None and time.time() - entry[2] >= self._ttl:
+                self._remove((table, key))
+                entry = None
+            if entry is None:
+                t["misses"] += 1
+                return None
+            t["hits"] += 1
+            self._entries.move_to_end((table, key))
+            return list(entry[0])
+
+    def put(self, table, key, rows, generation):
+        """
+        :param generation: The value of generation(table) read before the query ran.
+        """
+        size = estimate_size(rows)
+        if size > self._max_bytes:
+            return
+        with self._lock:
+            t = self._table_stats(table)
+            if t["generation"] != generation:
+                return
+            if (table, key) in self._entries:
+                self._remove((table, key))
+            self._entries[(table, key)] = (list(rows), size, time.time())
+            self._bytes += size
+            t["bytes"] += size
+            t["entries"] += 1
+            while self._bytes > self._max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, entry_key):
+        rows, size, stored = self._entries.pop(entry_key)
+        self._bytes -= size
+        t = self._table_stats(entry_key[0])
+        t["bytes"] -= size
+        t["entries"] -= 1
+
+    def invalidate(self, table):
+        """
+        Drops every cached result for the table.
+        """
+        with self._lock:
+            t = self._table_stats(table)
+            t["generation"] += 1
+            t["invalidations"] += 1
+            for entry_key in [k for k in self._entries.keys() if k[0] == table]:
+                self._remove(entry_key)
+
+    def clear(self):
+        with self._lock:
+            for table in self._tables.keys():
+                self._tables[table]["generation"] += 1
+            self._entries.clear()
+            self._bytes = 0
+            for t in self._tables.values():
+                t["bytes"] = 0
+                t["entries"] = 0
+
+    def stats(self):
+        """
+        :return: Overall size and budget, plus hits, misses, entries and bytes held for each table.
+        """
+        with self._lock:
+            tables = {}
+            for table, t in self._tables.items():
+                tables[table] = {k: v for k, v in t.items() if k != "generation"}
+            return {
+                "max_bytes": self._max_bytes,
+                "bytes": self._bytes,
+                "entries": len(self._entries),
+                "ttl": self._ttl,
+                "tables": tables
+            }
@@ -0,0 +1,106 @@
+import json
+import datetime
+import decimal
+
+# orjson is optional. It is a C encoder that is several times faster than json for large pages. Without it the
+# standard library encoder is used with a prebuilt encoder object.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Types that the JSON encoders handle natively. Everything else a DictCursor row can hold (Decimal, date,
+# datetime, time, timedelta, bytes, set) is sent as str(), which is what json.dumps(..., default=str) did.
+_native_types = (str, int, float, bool, type(None))
+_str_types = (decimal.Decimal, datetime.date, datetime.datetime, datetime.time, datetime.timedelta)
+
+_json_encoder = json.JSONEncoder(default=str, check_circular=False)
+
+COLUMNAR_MEDIA_TYPE = "application/vnd.columnar+json"
+
+
+def _orjson_default(v):
+    return str(v)
+
+
+def to_json(res):
+    """
+    :param res: Any result the routes return.
+    :return: res as a JSON string. MySQL types that JSON has no type for are encoded with str().
+    """
+    if orjson is not None:
+        # OPT_PASSTHROUGH_DATETIME sends dates through default, so they look the same as with the json module.
+        return orjson.dumps(res, default=_orjson_default,
+                            option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return _json_encoder.encode(res)
+
+
+def _column_converter(rows, column):
+    """
+    :return: None if the column only holds natively encodable values, otherwise a function that converts one value.
+        Deciding once per column means values of plain columns are never looked at again.
+    """
+    for r in rows:
+        v = r[column]
+        if v is None:
+            continue
+        if isinstance(v, _native_types):
+            # Only the first non null value is checked; a mixed column would still be caught by default=str.
+            return None
+        if isinstance(v, _str_types):
+            return lambda x: x if x is None else str(x)
+        return None
+    return None
+
+
+def to_columnar(rows):
+    """
+    :param rows: A list of row dictionaries that all have the same keys, as a DictCursor returns them.
+    :return: {"columns": [names], "rows": [[values], ...]}. Column names are sent once instead of once per row.
+    """
+    if len(rows) == 0:
+        return {"columns": [], "rows": []}
+    columns = list(rows[0].keys())
+    converters = [_column_converter(rows, c) for c in columns]
+    if all(c is None for c in converters):
+        values = [[r[c] for c in columns] for r in rows]
+    else:
+        pairs = list(zip(columns, converters))
+        values = [[r[c] if f is None else f(r[c]) for c, f in pairs] for r in rows]
+    return {"columns": columns, "rows": values}
+
+
+def is_row_list(res):
+    return type(res) == list and len(res) > 0 and all(type(r) == dict for r in res)
+
+
+def encode(res, fmt="json", links=None):
+    """
+    :param res: The result of a route.
+    :param fmt: 'json' for the usual list of objects, or 'columnar' for a column header plus value arrays.
+        'columnar' only applies to lists of rows; anything else is sent as plain JSON.
+    :param links: Optional paging links. For 'json' they are the first element of the list, as before. For
+        'columnar' they are a "links" member next to columns and rows.
+    :return: The encoded string.
+    """
+    if fmt == "columnar" and (is_row_list(res) or (type(res) == list and len(res) == 0)):
+        body = to_columnar(res)
+        if links is not None:
+            body["links"] = links
+        return to_json(body)
+    if links is not None:
+        res = [links] + res
+    return to_json(res)
+
+
+def format_from_request(query_format, accept):
+    """
+    :param query_format: Value of the format query parameter, or None.
+    :param accept: The Accept header, or None.
+    :return: 'columnar' or 'json'.
+    """
+    if query_format is not None:
+        return "columnar" if query_format == "columnar" else "json"
+    if accept is not None and COLUMNAR_MEDIA_TYPE in accept:
+        return "columnar"
+    return "json"
@@ -0,0 +1,77 @@
+import threading
+
+
+class _Call:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls: while a call for a key is running, other threads asking for the same key
+    wait for it and get its result (or its exception) instead of running their own.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._executed = 0
+        self._coalesced = 0
+        self._errors = 0
+        self._max_waiters = 0
+
+    def do(self, key, fn):
+        """
+        :param key: Identifies the call, e.g. the SQL and args of a query.
+        :param fn: Function with no arguments that produces the result.
+        :return: fn's result, from this thread's call or from the one already in flight. The same object is
+            returned to every waiter, so it must not be modified.
+        """
+        with self._lock:
+            call = self._calls.get(key, None)
+            if call is not None:
+                call.waiters += 1
+                self._coalesced += 1
+                self._max_waiters = max(self._max_waiters, call.waiters)
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self._executed += 1
+                leader = True
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            with self._lock:
+                self._errors += 1
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def stats(self):
+        """
+        :return: Calls executed, calls that shared another call's result, errors, and calls in flight now.
+        """
+        with self._lock:
+            total = self._executed + self._coalesced
+            return {
+                "executed": self._executed,
+                "coalesced": self._coalesced,
+                "coalesced_ratio": self._coalesced / total if total else 0.0,
+                "errors": self._errors,
+                "max_waiters": self._max_waiters,
+                "in_flight": len(self._calls)
+            }
@@ -0,0 +1,74 @@
+import threading
+from collections import OrderedDict
+
+
+class SQLCache:
+    """
+    A thread-safe LRU cache of generated SQL text, keyed by the shape of the statement (table, operation,
+    columns, and which optional clauses are present). Values never depend on the actual parameter values, so
+    one entry serves every request with the same shape.
+    """
+
+    def __init__(self, max_size=1024):
+        """
+        :param max_size: Maximum number of statements to keep. The least recently used is evicted first.
+        """
+        self._max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key):
+        """
+        :param key: The statement shape.
+        :return: The cached SQL, or None on a miss.
+        """
+        with self._lock:
+            sql = self._entries.get(key, None)
+            if sql is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+                self._entries.move_to_end(key)
+            return sql
+
+    def put(self, key, sql):
+        with self._lock:
+            self._entries[key] = sql
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def get_or_build(self, key, builder):
+        """
+        :param key: The statement shape.
+        :param builder: Function with no arguments that produces the SQL text on a miss.
+        :return: The SQL text.
+        """
+        sql = self.get(key)
+        if sql is None:
+            sql = builder()
+            self.put(key, sql)
+        return sql
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        :return: A dictionary with the current size and the hit, miss and eviction counters.
+        """
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "max_size": self._max_size,
+                "size": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": self._hits / lookups if lookups else 0.0,
+                "evictions": self._evictions
+            }
@@ -0,0 +1,134 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TableRegistry:
+    """
+    A bounded, thread-safe LRU registry of table objects keyed by fully qualified table name. The least recently
+    used entry is evicted (and its close function called) when the registry is full. Concurrent first requests for
+    the same key wait for one build instead of each building their own instance.
+    """
+
+    def __init__(self, max_size=256, on_evict=None):
+        """
+        :param max_size: Maximum number of table objects to keep.
+        :param on_evict: Function called with (key, table) for every entry that is evicted or cleared, outside
+            the registry lock.
+        """
+        self._max_size = max_size
+        self._on_evict = on_evict
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._building = {}  # key -> threading.Event set when the build finishes
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._builds = 0
+        self._build_failures = 0
+        self._total_build_time = 0.0
+        self._max_build_time = 0.0
+
+    def get(self, key, builder):
+        """
+        :param key: The table key, e.g. lahman2019clean.people.
+        :param builder: Function with no arguments that creates the table object on a miss.
+        :return: The table object.
+        """
+        while True:
+            with self._lock:
+                result = self._entries.get(key, None)
+                if result is not None:
+                    self._hits += 1
+                    self._entries.move_to_end(key)
+                    return result
+                event = self._building.get(key, None)
+                if event is None:
+                    self._misses += 1
+                    event = threading.Event()
+                    self._building[key] = event
+                    break
+            # Another thread is building this table. Wait for it and look again; if its build failed this thread
+            # takes over.
+            event.wait()
+
+        started = time.time()
+        try:
+            result = builder()
+        except Exception:
+            with self._lock:
+                self._build_failures += 1
+                del self._building[key]
+            event.set()
+            raise
+
+        elapsed = time.time() - started
+        evicted = []
+        with self._lock:
+            self._builds += 1
+            self._total_build_time += elapsed
+            self._max_build_time = max(self._max_build_time, elapsed)
+            self._entries[key] = result
+            while len(self._entries) > self._max_size:
+                evicted.append(self._entries.popitem(last=False))
+                self._evictions += 1
+            del self._building[key]
+        event.set()
+        self._close(evicted)
+        return result
+
+    def peek(self, key):
+        """
+        :return: The table object for key if it is cached, otherwise None. Never builds.
+        """
+        with self._lock:
+            result = self._entries.get(key, None)
+            if result is not None:
+                self._hits += 1
+                self._entries.move_to_end(key)
+            return result
+
+    def remove(self, key):
+        """
+        Drops key from the registry, closing its table object.
+        """
+        with self._lock:
+            table = self._entries.pop(key, None)
+        if table is not None:
+            self._close([(key, table)])
+
+    def clear(self):
+        with self._lock:
+            evicted = list(self._entries.items())
+            self._entries.clear()
+        self._close(evicted)
+
+    def values(self):
+        with self._lock:
+            return list(self._entries.values())
+
+    def _close(self, evicted):
+        if self._on_evict is None:
+            return
+        for key, table in evicted:
+            self._on_evict(key, table)
+
+    def stats(self):
+        """
+        :return: A dictionary with the current size, the lookup and eviction counters, and build times.
+        """
+        with self._lock:
+            return {
+                "max_size": self._max_size,
+                "size": len(self._entries),
+                "building": len(self._building),
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "builds": self._builds,
+                "build_failures": self._build_failures,
+                "total_build_time": self._total_build_time,
+                "avg_build_time": self._total_build_time / self._builds if self._builds else 0.0,
+                "max_build_time": self._max_build_time,
+                "tables": list(self._entries.keys())
+            }
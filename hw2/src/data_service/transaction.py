@@ -0,0 +1,154 @@
+import threading
+from contextlib import contextmanager
+import src.data_service.connection_pool as connection_pool
+
+# Pooled connections run in autocommit mode, so single statements need no COMMIT round trip. A unit of work
+# groups statements instead: it pins one pooled connection per connect_info to the current thread, opens a
+# transaction on it, and commits or rolls back once at the end. dbutils.run_q sends statements for that
+# connect_info to the pinned connection and suppresses their per-statement commits.
+_local = threading.local()
+
+
+class UnitOfWork:
+    """
+    The connections pinned by one unit of work. Tables that share connect_info (for example all tables in one
+    schema) share a connection and so commit atomically. Different connect_infos get separate connections that
+    are committed one after the other; that is not a distributed (two phase) commit.
+    """
+
+    def __init__(self):
+        self._connections = {}  # pool key -> (pool, connection)
+        self._on_end = []
+        self._on_commit = []
+
+    def on_end(self, fn):
+        """
+        :param fn: A function to call once the unit of work has committed or rolled back, e.g. to invalidate
+            cached results for the tables it wrote to.
+        """
+        if fn not in self._on_end:
+            self._on_end.append(fn)
+
+    def on_commit(self, fn):
+        """
+        :param fn: A function to call once the unit of work has committed, e.g. to publish the changes it made.
+            Not called on rollback.
+        """
+        self._on_commit.append(fn)
+
+    def _run_on_end(self):
+        callbacks = self._on_end
+        self._on_end = []
+        for fn in callbacks:
+            fn()
+
+    def connection(self, connect_info):
+        """
+        :return: The connection pinned for connect_info, checking one out and starting a transaction on first use.
+        """
+        key = connection_pool.pool_key(connect_info)
+        entry = self._connections.get(key, None)
+        if entry is None:
+            pool = connection_pool.get_pool(connect_info)
+            cnx = pool.checkout()
+            try:
+                cnx.begin()
+            except Exception:
+                pool.checkin(cnx, discard=True)
+                raise
+            entry = (pool, cnx)
+            self._connections[key] = entry
+        return entry[1]
+
+    def commit(self):
+        """
+        Commits every pinned connection and returns them to their pools. If a commit fails, the connections that
+        were not committed yet are rolled back.
+        """
+        entries = list(self._connections.values())
+        self._connections = {}
+        failed = None
+        for pool, cnx in entries:
+            if failed is None:
+                try:
+                    cnx.commit()
+                    pool.checkin(cnx)
+                    continue
+                except Exception as e:
+                    failed = e
+            self._release(pool, cnx, rollback=True)
+        on_commit = self._on_commit
+        self._on_commit = []
+        self._run_on_end()
+        if failed is not None:
+            raise failed
+        for fn in on_commit:
+            fn()
+
+    def rollback(self):
+        entries = list(self._connections.values())
+        self._connections = {}
+        self._on_commit = []
+        for pool, cnx in entries:
+            self._release(pool, cnx, rollback=True)
+        self._run_on_end()
+
+    @staticmethod
+    def _release(pool, cnx, rollback):
+        try:
+            if rollback:
+                cnx.rollback()
+            pool.checkin(cnx)
+        except Exception:
+            pool.checkin(cnx, discard=True)
+
+
+def current():
+    """
+    :return: The unit of work active on this thread, or None.
+    """
+    return getattr(_local, "unit_of_work", None)
+
+
+@contextmanager
+def unit_of_work():
+    """
+    Context manager for a transaction across any number of RDBDataTable operations:
+
+        with tbl.transaction():
+            tbl.insert(...)
+            other_tbl.update_by_key(...)
+
+    Commits once on normal exit and rolls back if the body raises. A nested unit of work joins the outer one,
+    which alone commits or rolls back.
+    """
+    uow = current()
+    if uow is not None:
+        yield uow
+        return
+    uow = UnitOfWork()
+    _local.unit_of_work = uow
+    try:
+        yield uow
+    except BaseException:
+        _local.unit_of_work = None
+        uow.rollback()
+        raise
+    _local.unit_of_work = None
+    uow.commit()
+
+
+@contextmanager
+def pinned_connection(connect_info):
+    """
+    For operations that manage their own transactions (batch inserts and updates).
+    :return: A context manager yielding (connection, owned). If a unit of work is active, the connection is the
+        pinned one and owned is False: the caller must not commit or roll back. Otherwise the connection is
+        checked out of the pool for the duration, and owned is True.
+    """
+    uow = current()
+    if uow is not None:
+        yield uow.connection(connect_info), False
+        return
+    with connection_pool.get_pool(connect_info).connection() as cnx:
+        yield cnx, True
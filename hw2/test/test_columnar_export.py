@@ -0,0 +1,55 @@
+import decimal
+import io
+import unittest
+
+import numpy as np
+from pymysql.constants import FIELD_TYPE
+
+import src.data_service.columnar_export as columnar_export
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+# (name, type_code, None, length, length, scale, null_ok), as pymysql reports them. amount is DECIMAL(10,2).
+_description = (
+    ("id", FIELD_TYPE.LONGLONG, None, 20, 20, 0, False),
+    ("amount", FIELD_TYPE.NEWDECIMAL, None, 12, 12, 2, True),
+)
+
+
+class TestColumnarExport(unittest.TestCase):
+
+    @unittest.skipIf(pa is None, "pyarrow is not installed")
+    def test_decimal_type_comes_from_description(self):
+        batches = [
+            [(1, None), (2, decimal.Decimal("1.50"))],
+            [(18446744073709551615, decimal.Decimal("12345678.99"))],
+        ]
+        data = b"".join(columnar_export.export_batches(_description, batches, "arrow", {"id"}))
+        table = pa.ipc.open_stream(data).read_all()
+        self.assertEqual(table.schema.field("id").type, pa.uint64())
+        self.assertEqual(table.schema.field("amount").type, pa.decimal128(10, 2))
+        self.assertEqual(table.column("amount").to_pylist(),
+                         [None, decimal.Decimal("1.50"), decimal.Decimal("12345678.99")])
+
+    @unittest.skipIf(pa is None, "pyarrow is not installed")
+    def test_empty_result_keeps_declared_types(self):
+        data = b"".join(columnar_export.export_batches(_description, [], "arrow"))
+        table = pa.ipc.open_stream(data).read_all()
+        self.assertEqual(table.num_rows, 0)
+        self.assertEqual(table.schema.field("id").type, pa.int64())
+        self.assertEqual(table.schema.field("amount").type, pa.decimal128(10, 2))
+
+    def test_npz_unsigned_bigint(self):
+        batches = [[(18446744073709551615, decimal.Decimal("1.50"))]]
+        data = b"".join(columnar_export.export_batches(_description, batches, "npz", {"id"}))
+        arrays = np.load(io.BytesIO(data))
+        self.assertEqual(arrays["id"].dtype, np.uint64)
+        self.assertEqual(int(arrays["id"][0]), 18446744073709551615)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+from unittest import mock
+
+import src.data_service.RDBDataTable as RDBDataTable
+import src.data_service.result_cache as result_cache
+
+
+class _Catalog:
+
+    def validate_columns(self, db_name, table_name, names):
+        pass
+
+
+def _table():
+    t = RDBDataTable.RDBDataTable.__new__(RDBDataTable.RDBDataTable)
+    t._catalog = _Catalog()
+    t._db_name, t._table_name, t._full_table_name = "lahman2019raw", "people", "lahman2019raw.people"
+    t._connect_info = {"host": "localhost", "user": "dbuser", "password": "dbuserdbuser", "db": "lahman2019raw"}
+    return t
+
+
+class TestCountEstimate(unittest.TestCase):
+
+    def setUp(self):
+        p = mock.patch.object(RDBDataTable.RDBDataTable, "_count_cache", result_cache.ResultCache(max_bytes=1024 * 1024))
+        p.start()
+        self.addCleanup(p.stop)
+
+    def _count(self, explain, count=None):
+        statements = []
+
+        def run_q(sql, args=None, **kwargs):
+            statements.append(sql)
+            if sql.startswith("EXPLAIN "):
+                return 1, [explain]
+            return 1, [{"count": count}]
+
+        with mock.patch("src.data_service.dbutils.run_q", side_effect=run_q):
+            result = _table().count_by_template({"nameLast": "Williams"})
+        return result, statements
+
+    def test_large_scan_with_selective_filter_is_estimated(self):
+        # 5M rows examined, 0.1% expected to match: the estimate (5000) is small but COUNT(*) would still scan 5M.
+        result, statements = self._count({"rows": 5000000, "filtered": 0.1})
+        self.assertEqual(result, {"count": 5000, "estimated": True})
+        self.assertEqual(len(statements), 1)
+
+    def test_small_scan_is_counted(self):
+        result, statements = self._count({"rows": 2000, "filtered": 10.0}, count=187)
+        self.assertEqual(result, {"count": 187, "estimated": False})
+        self.assertEqual(len(statements), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()